@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BATCH - Many meal plans over the same catalog, solved in a pool of processes
+----------------------------------------------------------------------------
+
+Each problem is a dictionary with the keyword arguments of `optimize_mealplan`, i.e.
+'dietary_constraints' and optionally 'meals_limits', 'params', 'initial_solution' and
+'availability'. The catalog of meals is shared by every problem, so it's sent to each
+worker process once, when the worker starts, instead of being pickled along with every
+problem.
+
+A problem that takes longer than its timeout is recorded as a `TimeoutError`, and a
+problem that kills its worker process as a `BrokenProcessPool`. Either way the other
+problems are solved as usual.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import signal
+
+from data import meals
+from classes import compile_catalog
+from optimizing_meals import optimize_mealplan
+
+# The catalog of meals in a worker process, set by `_initialize_worker`
+_catalog = None
+
+# By default, a problem may take this much longer than its 'time_limit_secs', e.g. to
+# build the model
+TIMEOUT_GRACE_SECS = 30
+
+# =============================================================================
+# FUNCTIONS - Used to generate many meal plans
+# =============================================================================
+
+
+def optimize_mealplan_batch(meals, problems, *, max_workers=None, timeout_secs=None):
+    """
+    Optimize a meal plan for every problem, using up to `max_workers` processes.
+
+    Returns a list with one entry per problem, in the order the problems were given.
+    An entry is the tuple (x, results_data) returned by `optimize_mealplan`, or the
+    exception raised while solving that problem.
+
+    A problem gets at least `timeout_secs` of wall time, by default its
+    'time_limit_secs' parameter plus `TIMEOUT_GRACE_SECS`. A problem that is not done
+    by then is a `TimeoutError`, and its worker is stopped. Should a worker process
+    die, the problems that were not finished are solved again in a new pool. Should
+    that pool break too, the problems left are solved one at a time, so that only the
+    problem that caused it fails.
+    """
+    problems = list(problems)
+    meals = compile_catalog(meals)
+    results = [None for problem in problems]
+
+    # A pool stopped after a timeout is replaced at once, since the cause is known
+    pending, crashes = list(range(len(problems))), 0
+    while pending and crashes < 2:
+        pending, crashed = _solve_in_pool(
+            meals, problems, pending, results, max_workers, timeout_secs
+        )
+        crashes += crashed
+
+    # A worker died twice, and it's not known which problem caused it
+    for k in pending:
+        left, crashed = _solve_in_pool(meals, problems, [k], results, 1, timeout_secs)
+        if left:
+            results[k] = concurrent.futures.process.BrokenProcessPool(
+                f"The worker solving problem {k} died."
+            )
+
+    return results
+
+
+def _solve_in_pool(meals, problems, pending, results, max_workers, timeout_secs):
+    """
+    Solve the `pending` problems in a new pool, storing what was solved in `results`.
+    Returns the problems that were not finished, and True if a worker died.
+    """
+    # The workers send their process IDs, so that a stuck worker can be killed
+    context = multiprocessing.get_context()
+    workers = context.SimpleQueue()
+    pool = new_pool(meals, max_workers, mp_context=context, workers=workers)
+    futures = {k: pool.submit(solve_problem, problems[k]) for k in pending}
+    unfinished, crashed, stopped = [], False, False
+    try:
+        # The futures are done in order, so when problem k is waited for, every worker
+        # is solving it or a later problem
+        for k, future in futures.items():
+            try:
+                timeout = _timeout_secs(problems[k], timeout_secs)
+                results[k] = future.result(timeout=None if stopped else timeout)
+            except concurrent.futures.TimeoutError:
+                results[k] = TimeoutError(
+                    f"Problem {k} was not solved within {timeout} seconds."
+                )
+                _stop_workers(workers)
+                stopped = True
+            except concurrent.futures.process.BrokenProcessPool:
+                unfinished.append(k)
+                crashed = crashed or not stopped
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        workers.close()
+    return unfinished, crashed
+
+
+def _timeout_secs(problem, timeout_secs):
+    if timeout_secs is not None:
+        return timeout_secs
+    params = problem.get("params") or dict()
+    return params.get("time_limit_secs", 10) + TIMEOUT_GRACE_SECS
+
+
+def _stop_workers(workers):
+    """
+    Kill the workers that sent their process IDs to the queue `workers`, e.g. one
+    that is stuck. The executor has no public way to stop a running task, but it
+    notices a killed worker: the pool is then broken, and it stops the other workers.
+    """
+    kill = getattr(signal, "SIGKILL", signal.SIGTERM)
+    while not workers.empty():
+        try:
+            os.kill(workers.get(), kill)
+        except ProcessLookupError:
+            pass
+
+
+def new_pool(meals, max_workers, mp_context=None, *, workers=None):
+    """
+    Return a process pool whose workers share the catalog `meals`, for submitting
+    `solve_problem`. See `multiprocessing` for `mp_context`. If a queue `workers` of
+    that context is given, every worker puts its process ID in it when it starts.
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=mp_context,
+        initializer=_initialize_worker,
+        initargs=(meals, workers),
+    )
+
+
+def _initialize_worker(meals, workers=None):
+    """Compile the catalog once per worker process, unless it was compiled already."""
+    global _catalog
+    _catalog = compile_catalog(meals)
+    if workers is not None:
+        workers.put(os.getpid())
+
+
+def solve_problem(problem):
+    """Solve a single problem in a worker, returning an exception instead of raising."""
+    try:
+        return optimize_mealplan(meals=_catalog, **problem)
+    except Exception as exception:
+        return exception
+
+
+def test_batch():
+    """Example: Optimizing meals for several profiles, one of them invalid."""
+
+    meal_list = list(meals.values())
+    params = {"num_days": 1, "num_meals": 4}
+    problems = [
+        {"dietary_constraints": {"kcal": (kcal, kcal)}, "params": params}
+        for kcal in (1600, 1800, 2000)
+    ]
+    problems.insert(1, {"dietary_constraints": {"vitamin c": (1, 2)}})
+
+    results = optimize_mealplan_batch(meal_list, problems, max_workers=2)
+
+    assert len(results) == 4
+    assert isinstance(results[1], AssertionError)
+    for x, results_data in results[:1] + results[2:]:
+        assert len(x) == len(meal_list)
+
+    # The results are in the order of the problems
+    x, results_data = optimize_mealplan(meal_list, **problems[3])
+    assert results[3][1]["obj_func_value"] == results_data["obj_func_value"]
+
+
+def test_batch_failures():
+    """Example: A problem that kills its worker or times out doesn't stop the batch."""
+
+    import time
+
+    class Crash:
+        """Kills the worker process that unpickles it."""
+
+        def __reduce__(self):
+            return (os._exit, (1,))
+
+    class Hang:
+        """Keeps the worker process that unpickles it busy for an hour."""
+
+        def __reduce__(self):
+            return (time.sleep, (3600,))
+
+    meal_list = list(meals.values())
+    problem = {
+        "dietary_constraints": {"kcal": (1800, 1800)},
+        "params": {"num_days": 1, "num_meals": 4},
+    }
+    problems = [problem, dict(problem, crash=Crash()), problem, problem]
+    results = optimize_mealplan_batch(meal_list, problems, max_workers=2)
+    assert isinstance(results[1], concurrent.futures.process.BrokenProcessPool)
+    assert all(isinstance(results[k], tuple) for k in (0, 2, 3))
+
+    # A problem that never finishes times out, and its worker is killed
+    start_time = time.perf_counter()
+    problems = [problem, dict(problem, hang=Hang()), problem]
+    results = optimize_mealplan_batch(
+        meal_list, problems, max_workers=1, timeout_secs=5
+    )
+    assert isinstance(results[1], TimeoutError)
+    assert isinstance(results[0], tuple) and isinstance(results[2], tuple)
+    assert time.perf_counter() - start_time < 60
+
+
+if __name__ == "__main__":
+    test_batch()
+    test_batch_failures()
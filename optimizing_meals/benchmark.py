@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BENCHMARK - Build and solve times of the model on synthetic catalogs
+--------------------------------------------------------------------
+
+Catalogs of foods and meals are generated from a seed, so that the same instances are
+solved on every run. Each instance is built and solved in a fresh worker process, in
+which the peak memory (resident set size) is measured. The results are saved as JSON,
+along with the git commit, so that runs can be compared across commits:
+    1. $ python benchmark.py --suite small --output before.json
+    2. $ python benchmark.py --suite small --output after.json
+    3. $ python benchmark.py --compare before.json after.json
+The same comparison shows what `tighten_bounds` does to the node count and the solve
+time, by running the suite once more with `--loose-bounds`.
+
+Only the standard library, numpy and ortools are used, and nothing is downloaded.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import ortools
+
+from classes import MACROS, Food, Meal, compile_catalog
+from optimizing_meals import MealPlanModel
+
+# Instances as (number of meals, number of days, number of nutrients)
+SUITES = {
+    "small": [(10, 1, 2), (10, 7, 4), (50, 7, 4), (100, 14, 4)],
+    "medium": [(250, 7, 4), (500, 7, 4), (500, 28, 4), (1000, 30, 4)],
+    "large": [(1000, 90, 4), (2000, 90, 4), (5000, 30, 4), (1000, 365, 4)],
+    "nutrients": [(100, 365, 4), (100, 365, 40), (1000, 365, 40)],
+}
+
+# The nutrients that may be constrained, in the order they are added to an instance.
+# Beyond the macros, the foods have micronutrients, see `generate_catalog`.
+NUTRIENTS = MACROS + tuple(f"micronutrient {k}" for k in range(36))
+
+MEAL_TYPES = ("breakfast", "lunch", "dinner", "snack")
+
+# =============================================================================
+# FUNCTIONS - Used to generate instances
+# =============================================================================
+
+
+def generate_catalog(num_meals, *, seed=0, max_foods_per_meal=3, num_micronutrients=0):
+    """
+    Return a list of `num_meals` random meals, made of `num_meals` random foods. The
+    macros of a food add up to its kcal (within a few percent), and about half of the
+    meals are discrete. A food has each of the first `num_micronutrients` nutrients
+    after the macros in `NUTRIENTS` with probability one half. The same seed gives the
+    same meals.
+
+    Examples
+    --------
+    >>> meals = generate_catalog(20, seed=1)
+    >>> len(meals)
+    20
+    >>> meals == generate_catalog(20, seed=1)
+    True
+    """
+    rng = np.random.default_rng(seed)
+
+    # Grams of protein, fat and carbs in 100 grams of a food
+    macros = rng.dirichlet([1.0, 1.0, 1.5], size=num_meals) * rng.uniform(
+        10, 90, size=(num_meals, 1)
+    )
+    kcals = macros @ np.array([4, 9, 4]) * rng.uniform(0.97, 1.03, size=num_meals)
+    prices = rng.uniform(10, 120, size=num_meals)
+    grams = rng.choice([100, 200, 250, 400, 500, 1000], size=num_meals)
+
+    # Drawn from another generator, so that the rest of the catalog doesn't change
+    micronutrients = NUTRIENTS[len(MACROS) :][:num_micronutrients]
+    micro_rng = np.random.default_rng([seed, 1])
+    amounts = micro_rng.uniform(0, 20, size=(num_meals, len(micronutrients)))
+    amounts[micro_rng.random(amounts.shape) < 0.5] = 0
+
+    foods = [
+        Food(
+            name=f"food {i}",
+            protein=round(float(protein), 1),
+            fat=round(float(fat), 1),
+            carbs=round(float(carbs), 1),
+            kcal=round(float(kcal)),
+            price_per_product=round(float(price), 1),
+            grams_per_product=int(grams_per_product),
+            nutrients={
+                name: round(float(amount), 2)
+                for (name, amount) in zip(micronutrients, amounts[i])
+                if amount
+            },
+        )
+        for i, ((protein, fat, carbs), kcal, price, grams_per_product) in enumerate(
+            zip(macros, kcals, prices, grams)
+        )
+    ]
+
+    meals = []
+    for i in range(num_meals):
+        num_foods = rng.integers(1, max_foods_per_meal + 1)
+        chosen = rng.choice(num_meals, size=num_foods, replace=False)
+        quantities = rng.uniform(30, 250, size=num_foods).round()
+        meals.append(
+            Meal(
+                name=f"meal {i}",
+                foods={foods[j]: float(q) for (j, q) in zip(chosen, quantities)},
+                discrete=bool(rng.random() < 0.5),
+                type=MEAL_TYPES[rng.integers(len(MEAL_TYPES))],
+            )
+        )
+    return meals
+
+
+def generate_problem(num_meals, num_days, num_nutrients, *, seed=0):
+    """
+    Return the keyword arguments of `MealPlanModel` for an instance: the meals, the
+    dietary constraints on the first `num_nutrients` nutrients, and limits on the meals
+    that leave room for twice the number of meals needed, which couples the days. The
+    micronutrients have a lower bound that most days meet.
+
+    Examples
+    --------
+    >>> problem = generate_problem(10, 7, 2)
+    >>> problem["dietary_constraints"]
+    {'kcal': (1800, 2200), 'protein': (100, None)}
+    >>> problem["meals_limits"][0]
+    (None, 6)
+    >>> generate_problem(10, 7, 6)["dietary_constraints"]["micronutrient 1"]
+    (20, None)
+    """
+    targets = {
+        "kcal": (1800, 2200),
+        "protein": (100, None),
+        "fat": (50, 90),
+        "carbs": (None, 300),
+    }
+    targets.update({key: (20, None) for key in NUTRIENTS[len(MACROS) :]})
+    num_nutrients = min(max(num_nutrients, 1), len(NUTRIENTS))
+    num_meals_per_day = 4
+    most = max(1, math.ceil(2 * num_days * num_meals_per_day / num_meals))
+    return {
+        "meals": generate_catalog(
+            num_meals,
+            seed=seed,
+            num_micronutrients=max(num_nutrients - len(MACROS), 0),
+        ),
+        "dietary_constraints": {key: targets[key] for key in NUTRIENTS[:num_nutrients]},
+        "meals_limits": [(None, most) for i in range(num_meals)],
+        "params": {"num_days": num_days, "num_meals": num_meals_per_day},
+    }
+
+
+# =============================================================================
+# FUNCTIONS - Used to run the benchmarks
+# =============================================================================
+
+
+def run_benchmarks(instances, *, path=None, seed=0, params=None):
+    """
+    Build and solve every instance (num_meals, num_days, num_nutrients), each in a
+    new process. Returns a dictionary with the results, and saves it as JSON if a
+    `path` is given. The `params` are added to those of every instance, e.g. a
+    'time_limit_secs' or a 'backend'.
+    """
+    params = dict() if params is None else params
+    results = []
+    for num_meals, num_days, num_nutrients in instances:
+        context = multiprocessing.get_context("fork")
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+            future = pool.submit(
+                _run_instance, num_meals, num_days, num_nutrients, seed, params
+            )
+            try:
+                result = future.result()
+            except concurrent.futures.process.BrokenProcessPool as exception:
+                result = {"error": repr(exception)}
+        result = dict(
+            num_meals=num_meals,
+            num_days=num_days,
+            num_nutrients=num_nutrients,
+            seed=seed,
+            **result,
+        )
+        results.append(result)
+
+    benchmarks = {
+        "commit": _git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "ortools": ortools.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": params,
+        "results": results,
+    }
+    if path is not None:
+        with open(path, "w") as file:
+            json.dump(benchmarks, file, indent=2)
+    return benchmarks
+
+
+def _run_instance(num_meals, num_days, num_nutrients, seed, params):
+    """Build and solve an instance in a worker, measuring time and memory."""
+    problem = generate_problem(num_meals, num_days, num_nutrients, seed=seed)
+    problem["params"].update(params)
+
+    # Without tightening, a valid M2 gives the same optimum as the tightened model
+    if not problem["params"].get("tighten_bounds", True):
+        M1 = problem["params"].get("M1", 20)
+        M2 = float(compile_catalog(problem["meals"])["kcal"].max()) * M1
+        problem["params"].setdefault("M2", M2)
+
+    start_time = time.perf_counter()
+    try:
+        model = MealPlanModel(**problem)
+    except RuntimeError as exception:
+        return {"error": str(exception)}
+    build_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    try:
+        x, results_data = model.solve()
+    except RuntimeError as exception:
+        return {"build_time": round(build_time, 3), "error": str(exception)}
+    solve_time = time.perf_counter() - start_time
+
+    # On Linux, the peak resident set size is in kilobytes
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        "status": results_data["status"],
+        "build_time": round(build_time, 3),
+        "solve_time": round(solve_time, 3),
+        "peak_rss_mb": round(peak_rss, 1),
+        "num_variables": results_data["num_variables"],
+        "num_constraints": results_data["num_constraints"],
+        "num_nonzeros": results_data["num_nonzeros"],
+        "iterations": results_data["iterations"],
+        "nodes": results_data["nodes"],
+        "mip_gap": results_data["mip_gap"],
+        "obj_func_value": results_data["obj_func_value"],
+        "timings": results_data["timings"],
+        "backend": results_data["backend"],
+    }
+
+
+def _git_commit():
+    """Return the current git commit, or None outside of a git repository."""
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def compare_benchmarks(before, after):
+    """
+    Return a Markdown table comparing the results of two runs, given as dictionaries
+    or paths to JSON files. Instances are matched on their size and seed.
+    """
+    before, after = (_load(benchmarks) for benchmarks in (before, after))
+    keys = ("num_meals", "num_days", "num_nutrients", "seed")
+    old = {tuple(result[key] for key in keys): result for result in before["results"]}
+
+    fields = ("build_time", "solve_time", "nodes", "peak_rss_mb", "obj_func_value")
+    lines = [
+        f"Instance | {' | '.join(fields)}",
+        "|".join(["---"] * (len(fields) + 1)),
+    ]
+    for result in after["results"]:
+        instance = tuple(result[key] for key in keys)
+        previous = old.get(instance, dict())
+        cells = [
+            f"{previous.get(field, '-')} -> {result.get(field, '-')}"
+            for field in fields
+        ]
+        name = "{} meals, {} days, {} nutrients".format(*instance[:3])
+        lines.append(f"{name} | {' | '.join(cells)}")
+    return "\n".join(lines)
+
+
+def _load(benchmarks):
+    if isinstance(benchmarks, dict):
+        return benchmarks
+    with open(benchmarks) as file:
+        return json.load(file)
+
+
+def test_benchmark():
+    """Example: Benchmarking a small instance, and comparing two runs."""
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "benchmark.json")
+        benchmarks = run_benchmarks([(10, 2, 2)], path=path, params={"num_meals": 3})
+        with open(path) as file:
+            assert json.load(file) == benchmarks
+
+    (result,) = benchmarks["results"]
+    assert "error" not in result
+    assert result["build_time"] >= 0 and result["peak_rss_mb"] > 0
+    assert result["num_variables"] > 10 * 2 * 2
+
+    table = compare_benchmarks(benchmarks, benchmarks)
+    assert "10 meals, 2 days, 2 nutrients" in table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--suite", choices=list(SUITES), default="small")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time-limit", type=float, default=10)
+    parser.add_argument("--backend", default="CBC")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    parser.add_argument(
+        "--slots", action="store_true", help="A slot per day for each meal type"
+    )
+    parser.add_argument(
+        "--loose-bounds",
+        action="store_true",
+        help="Without the bounds and cuts of tighten_bounds, to compare with them",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        print(compare_benchmarks(*args.compare))
+    else:
+        params = {"time_limit_secs": args.time_limit, "backend": args.backend}
+        if args.slots:
+            params["slots"] = {meal_type: 1 for meal_type in MEAL_TYPES}
+        if args.loose_bounds:
+            params["tighten_bounds"] = False
+        benchmarks = run_benchmarks(
+            SUITES[args.suite], path=args.output, seed=args.seed, params=params
+        )
+        for result in benchmarks["results"]:
+            print(json.dumps(result))
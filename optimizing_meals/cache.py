@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CACHE - Solutions of meal planning problems, stored by the contents of the problem
+----------------------------------------------------------------------------------
+
+A problem is identified by a hash of its contents: the compiled catalog (the names and
+types of the meals, and the attributes and portion types, which are computed from the
+foods), the dietary constraints, the limits on the meals, the parameters, the initial
+solution and the availability of the meals. Problems with equal contents have the same
+key, even if they are made of different `Meal` and `Food` objects. Solutions are kept
+in memory, with the least recently used evicted first, and optionally in a directory
+on disk, with the oldest files evicted first when the directory grows beyond
+`max_bytes`. A directory may be shared by several processes, e.g. the workers of
+`batch.py`: the files they write count towards `max_bytes`, and files removed by
+another process are skipped.
+
+The cache is used by passing it to `optimize_mealplan` as `params["cache"]`, which
+reports `results_data["cache_hit"]`.
+"""
+
+import collections
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from classes import compile_catalog
+
+# Parameters that don't change the solution, and are left out of the key
+UNHASHED_PARAMS = ("cache", "profiler", "incumbent_callback", "output")
+
+# Part of every key, so that solutions from older versions of the model are not used
+KEY_VERSION = 3
+
+
+class SolutionCache:
+    """
+    A cache of solutions (x, results_data), keyed by `problem_key`. Up to `maxsize`
+    solutions are kept in memory. If a `directory` is given, solutions are also stored
+    there as JSON files, using at most `max_bytes` in total.
+
+    Examples
+    --------
+    >>> cache = SolutionCache(maxsize=1)
+    >>> cache.put("a", [[1.0]], {"status": "OPTIMAL"})
+    >>> cache.get("a")
+    ([[1.0]], {'status': 'OPTIMAL'})
+    >>> cache.put("b", [[2.0]], {"status": "OPTIMAL"})
+    >>> cache.get("a") is None
+    True
+    >>> cache.hits, cache.misses
+    (1, 1)
+    """
+
+    def __init__(self, maxsize=128, *, directory=None, max_bytes=2**30):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        self._directory_mtime = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._count()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def get(self, key):
+        """Return a copy of the solution stored under `key`, or None if there is none."""
+        with self._lock:
+            solution = self._memory.get(key, None)
+            if solution is not None:
+                self._memory.move_to_end(key)
+            elif self.directory is not None:
+                solution = self._read(key)
+                if solution is not None:
+                    self._remember(key, solution)
+            if solution is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return copy.deepcopy(solution)
+
+    def put(self, key, x, results_data):
+        """Store a solution under `key`, in memory and on disk."""
+        solution = copy.deepcopy((x, results_data))
+        with self._lock:
+            self._remember(key, solution)
+            if self.directory is not None:
+                self._write(key, solution)
+
+    def clear(self):
+        """Remove every solution, in memory and on disk."""
+        with self._lock:
+            self._memory.clear()
+            for _, _, path in self._files():
+                _remove(path)
+            if self.directory is not None:
+                self._count()
+
+    def _remember(self, key, solution):
+        self._memory[key] = solution
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _files(self):
+        """Return (modification time, size, path) of every file, oldest first."""
+        if self.directory is None:
+            return []
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return sorted(files)
+
+    def _count(self):
+        """Count the size of the directory, and note when it was last modified."""
+        self._directory_mtime = os.stat(self.directory).st_mtime_ns
+        self._disk_bytes = sum(size for (_, size, _) in self._files())
+
+    def _read(self, key):
+        try:
+            with open(self._path(key)) as file:
+                x, results_data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(self._path(key))  # Marks the file as recently used
+        except FileNotFoundError:
+            pass
+        return x, results_data
+
+    def _write(self, key, solution):
+        # The size of the directory is kept as a running total, and the directory is
+        # only listed when it's too large, or when another process has written to it
+        # or removed files from it since this cache last did
+        if os.stat(self.directory).st_mtime_ns != self._directory_mtime:
+            self._count()
+
+        # Written to a temporary file first, so that a file is never read half-written.
+        # A file that is replaced no longer counts towards the total.
+        data = json.dumps(solution).encode()
+        path = self._path(key)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        file, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(file, "wb") as file:
+            file.write(data)
+        os.replace(temporary_path, path)
+        self._disk_bytes += len(data) - replaced
+
+        # The least recently used files are evicted until the directory fits in 3/4 of
+        # max_bytes, so that it's not listed on the next put
+        if self._disk_bytes > self.max_bytes:
+            files = self._files()
+            total = sum(size for (_, size, _) in files)
+            for _, size, path in files:
+                if total <= self.max_bytes * 3 // 4:
+                    break
+                _remove(path)
+                total -= size
+            self._disk_bytes = total
+        self._directory_mtime = os.stat(self.directory).st_mtime_ns
+
+
+def _remove(path):
+    """Remove a file, unless another process already did."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def problem_key(
+    meals,
+    dietary_constraints,
+    *,
+    meals_limits=None,
+    params=None,
+    initial_solution=None,
+    availability=None,
+):
+    """
+    Return a hash (hex string) of the contents of a problem. The arguments are those of
+    `optimize_mealplan`. Parameters in `UNHASHED_PARAMS` are left out.
+
+    Examples
+    --------
+    >>> from data import meals
+    >>> meal_list = list(meals.values())
+    >>> key = problem_key(meal_list, {"kcal": (1800, 1800)}, params={"num_days": 2})
+    >>> key == problem_key(meal_list, {"kcal": (1800, 1800)},
+    ...                    params={"num_days": 2, "profiler": print})
+    True
+    >>> key == problem_key(meal_list, {"kcal": (1800, 1800)}, params={"num_days": 3})
+    False
+    """
+    catalog = compile_catalog(meals)
+    params = dict() if params is None else params
+    params = {k: v for (k, v) in params.items() if k not in UNHASHED_PARAMS}
+
+    digest = hashlib.sha256()
+    digest.update("\0".join(catalog.attributes).encode())
+    digest.update(np.ascontiguousarray(catalog.matrix, dtype=np.float64).tobytes())
+    digest.update(np.asarray(catalog.discrete, dtype=bool).tobytes())
+    digest.update("\0".join(map(str, catalog.names)).encode())
+    digest.update("\0".join(map(str, catalog.types)).encode())
+    if availability is not None:
+        availability = np.asarray(availability, dtype=bool)
+        digest.update(str(availability.shape).encode() + availability.tobytes())
+
+    if initial_solution is not None:
+        initial_solution = np.asarray(initial_solution, dtype=float).tolist()
+    problem = [
+        KEY_VERSION,
+        sorted(dietary_constraints.items()),
+        meals_limits,
+        sorted(params.items()),
+        initial_solution,
+    ]
+    digest.update(json.dumps(problem, default=repr).encode())
+    return digest.hexdigest()
+
+
+def test_cache():
+    """Example: A repeated problem is returned from the cache, also from disk."""
+
+    from data import meals
+    from optimizing_meals import optimize_mealplan
+
+    meal_list = list(meals.values())
+    dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+
+    with tempfile.TemporaryDirectory() as directory:
+        params = {"num_days": 2, "cache": SolutionCache(directory=directory)}
+        x, results_data = optimize_mealplan(
+            meal_list, dietary_constraints, params=params
+        )
+        assert not results_data["cache_hit"]
+
+        # Equal meals that are different objects give the same key
+        meal_copies = [copy.deepcopy(meal) for meal in meal_list]
+        x_hit, results_hit = optimize_mealplan(
+            meal_copies, dietary_constraints, params=params
+        )
+        assert results_hit["cache_hit"] and x_hit == x
+        assert results_hit["obj_func_value"] == results_data["obj_func_value"]
+
+        # A new cache on the same directory reads the solution from disk
+        params["cache"] = SolutionCache(directory=directory)
+        x_disk, results_disk = optimize_mealplan(
+            meal_list, dietary_constraints, params=params
+        )
+        assert results_disk["cache_hit"] and x_disk == x
+
+        # Files are evicted when the directory is too large
+        cache = SolutionCache(maxsize=0, directory=directory, max_bytes=0)
+        cache.put("key", x, results_data)
+        assert cache.get("key") is None and not os.listdir(directory)
+
+
+def test_shared_directory():
+    """Example: Caches in several processes share a directory, and evict its files."""
+
+    solution = ([[1.0]], {"status": "OPTIMAL"})
+    size = len(json.dumps(solution).encode())
+
+    def directory_bytes(directory):
+        return sum(os.path.getsize(entry.path) for entry in os.scandir(directory))
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Together the caches keep the directory within max_bytes
+        max_bytes = 10 * size
+        caches = [SolutionCache(directory=directory, max_bytes=max_bytes) for _ in "ab"]
+        for i in range(50):
+            caches[i % 2].put(f"key {i}", *solution)
+            assert directory_bytes(directory) <= max_bytes
+
+        # A file that is replaced is not counted twice, so nothing is evicted
+        caches[0].clear()
+        caches[0].put("a", *solution)
+        for i in range(50):
+            caches[1].put("b", *solution)
+        assert sorted(os.listdir(directory)) == ["a.json", "b.json"]
+
+        # Files removed by another cache are no longer counted
+        caches[0].max_bytes = caches[1].max_bytes = 2 * size
+        caches[1].clear()
+        caches[0].put("c", *solution)
+        caches[0].put("d", *solution)
+        assert sorted(os.listdir(directory)) == ["c.json", "d.json"]
+
+
+if __name__ == "__main__":
+    test_cache()
+    test_shared_directory()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CANDIDATES - Meal plans over a large catalog, solved over a few candidate meals
+-------------------------------------------------------------------------------
+
+Only `num_meals` meals are chosen per day, but every meal in the catalog adds a set of
+x and z variables per day to the model. For catalogs with thousands of meals, the model
+is solved in two stages here:
+    1. The LP relaxation of an average day is solved, where the limits on the meals
+       are spread evenly over the days. The meals are ranked by their values in it,
+       then by their reduced costs. Candidates are taken from the top of the ranking,
+       until the LP restricted to the candidates is (almost) as good as the full LP.
+    2. The meal plan is optimized over the candidates only, and mapped back to every
+       meal. If no plan is found, the number of candidates is doubled. The number of
+       candidates is also doubled if the plan is far from the LP bound, as long as
+       that improves the plan.
+The LP of a single day is small, so the solve time depends little on the catalog size.
+The days are interchangeable, so the LP of an average day ranks the meals for every
+day, and every day has the same candidates.
+"""
+
+import numpy as np
+
+from data import meals
+from classes import compile_catalog
+from plans import as_array, format_plan
+from optimizing_meals import MealPlanModel, evaluate_mealplan, optimize_mealplan
+
+# =============================================================================
+# FUNCTIONS - Used to generate the meal plan
+# =============================================================================
+
+
+def optimize_mealplan_candidates(
+    meals,
+    dietary_constraints,
+    *,
+    meals_limits=None,
+    params=None,
+    num_candidates=40,
+    lp_tolerance=1e-3,
+    mip_tolerance=0.05,
+):
+    """
+    Optimize a meal plan over `num_candidates` candidate meals, or more if needed, see
+    the module docstring. Returns (x, results_data) like `optimize_mealplan`, where
+    `x` has a row for every meal. The candidates are expanded until the LP over them is
+    within `lp_tolerance` (relative) of the full LP. They are expanded further while a
+    plan proven optimal over them is more than `mip_tolerance` (relative) above the LP
+    bound, and doubling them improves the plan by more than `mip_tolerance`.
+    `results_data` also reports the number of candidates used, the objective function
+    value of the LP and the gap between the two ('lp_gap').
+    """
+    params = dict() if params is None else params
+    catalog = compile_catalog(meals)
+    num_days = params.get("num_days", 1)
+
+    if meals_limits is None:
+        meals_limits = [(None, None)] * len(catalog)
+    assert len(meals_limits) == len(catalog)
+    forced = np.array([low is not None and low > 0 for (low, _) in meals_limits])
+
+    # =========================================================================
+    #     STAGE 1: RANK THE MEALS BY THE LP RELAXATION OF AN AVERAGE DAY
+    # =========================================================================
+
+    # The kcal range is left out, since its big-M terms make the LP relaxation weak
+    lp_params = dict(params, num_days=1, backend="GLOP", weight_range=0)
+    lp = MealPlanModel(catalog, dietary_constraints, params=lp_params)
+    z_bounds = [
+        (0 if low is None else low / num_days, 1 if high is None else high / num_days)
+        for (low, high) in meals_limits
+    ]
+    for variable, (low, high) in zip(lp.z[:, 0], z_bounds):
+        variable.SetBounds(min(low, 1), min(high, 1))
+
+    lp_value = _solve_lp(lp)
+    if lp_value == np.inf:
+        raise RuntimeError("Infeasible problem.")
+    z_values = np.array([variable.solution_value() for variable in lp.z[:, 0]])
+    reduced_costs = np.array([variable.reduced_cost() for variable in lp.z[:, 0]])
+    ranking = np.lexsort((reduced_costs, -z_values.round(9)))
+
+    # Take candidates until the LP over them is about as good as the full LP
+    tolerance = lp_tolerance * max(abs(lp_value), 1)
+    num_candidates = min(num_candidates, len(catalog))
+    while True:
+        candidates = _candidates(ranking, num_candidates, forced)
+        excluded = np.setdiff1d(np.arange(len(catalog)), candidates)
+        for i in excluded:
+            lp.z[i, 0].SetBounds(0, 0)
+        restricted_value = _solve_lp(lp)
+        for i in excluded:
+            lp.z[i, 0].SetBounds(*z_bounds[i])
+        if restricted_value <= lp_value + tolerance or len(excluded) == 0:
+            break
+        num_candidates = min(2 * num_candidates, len(catalog))
+
+    # =========================================================================
+    #     STAGE 2: OPTIMIZE THE MEAL PLAN OVER THE CANDIDATES
+    # =========================================================================
+
+    # The LP of an average day is a lower bound on the objective function without the
+    # kcal range term. A gap that remains when more candidates don't help is due to
+    # the integer variables, not to the candidates.
+    no_range = dict(params, weight_range=0)
+    best = None
+    while True:
+        candidate_meals = catalog.subset(candidates)
+        try:
+            x, results_data = optimize_mealplan(
+                candidate_meals,
+                dietary_constraints,
+                meals_limits=[meals_limits[i] for i in candidates],
+                params=params,
+            )
+        except RuntimeError:
+            # The limits may not be met by the candidates alone
+            if len(candidates) == len(catalog):
+                raise
+            x = None
+
+        done = False
+        if x is not None:
+            value = evaluate_mealplan(
+                x, candidate_meals, dietary_constraints, params=no_range
+            )
+            # The better plan is kept, but only a large improvement is worth expanding
+            improved = best is None or value < best[0] - mip_tolerance * abs(best[0])
+            if best is None or value < best[0]:
+                best = (value, x, results_data, candidates)
+            gap = (value - lp_value) / max(abs(lp_value), 1e-9)
+            optimal = results_data["status"] == "OPTIMAL"
+            done = gap <= mip_tolerance or not improved or not optimal
+        if done or len(candidates) == len(catalog):
+            break
+        num_candidates = min(2 * num_candidates, len(catalog))
+        candidates = _candidates(ranking, num_candidates, forced)
+
+    if best is not None:
+        value, x, results_data, candidates = best
+        results_data["lp_gap"] = round((value - lp_value) / max(abs(lp_value), 1e-9), 6)
+    results_data["num_candidates"] = len(candidates)
+    results_data["lp_obj_func_value"] = round(lp_value, 6)
+    if x is None:
+        return x, results_data
+    x_full = np.zeros((len(catalog), num_days))
+    x_full[candidates] = as_array(x)
+    return format_plan(x_full, params.get("output", "list")), results_data
+
+
+def _candidates(ranking, num_candidates, forced):
+    """The first meals of the ranking, and the meals forced by a lower limit."""
+    return np.union1d(ranking[:num_candidates], np.flatnonzero(forced))
+
+
+def _solve_lp(model):
+    """
+    Solve the LP relaxation of a model built with the GLOP backend, returning the
+    objective function value, or infinity if it's infeasible.
+    """
+    solver = model.solver
+    result_status = solver.Solve()
+    if result_status == solver.INFEASIBLE:
+        return np.inf
+    if result_status != solver.OPTIMAL:
+        raise RuntimeError(f"The LP relaxation failed with status {result_status}.")
+    return solver.Objective().Value()
+
+
+def test_candidates():
+    """Example: Optimizing meals over a few candidates of a larger catalog."""
+
+    params = {"num_days": 2, "num_meals": 4}
+    dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    meal_list = list(meals.values())
+    meals_limits = [(None, 2)] + [(None, 1) for meal in meal_list[1:]]
+
+    x, results_data = optimize_mealplan_candidates(
+        meal_list,
+        dietary_constraints,
+        meals_limits=meals_limits,
+        params=params,
+        num_candidates=5,
+    )
+    x = np.array(x)
+    assert x.shape == (len(meal_list), 2)
+    assert np.all((x > 0).sum(axis=0) == 4)
+
+    # The limits require 8 meals, so every meal is a candidate
+    assert results_data["num_candidates"] == len(meal_list)
+    assert results_data["status"] in ("OPTIMAL", "FEASIBLE")
+
+    # The LP of an average day is a lower bound, without the kcal range term
+    assert results_data["lp_gap"] >= -1e-6
+
+
+if __name__ == "__main__":
+    test_candidates()
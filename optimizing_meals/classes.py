@@ -5,18 +5,165 @@ Data classes for optimizing meals.
 """
 import dataclasses
 import collections
+import collections.abc
+import functools
+import threading
 import warnings
-import typing
+
+import numpy as np
+
+# The macros that every food has. Any other nutrient is stored in `nutrient_table`.
+MACROS = ("kcal", "protein", "fat", "carbs")
 
 # =============================================================================
 # CLASSES - Used to store data and ease computations in hierarchical data
 # =============================================================================
 
 
-@dataclasses.dataclass(frozen=True)
-class Food:
+class _Frozen:
+    """
+    Base class for compact, immutable objects. Subclasses list their constructor
+    arguments in `_fields`, and store them (and anything derived from them) in slots.
+    Equality, hashing, repr and pickling are defined in terms of `_fields`.
+    """
+
+    __slots__ = ("_hash",)
+    _fields = ()
+
+    def _astuple(self):
+        return tuple(getattr(self, field) for field in self._fields)
+
+    def __setattr__(self, key, value):
+        raise dataclasses.FrozenInstanceError(f"cannot assign to field '{key}'")
+
+    def __delattr__(self, key):
+        raise dataclasses.FrozenInstanceError(f"cannot delete field '{key}'")
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._astuple() == other._astuple()
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (type(self), self._astuple())
+
+    def __repr__(self):
+        arguments = ", ".join(f"{key}={getattr(self, key)!r}" for key in self._fields)
+        return f"{type(self).__name__}({arguments})"
+
+
+class NutrientTable:
+    """
+    The nutrients of foods beyond the `MACROS`, per 100 grams, in a single (rows x
+    nutrients) array shared by every `Food`. A food stores its row, and foods with the
+    same nutrients share a row, e.g. every food without any shares row 0, so the table
+    only grows with the distinct foods. A nutrient that is seen for the first time gets
+    a new column. Missing values are 0.
+
+    Examples
+    --------
+    >>> table = NutrientTable()
+    >>> table.add({"fiber": 2.5}), table.add({"sodium": 0.4, "fiber": 1.0})
+    (1, 2)
+    >>> table.add({}), table.add({"fiber": 2.5, "sodium": 0})
+    (0, 1)
+    >>> table.names
+    ('fiber', 'sodium')
+    >>> table.values
+    array([[0. , 0. ],
+           [2.5, 0. ],
+           [1. , 0.4]])
+    >>> table.select([2, 1])
+    (('fiber', 'sodium'), array([[1. , 0.4],
+           [2.5, 0. ]]))
+    """
+
+    def __init__(self):
+        self.index = dict()
+        self._rows = {frozenset(): 0}
+        self._values = np.zeros((64, 8))
+        self._lock = threading.Lock()
+
+    @property
+    def names(self):
+        return tuple(self.index)
+
+    @property
+    def values(self):
+        """The (rows x nutrients) array of every row so far."""
+        with self._lock:
+            return self._values[: len(self._rows), : len(self.index)]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def add(self, nutrients):
+        """
+        Return the row with the nutrients of a food, a mapping name -> value, adding
+        it if it's new.
+        """
+        nutrients = {name: float(value) for (name, value) in nutrients.items() if value}
+        key = frozenset(nutrients.items())
+        with self._lock:
+            if key in self._rows:
+                return self._rows[key]
+
+            # The array is grown before the new columns are published in the index
+            new = [name for name in dict.fromkeys(nutrients) if name not in self.index]
+            rows, columns = self._values.shape
+            if len(self.index) + len(new) > columns:
+                width = max(columns, len(new))
+                self._values = np.pad(self._values, ((0, 0), (0, width)))
+            if len(self._rows) == rows:
+                self._values = np.pad(self._values, ((0, rows), (0, 0)))
+            for name in new:
+                self.index[name] = len(self.index)
+
+            row = len(self._rows)
+            columns = [self.index[name] for name in nutrients]
+            self._values[row, columns] = list(nutrients.values())
+            self._rows[key] = row
+            return row
+
+    def get(self, row, name):
+        """Return the value of a nutrient in a row."""
+        with self._lock:
+            return float(self._values[row, self.index[name]])
+
+    def row(self, row):
+        """Return the non-zero nutrients in a row, as a dictionary."""
+        with self._lock:
+            values = self._values[row, : len(self.index)].tolist()
+            return {name: value for (name, value) in zip(self.index, values) if value}
+
+    def select(self, rows):
+        """
+        Return the nutrients that are non-zero in any of the `rows`, sorted by name,
+        and the (rows x nutrients) array of their values.
+        """
+        with self._lock:
+            values = self._values[np.asarray(rows, dtype=int), : len(self.index)]
+            names = sorted(
+                name for (name, column) in self.index.items() if values[:, column].any()
+            )
+            columns = [self.index[name] for name in names]
+            return tuple(names), values[:, columns]
+
+
+nutrient_table = NutrientTable()
+
+
+class Food(_Frozen):
     """
-    A food consists of a name and nutritional data given in units of 100 grams.
+    A food consists of a name and nutritional data given in units of 100 grams. Other
+    nutrients than the macros are given as a mapping `nutrients`, e.g. {"fiber": 2.1},
+    stored in the shared `nutrient_table` and read as attributes.
     
     Examples
     --------
@@ -26,25 +173,67 @@ class Food:
     4.768115942028985
     >>> eggs.name
     'eggs'
+    >>> oats = Food(name='oats', protein=13.5, fat=7.0, carbs=58.7, kcal=372,
+    ...             price_per_product=17.9, grams_per_product=1000,
+    ...             nutrients={"fiber": 10.1})
+    >>> oats.fiber, oats.nutrients
+    (10.1, {'fiber': 10.1})
     """
 
-    name: str
-
-    # Values are per 100 grams of food
-    protein: float
-    fat: float
-    carbs: float
-    kcal: float
+    __slots__ = (
+        "name",
+        # Values are per 100 grams of food
+        "protein",
+        "fat",
+        "carbs",
+        "kcal",
+        # Used to infer the price per 100 grams
+        "price_per_product",
+        "grams_per_product",
+        "price",
+        # The row of the other nutrients in `nutrient_table`
+        "_row",
+    )
+    _fields = __slots__[:-2] + ("nutrients",)
 
-    # Used to infer the price per 100 grams
-    price_per_product: float
-    grams_per_product: float
+    def __init__(
+        self,
+        name,
+        protein,
+        fat,
+        carbs,
+        kcal,
+        price_per_product,
+        grams_per_product,
+        nutrients=None,
+    ):
+        nutrients = dict() if nutrients is None else nutrients
+        set_attribute = object.__setattr__
+        set_attribute(self, "name", name)
+        set_attribute(self, "protein", protein)
+        set_attribute(self, "fat", fat)
+        set_attribute(self, "carbs", carbs)
+        set_attribute(self, "kcal", kcal)
+        set_attribute(self, "price_per_product", price_per_product)
+        set_attribute(self, "grams_per_product", grams_per_product)
+        set_attribute(self, "price", price_per_product / grams_per_product * 100)
+        set_attribute(self, "_row", nutrient_table.add(nutrients))
+        nutrients = frozenset(nutrient_table.row(self._row).items())
+        set_attribute(self, "_hash", hash(self._astuple()[:-1] + (nutrients,)))
+        self._verify_kcal()
 
     @property
-    def price(self):
-        return self.price_per_product / self.grams_per_product * 100
+    def nutrients(self):
+        """The nutrients of the food that are not macros, as a dictionary."""
+        return nutrient_table.row(self._row)
 
-    def __post_init__(self):
+    def __getattr__(self, key):
+        """Allow accessing the nutrients in `nutrient_table` as attributes."""
+        if key.startswith("_") or key not in nutrient_table:
+            raise AttributeError(key)
+        return nutrient_table.get(self._row, key)
+
+    def _verify_kcal(self):
         """Verify the relationship between macros and kcal."""
         computed_kcal = 4 * self.protein + 4 * self.carbs + 9 * self.fat
         relative_error = abs((self.kcal - computed_kcal) / computed_kcal)
@@ -52,8 +241,7 @@ class Food:
             warnings.warn(f"Got a {relative_error:.2f} error on kcal: '{self.name}'.")
 
 
-@dataclasses.dataclass(frozen=True)
-class Meal:
+class Meal(_Frozen):
     """
     A meal consists of several foods given at some "base" unit of grams. In the example
     below 'eggs' is the general food, an a meal consists of discrete units of eggs,
@@ -66,35 +254,55 @@ class Meal:
     >>> egg = Meal(name='egg', foods={eggs:65}, discrete=True)
     >>> egg.price # price of the meal
     3.0992753623188407
+    >>> egg.grams
+    65
+    >>> egg.protein == sum(food.protein * qnty / 100 for food, qnty in egg.foods.items())
+    True
     """
 
-    # Foods are added as: foods={all_foods["lettmelk"]:100, all_foods["musli"]:100}
-    # This means that a baseline
-    name: str
-    foods: typing.Dict[Food, float] = dataclasses.field(default_factory=dict)
-    discrete: bool = True
-    type: str = None
+    # The sums over foods are computed once, at construction. The `foods` dictionary
+    # must therefore not be modified after the meal has been created.
+    _aggregates = ("kcal", "protein", "fat", "carbs", "price")
 
-    def __getattr__(self, key):
-        """Allow accessing attributes of foods, summing over them."""
+    __slots__ = ("name", "foods", "discrete", "type", "grams") + _aggregates
+    _fields = ("name", "foods", "discrete", "type")
+
+    def __init__(self, name, foods=None, discrete=True, type=None):
+        # Foods are added as: foods={all_foods["lettmelk"]:100, all_foods["musli"]:100}
+        # This means that a baseline
+        foods = dict() if foods is None else foods
+
+        set_attribute = object.__setattr__
+        set_attribute(self, "name", name)
+        set_attribute(self, "foods", foods)
+        set_attribute(self, "discrete", discrete)
+        set_attribute(self, "type", type)
+        set_attribute(self, "grams", int(sum(foods.values())))
+        set_attribute(self, "_hash", hash(name) + hash(frozenset(foods.keys())))
+        for key in self._aggregates:
+            set_attribute(self, key, self._sum_over_foods(key))
+
+    def _sum_over_foods(self, key):
         return sum(
             getattr(food, key) * quantity / 100
             for (food, quantity) in self.foods.items()
         )
 
-    @property
-    def grams(self):
-        return int(sum(self.foods.values()))
-
-    def __hash__(self):
-        return hash(self.name) + hash(frozenset(self.foods.keys()))
+    def __getattr__(self, key):
+        """Allow accessing attributes of foods, summing over them."""
+        if key.startswith("_") or key in self.__slots__:
+            raise AttributeError(key)
+        return self._sum_over_foods(key)
 
     def __iter__(self):
         return iter(self.foods.keys())
 
     def __copy__(self):
         return type(self)(
-            name=self.name, foods=self.foods.copy(), discrete=self.discrete
+            name=self.name,
+            foods=self.foods.copy(),
+            discrete=self.discrete,
+            type=self.type,
         )
 
     def __str__(self):
@@ -115,6 +323,156 @@ class Day(collections.UserList):
         return sum(getattr(meal, key) for meal in self.data)
 
 
+class Catalog:
+    """
+    A compiled catalog of meals. The attributes of every meal are computed once and
+    stored in a (meals x attributes) float array, so that the optimizer can read
+    coefficients from it instead of summing over foods on every access. The attributes
+    are those in `Catalog.attributes`, followed by the other nutrients of the foods in
+    the meals, sorted by name and summed over the foods with array operations.
+
+    A catalog may also be created from arrays, see `Catalog.from_arrays`. Then `meals`
+    may be any sequence, e.g. one that creates the meals on demand.
+
+    Examples
+    --------
+    >>> eggs = Food(name='eggs', protein=13.0, fat=10.6, carbs=0.3, kcal=149,
+    ...             price_per_product=32.9, grams_per_product=690)
+    >>> catalog = Catalog([Meal(name='egg', foods={eggs:65}, discrete=True)])
+    >>> catalog.matrix.shape
+    (1, 5)
+    >>> catalog["price"]
+    array([3.09927536])
+    >>> compile_catalog(list(catalog)) is compile_catalog(list(catalog))
+    True
+    """
+
+    attributes = ("kcal", "protein", "fat", "carbs", "price")
+
+    def __init__(self, meals):
+        self.meals = tuple(meals)
+        matrix = np.array(
+            [[getattr(meal, attr) for attr in self.attributes] for meal in self.meals],
+            dtype=float,
+        ).reshape(len(self.meals), len(self.attributes))
+
+        # The other nutrients of the foods are summed over their rows in `nutrient_table`
+        recipes = [
+            (i, food._row, quantity)
+            for i, meal in enumerate(self.meals)
+            for (food, quantity) in meal.foods.items()
+        ]
+        meal_rows, food_rows, grams = np.array(recipes, dtype=float).reshape(-1, 3).T
+        names, values = nutrient_table.select(food_rows.astype(int))
+        nutrients = np.zeros((len(self.meals), len(names)))
+        np.add.at(nutrients, meal_rows.astype(int), values * grams[:, None] / 100)
+        self.attributes = self.attributes + names
+        self.matrix = np.column_stack([matrix, nutrients])
+        self.discrete = np.array([meal.discrete for meal in self.meals], dtype=bool)
+        self.names = np.array([meal.name for meal in self.meals], dtype=object)
+        self.types = np.array([meal.type for meal in self.meals], dtype=object)
+
+        # The catalog is shared through the cache, so it must not be modified
+        self.matrix.flags.writeable = False
+        self.discrete.flags.writeable = False
+
+    @classmethod
+    def from_arrays(cls, meals, matrix, discrete, names, types=None, attributes=None):
+        """
+        Create a catalog from a (meals x attributes) array, with the attributes in the
+        order of `attributes` (by default `Catalog.attributes`), a boolean array, an
+        array of names and optionally an array of meal types. The arrays may be
+        memory-mapped, and are not copied.
+        """
+        catalog = cls.__new__(cls)
+        catalog.meals = meals
+        catalog.attributes = cls.attributes if attributes is None else tuple(attributes)
+        catalog.matrix = np.asarray(matrix, dtype=float)
+        catalog.discrete = np.asarray(discrete, dtype=bool)
+        catalog.names = np.asarray(names, dtype=object)
+        types = [None] * len(meals) if types is None else types
+        catalog.types = np.asarray(types, dtype=object)
+        assert catalog.matrix.shape == (len(meals), len(catalog.attributes))
+        assert len(catalog.discrete) == len(catalog.names) == len(meals)
+        assert len(catalog.types) == len(meals)
+        catalog.matrix.flags.writeable = False
+        catalog.discrete.flags.writeable = False
+        return catalog
+
+    def subset(self, indices):
+        """
+        Return a catalog of the meals at `indices`, with rows sliced from the arrays of
+        this catalog. The meals are not accessed, so a lazy sequence of meals (see
+        loader.py) creates none of them.
+
+        Examples
+        --------
+        >>> eggs = Food(name='eggs', protein=13.0, fat=10.6, carbs=0.3, kcal=149,
+        ...             price_per_product=32.9, grams_per_product=690)
+        >>> catalog = Catalog([Meal(name=f'{n} eggs', foods={eggs: 65 * n})
+        ...                    for n in (1, 2, 3)])
+        >>> subset = catalog.subset([2, 0])
+        >>> list(subset.names), subset["kcal"].round(1)
+        (['3 eggs', '1 eggs'], array([290.6,  96.8]))
+        """
+        indices = np.asarray(indices, dtype=int)
+        if isinstance(self.meals, (list, tuple)):
+            meals = [self.meals[i] for i in indices.tolist()]
+        else:
+            meals = _SubsetSequence(self.meals, indices)
+        return Catalog.from_arrays(
+            meals,
+            self.matrix[indices],
+            self.discrete[indices],
+            self.names[indices],
+            self.types[indices],
+            attributes=self.attributes,
+        )
+
+    @property
+    def nutrients(self):
+        """The attributes that may be constrained, i.e. every attribute but the price."""
+        return tuple(attr for attr in self.attributes if attr != "price")
+
+    def __getitem__(self, attribute):
+        """Return the column of an attribute, e.g. catalog['kcal']."""
+        return self.matrix[:, self.attributes.index(attribute)]
+
+    def __len__(self):
+        return len(self.meals)
+
+    def __iter__(self):
+        return iter(self.meals)
+
+
+class _SubsetSequence(collections.abc.Sequence):
+    """The items of a sequence at some indices, accessed on demand."""
+
+    def __init__(self, sequence, indices):
+        self.sequence = sequence
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.sequence[int(self.indices[i])]
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_catalog(meals):
+    return Catalog(meals)
+
+
+def compile_catalog(meals):
+    """Return a compiled catalog of the meals, re-using it if seen recently."""
+    if isinstance(meals, Catalog):
+        return meals
+    return _compile_catalog(tuple(meals))
+
+
 if __name__ == "__main__":
     import pytest
 
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FEASIBILITY - Fast checks of a meal planning problem, before a solver is created
+--------------------------------------------------------------------------------
+
+The hard constraints of the model are the number of meals per day, the limits on the
+number of times each meal is used, and the bounds on the quantity of a chosen meal
+(at least EPSILON, at most M1, and integer for discrete meals). Since every day is
+alike, a plan exists if and only if the limits can be met with `num_meals` distinct
+meals per day, which is checked here with a few sums. With `params["slots"]`, the same
+is checked for the meals of each type. With an availability mask the days are not
+alike, and each day is checked to have enough meals, but a plan may still not exist.
+The nutrients are soft constraints (deviations are penalized), so a daily target that
+can't be reached does not make the problem infeasible. Such targets are reported
+separately.
+"""
+import numpy as np
+
+from classes import compile_catalog
+
+
+class FeasibilityReport:
+    """
+    The result of `analyze_feasibility`. `conflicts` lists the hard constraints that
+    clash, in which case no meal plan exists. `unreachable` lists the daily nutrient
+    targets that no meal plan can meet.
+
+    Examples
+    --------
+    >>> report = FeasibilityReport()
+    >>> report.feasible
+    True
+    >>> report.conflicts.append("Not enough meals.")
+    >>> print(report)
+    Infeasible problem: Not enough meals.
+    """
+
+    def __init__(self):
+        self.conflicts = []
+        self.unreachable = []
+
+    @property
+    def feasible(self):
+        return not self.conflicts
+
+    def __str__(self):
+        if self.feasible:
+            return "No conflicts found."
+        return "Infeasible problem: " + " ".join(self.conflicts)
+
+
+def analyze_feasibility(
+    meals,
+    dietary_constraints,
+    *,
+    meals_limits=None,
+    params=None,
+    availability=None,
+    conflict_report=False,
+):
+    """
+    Check the problem for conflicting constraints, without solving it. The arguments
+    are those of `optimize_mealplan`, and `dietary_constraints` may be None to only
+    check the limits on the meals. If `conflict_report` is True, the names of the meals
+    involved in each conflict are listed as well.
+
+    Examples
+    --------
+    >>> from data import meals
+    >>> meal_list = list(meals.values())
+    >>> meals_limits = [(None, 1) for meal in meal_list]
+    >>> report = analyze_feasibility(meal_list, {"protein": (1500, None)},
+    ...                              meals_limits=meals_limits, params={"num_days": 2})
+    >>> report.feasible
+    False
+    >>> print(report.conflicts[0])
+    Cannot achieve 8 totals meals with a total of 7 meals.
+    >>> print(report.unreachable[0])
+    At most 1346 protein per day is possible with 4 meals, but the target is 1500.
+    """
+    catalog = compile_catalog(meals)
+    params = dict() if params is None else params
+    num_days = params.get("num_days", 1)
+    num_meals = params.get("num_meals", 4)
+    EPSILON = params.get("epsilon", 1e-3)
+    M1 = params.get("M1", 20)
+
+    if meals_limits is None:
+        meals_limits = [(None, None)] * len(catalog)
+    assert len(meals_limits) == len(catalog)
+
+    report = FeasibilityReport()
+    names = catalog.names
+
+    def listing(mask):
+        return f" ({', '.join(names[mask])})" if conflict_report else ""
+
+    # Limits as arrays. A meal is used at most once per day, so at most num_days times
+    at_least = np.array([0 if low is None else low for (low, _) in meals_limits])
+    at_most = np.array(
+        [num_days if high is None else high for (_, high) in meals_limits]
+    )
+    at_most = np.minimum(at_most, num_days)
+
+    # ... and on the days it's available
+    if availability is None:
+        available_days = np.full(len(catalog), num_days)
+    else:
+        availability = np.asarray(availability, dtype=bool)
+        assert availability.shape == (len(catalog), num_days)
+        available_days = availability.sum(axis=1)
+    limit_most, at_most = at_most, np.minimum(at_most, available_days)
+
+    # A chosen meal has x >= EPSILON and x <= M1, and discrete meals are integers
+    smallest_portion = np.where(catalog.discrete, 1.0, EPSILON)
+    can_be_picked = (smallest_portion <= M1) & (at_most > 0)
+
+    # =============================================================================
+    #     HARD CONSTRAINTS
+    # =============================================================================
+
+    for i in np.flatnonzero(at_least > num_days):
+        msg = f"Lower limit on '{names[i]}' is {at_least[i]}, but there are {num_days} days."
+        report.conflicts.append(msg)
+
+    for i in np.flatnonzero((at_least > available_days) & (at_least <= num_days)):
+        msg = f"Lower limit on '{names[i]}' is {at_least[i]}, but it's available on {available_days[i]} days."
+        report.conflicts.append(msg)
+
+    for i in np.flatnonzero((at_least > limit_most) & (at_least <= available_days)):
+        msg = f"Lower limit on '{names[i]}' is {at_least[i]}, but the upper limit is {limit_most[i]}."
+        report.conflicts.append(msg)
+
+    for i in np.flatnonzero((at_least > 0) & ~can_be_picked & (at_least <= at_most)):
+        msg = f"'{names[i]}' must be used, but at most {M1} of it fits in a meal."
+        report.conflicts.append(msg)
+
+    meals_total = num_days * num_meals
+    maximum_limit = int(np.where(can_be_picked, at_most, 0).sum())
+    if maximum_limit < meals_total:
+        msg = f"Cannot achieve {meals_total} totals meals with a total of {maximum_limit} meals."
+        limited = (at_most < num_days) | ~can_be_picked
+        report.conflicts.append(msg + listing(limited))
+
+    minimum_limit = int(at_least.sum())
+    if minimum_limit > meals_total:
+        msg = f"The lower limits add up to {minimum_limit} meals, but there are {meals_total}."
+        report.conflicts.append(msg + listing(at_least > 0))
+
+    if availability is not None:
+        per_day = (availability & can_be_picked[:, None]).sum(axis=0)
+        for j in np.flatnonzero(per_day < num_meals):
+            msg = (
+                f"Day {j + 1} has {per_day[j]} meals available, but needs {num_meals}."
+            )
+            report.conflicts.append(msg)
+
+    # With slots, each day has `count` distinct meals of each type
+    slots = params.get("slots", None)
+    if slots is not None:
+        types = catalog.types
+        for meal_type, count in slots.items():
+            of_type = types == meal_type
+            type_total = num_days * count
+            type_maximum = int(np.where(can_be_picked & of_type, at_most, 0).sum())
+            if type_maximum < type_total:
+                msg = f"Cannot achieve {type_total} '{meal_type}' meals with a total of {type_maximum} meals."
+                report.conflicts.append(msg + listing(of_type))
+
+            type_minimum = int(at_least[of_type].sum())
+            if type_minimum > type_total:
+                msg = f"The lower limits on '{meal_type}' meals add up to {type_minimum} meals, but there are {type_total}."
+                report.conflicts.append(msg + listing(of_type & (at_least > 0)))
+
+            if availability is not None:
+                available = availability & (can_be_picked & of_type)[:, None]
+                per_day = available.sum(axis=0)
+                for j in np.flatnonzero(per_day < count):
+                    msg = f"Day {j + 1} has {per_day[j]} '{meal_type}' meals available, but needs {count}."
+                    report.conflicts.append(msg)
+
+        slotted = np.array([meal_type in slots for meal_type in types], dtype=bool)
+        for i in np.flatnonzero((at_least > 0) & ~slotted):
+            msg = f"'{names[i]}' must be used, but there are no slots for its type '{types[i]}'."
+            report.conflicts.append(msg)
+        can_be_picked = can_be_picked & slotted
+
+    # =============================================================================
+    #     SOFT CONSTRAINTS
+    # =============================================================================
+
+    if dietary_constraints is None or num_meals > can_be_picked.sum():
+        return report
+
+    for macro, (low, high) in dietary_constraints.items():
+        values = catalog[macro][can_be_picked]
+
+        # The most of a macro in a day: the num_meals largest amounts, at M1 each
+        if low is not None:
+            most = np.sort(values * M1)[-num_meals:].sum()
+            if most < low:
+                msg = f"At most {most:.0f} {macro} per day is possible with {num_meals} meals, but the target is {low}."
+                report.unreachable.append(msg)
+
+        # The least of a macro in a day: the num_meals smallest, at the smallest portion
+        if high is not None:
+            least = np.sort(values * smallest_portion[can_be_picked])[:num_meals].sum()
+            if least > high:
+                msg = f"At least {least:.0f} {macro} per day is needed with {num_meals} meals, but the target is {high}."
+                report.unreachable.append(msg)
+
+    return report
@@ -0,0 +1,631 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HEURISTIC - Meal plans in milliseconds, from a greedy start and a local search
+------------------------------------------------------------------------------
+
+For interactive previews, a meal plan is built without a MIP solver. The objective
+function is that of the MIP (the price, the deviation from the nutrients and the range
+of kcal in a day), computed from the compiled catalog for many candidate plans at once:
+    1. Every meal gets a default quantity, which gives it an equal share of the kcal.
+    2. The days are filled one at a time. Meals that must be used to meet a lower limit
+       come first, then the meal that gives the best day so far, among the meals below
+       their upper limit.
+    3. A local search replaces a meal of a day by another meal, or changes the quantity
+       of a meal, for as long as the objective function value improves.
+With `params["slots"]`, every meal of a day fills a slot of its type, and a meal is
+only replaced by a meal of the same type. With an availability mask, a meal is only
+chosen on the days it's available. The plan meets `num_meals` (or the slots),
+the limits on the meals and the bounds on the quantities, but it's not proven optimal.
+It may be given to the MIP as an initial solution, see `params["heuristic_start"]` in
+`optimize_mealplan`.
+"""
+
+import statistics
+import time
+
+import numpy as np
+
+from data import meals
+from classes import compile_catalog
+from feasibility import analyze_feasibility
+from optimizing_meals import _with_slots, _x_bounds, evaluate_mealplan
+from plans import format_plan
+
+# The factors that the quantity of a meal is multiplied by in the local search. The
+# quantity of a discrete meal is changed by a whole number of portions instead, with
+# as many steps as there are factors.
+QUANTITY_FACTORS = (0.5, 0.75, 0.9, 0.97, 1.03, 1.1, 1.33, 2.0)
+PORTION_STEPS = (-4, -3, -2, -1, 1, 2, 3, 4)
+
+# Candidate moves are evaluated for this many (day, meal, move) triplets at a time
+CHUNK_SIZE = 2**18
+
+# =============================================================================
+# CLASSES - Used to evaluate many candidate days at once
+# =============================================================================
+
+
+class DayObjective:
+    """
+    The terms of the objective function of the MIP that belong to a single day, see
+    `MealPlanModel._update_objective`. Called with arrays of the totals of the catalog
+    attributes of candidate days, and of their largest and smallest kcal in a meal.
+
+    Examples
+    --------
+    >>> catalog = compile_catalog(list(meals.values()))
+    >>> objective = DayObjective(catalog, {"kcal": (1800, 1800)}, dict())
+    >>> totals = np.array([[1800, 0, 0, 0, 75], [1700, 0, 0, 0, 75]])
+    >>> objective(totals, np.array([450, 500]), np.array([450, 400]))
+    array([0.1       , 0.37777778])
+    """
+
+    def __init__(self, catalog, dietary_constraints, params):
+        num_days = params.get("num_days", 1)
+        num_meals = params.get("num_meals", 4)
+        weight_price = params.get("weight_price", 0.1)
+        weight_nutrients = params.get("weight_nutrients", 2.0)
+        weight_range = params.get("weight_range", 0.75)
+        expected_daily_price = params.get("expected_daily_price", 75)
+
+        self.price_column = catalog.attributes.index("price")
+        self.price_weight = weight_price / (expected_daily_price * num_days)
+
+        # A deviation is max(sign * (total - limit), 0), with sign -1 for lower limits
+        columns, limits, signs, weights = [], [], [], []
+        for macro, (low, high) in dietary_constraints.items():
+            values = [value for value in (low, high) if value is not None]
+            if not values:
+                continue
+            weight = weight_nutrients / (statistics.mean(values) * num_days)
+            for limit, sign in ((low, -1.0), (high, 1.0)):
+                if limit is not None:
+                    columns.append(catalog.attributes.index(macro))
+                    limits.append(limit)
+                    signs.append(sign)
+                    weights.append(weight)
+        self.columns = np.array(columns, dtype=int)
+        self.limits, self.signs = np.array(limits), np.array(signs)
+        self.weights = np.array(weights)
+
+        kcal = [value for value in dietary_constraints["kcal"] if value is not None]
+        self.range_weight = weight_range / (
+            statistics.mean(kcal) * num_days / num_meals
+        )
+
+    def __call__(self, totals, kcal_max, kcal_min):
+        deviations = np.maximum(
+            self.signs * (totals[..., self.columns] - self.limits), 0
+        )
+        return (
+            self.price_weight * totals[..., self.price_column]
+            + deviations @ self.weights
+            + self.range_weight * (kcal_max - kcal_min)
+        )
+
+
+# =============================================================================
+# FUNCTIONS - Used to generate the meal plan
+# =============================================================================
+
+
+def optimize_mealplan_heuristic(
+    meals, dietary_constraints, *, meals_limits=None, params=None, availability=None
+):
+    """
+    Build a meal plan with the heuristic, see the module docstring. Returns
+    (x, results_data) like `optimize_mealplan`, with the status 'FEASIBLE' since the
+    plan is not proven optimal. Raises a RuntimeError if the problem is infeasible, or
+    if no plan that meets the limits on the meals was found.
+    """
+    start_time = time.perf_counter()
+    params = _with_slots(dict() if params is None else params)
+    catalog = compile_catalog(meals)
+
+    report = analyze_feasibility(
+        catalog,
+        dietary_constraints,
+        meals_limits=meals_limits,
+        params=params,
+        availability=availability,
+    )
+    if not report.feasible:
+        raise RuntimeError(str(report))
+
+    x, moves = heuristic_plan(
+        catalog,
+        dietary_constraints,
+        meals_limits=meals_limits,
+        params=params,
+        availability=availability,
+    )
+    obj_func_value = evaluate_mealplan(x, catalog, dietary_constraints, params=params)
+    seconds = time.perf_counter() - start_time
+
+    results_data = {
+        "status": "FEASIBLE",
+        "obj_func_value": round(obj_func_value, 6),
+        "wall_time": round(seconds, 3),
+        "iterations": moves,
+        "total_price": round(float(catalog["price"] @ x.sum(axis=1)), 1),
+        "initial_solution_used": False,
+        "nodes": 0,
+        "mip_gap": None,
+        "num_variables": None,
+        "num_constraints": None,
+        "num_nonzeros": None,
+        "timings": {"heuristic": round(seconds, 6)},
+        "backend": "heuristic",
+    }
+    return format_plan(x, params.get("output", "list")), results_data
+
+
+def heuristic_plan(
+    meals,
+    dietary_constraints,
+    *,
+    meals_limits=None,
+    params=None,
+    availability=None,
+    max_rounds=50,
+):
+    """
+    Return a meal plan as a (meals x days) array, and the number of moves made by the
+    local search, which stops after `max_rounds` rounds of moves.
+    """
+    catalog = compile_catalog(meals)
+    params = _with_slots(dict() if params is None else params)
+    num_days = params.get("num_days", 1)
+    num_meals = params.get("num_meals", 4)
+    EPSILON = params.get("epsilon", 1e-3)
+    M1 = params.get("M1", 20)
+
+    if meals_limits is None:
+        meals_limits = [(None, None)] * len(catalog)
+    assert len(meals_limits) == len(catalog)
+    low = np.array([0 if low is None else low for (low, _) in meals_limits])
+    if availability is None:
+        availability = np.ones((len(catalog), num_days), dtype=bool)
+    availability = np.asarray(availability, dtype=bool)
+    high = np.array(
+        [
+            num_days if high is None else min(high, num_days)
+            for (_, high) in meals_limits
+        ]
+    )
+
+    # The same bounds on the quantities as the MIP, and a default quantity per meal
+    discrete = catalog.discrete
+    smallest = np.where(discrete, 1.0, EPSILON)
+    if params.get("tighten_bounds", True):
+        bounds = _x_bounds(catalog, M1, EPSILON)
+    else:
+        bounds = np.full(len(catalog), float(M1))
+    kcal = catalog["kcal"]
+    share = statistics.mean(
+        [value for value in dietary_constraints["kcal"] if value is not None]
+    )
+    default = np.divide(share / num_meals, kcal, out=smallest.copy(), where=kcal > 0)
+    default = np.clip(np.where(discrete, np.round(default), default), smallest, bounds)
+
+    # The meals of a day are in slots, and fits[p, i] is True if meal i fits in slot p.
+    # Without slots, every meal fits in every slot.
+    slots = params.get("slots", None)
+    if slots is None:
+        groups, slot_groups = np.zeros(len(catalog), dtype=int), np.zeros(num_meals)
+    else:
+        types = list(slots)
+        groups = np.array([types.index(t) if t in slots else -1 for t in catalog.types])
+        slot_groups = np.repeat(np.arange(len(types)), list(slots.values()))
+    fits = slot_groups[:, None] == groups[None, :]
+
+    objective = DayObjective(catalog, dietary_constraints, params)
+    search = _LocalSearch(
+        catalog, objective, low, high, smallest, bounds, fits, availability
+    )
+    chosen, quantities, used = _greedy_days(
+        catalog, objective, default, low, high, fits, availability
+    )
+
+    moves = 0
+    for round_number in range(max_rounds):
+        swaps = search.swap_meals(chosen, quantities, used, default)
+        changes = search.change_quantities(chosen, quantities)
+        moves += swaps + changes
+        if swaps + changes == 0:
+            break
+
+    x = np.zeros((len(catalog), num_days))
+    x[chosen, np.arange(num_days)[:, None]] = quantities
+
+    # With an availability mask a plan may not exist, even if no conflict was found
+    # before, so the limits on the meals are checked before the plan is returned
+    times_used = (x > 0).sum(axis=1)
+    if (
+        np.any(times_used < low)
+        or np.any(times_used > high)
+        or np.any((x > 0) & ~availability)
+    ):
+        raise RuntimeError("The heuristic found no plan that meets the meals limits.")
+    return x, moves
+
+
+def _greedy_days(catalog, objective, default, low, high, fits, availability):
+    """
+    Choose the meals of each day, one day at a time, at their default quantities.
+    Returns the (days x num_meals) chosen meals, their quantities and the number of
+    days each meal is used.
+
+    A meal is only chosen if the meals left can still fill the slots of the days
+    after, given the upper limits on the meals. Should no meal be left for a slot, a
+    meal is moved to it from an earlier day, where another meal takes its place.
+    """
+    contributions = catalog.matrix * default[:, None]
+    kcals = catalog["kcal"] * default
+    used = np.zeros(len(catalog), dtype=int)
+    num_meals, num_days = len(fits), availability.shape[1]
+    chosen = np.zeros((num_days, num_meals), dtype=int)
+
+    # The slots that each meal fits in are alike, so they are counted per meal
+    capacity = fits.sum(axis=0)
+
+    for day in range(num_days):
+        # Meals needed on every remaining day they are available come first, then the
+        # meals with the fewest days to spare. If the meals that are needed are
+        # available on every remaining day, a meal with days to spare waits until the
+        # remaining needs don't fit in the remaining days. The needs of meals that fit
+        # in the same slots are counted together.
+        days_left = num_days - day
+        need = np.maximum(low - used, 0)
+        remaining = fits.astype(int) @ need
+        available_days = availability[:, day:].sum(axis=1)
+        may_wait = np.all(available_days[need > 0] == days_left)
+        meals_of_day = np.full(num_meals, -1)
+        needed = np.flatnonzero((need > 0) & availability[:, day])
+        order = np.lexsort((-need[needed], available_days[needed] - need[needed]))
+        for i in needed[order]:
+            if np.all(meals_of_day >= 0):
+                break
+            slot = np.argmax(fits[:, i])
+            if (
+                may_wait
+                and need[i] < available_days[i]
+                and remaining[slot] <= capacity[i] * (days_left - 1)
+            ):
+                continue
+            open_slots = np.flatnonzero(fits[:, i] & (meals_of_day < 0))
+            if len(open_slots):
+                meals_of_day[open_slots[0]] = i
+                remaining[fits[:, i]] -= 1
+
+        picked = meals_of_day[meals_of_day >= 0]
+        available = (used < high) & availability[:, day]
+        available[picked] = False
+        totals = contributions[picked].sum(axis=0)
+        for p in np.flatnonzero(meals_of_day < 0):
+            # The day so far and a candidate meal, scaled up to a full day
+            scale = num_meals / (len(picked) + 1)
+            kcal_max = np.maximum(kcals[picked].max(initial=0), kcals)
+            kcal_min = np.minimum(kcals[picked].min(initial=np.inf), kcals)
+            values = objective((totals + contributions) * scale, kcal_max, kcal_min)
+            candidates = available & fits[p]
+            values[~candidates] = np.inf
+            allowed = candidates & _within_budget(
+                p, day, meals_of_day, used, high, fits, availability
+            )
+            if allowed.any():
+                values[~allowed] = np.inf
+            j = int(np.argmin(values))
+            if not candidates[j]:
+                j = _move_from_earlier_day(
+                    p, day, chosen, meals_of_day, used, high, fits, availability
+                )
+            if j < 0:
+                raise RuntimeError("The heuristic found no plan.")
+            meals_of_day[p] = j
+            picked = meals_of_day[meals_of_day >= 0]
+            available[j] = False
+            totals = totals + contributions[j]
+
+        chosen[day] = meals_of_day
+        used[meals_of_day] += 1
+
+    return chosen, default[chosen], used
+
+
+def _within_budget(p, day, meals_of_day, used, high, fits, availability):
+    """
+    Return a boolean array, True for the meals that may fill slot p of the day without
+    leaving too few meals for the same slots on the days after. A meal can be used on
+    at most min(days it may still be used, days it's available) of those days, and
+    choosing it lowers that only if it has no days to spare.
+    """
+    group = fits[p]
+    slots = np.all(fits == group, axis=1)
+    budget = high - used
+    budget[meals_of_day[meals_of_day >= 0]] -= 1
+    days_after = availability[:, day + 1 :].sum(axis=1)
+    capacity = np.minimum(np.maximum(budget, 0), days_after)
+    slack = capacity[group].sum() - slots.sum() * (availability.shape[1] - day - 1)
+
+    # Chosen meals without days to spare lower the slack, and the other open slots of
+    # the day lower it too, once the meals with days to spare run out
+    candidates = group & (budget > 0) & availability[:, day]
+    candidates[meals_of_day[meals_of_day >= 0]] = False
+    costly = budget <= days_after
+    spare = candidates & ~costly
+    open_slots = np.sum(slots & (meals_of_day < 0)) - 1
+    forced = np.maximum(open_slots - spare.sum() + spare, 0)
+    return costly.astype(int) + forced <= slack
+
+
+def _move_from_earlier_day(
+    p, day, chosen, meals_of_day, used, high, fits, availability
+):
+    """
+    Find a meal for slot p of the day by moving one from an earlier day, and putting
+    another meal in its place there. Returns the meal, or -1 if there is no such move.
+    """
+    picked_today = np.zeros(len(used), dtype=bool)
+    picked_today[meals_of_day[meals_of_day >= 0]] = True
+    slots = np.flatnonzero(np.all(fits == fits[p], axis=1))
+    for earlier in range(day):
+        for q in slots:
+            k = chosen[earlier, q]
+            if picked_today[k] or not availability[k, day]:
+                continue
+            options = fits[q] & availability[:, earlier] & (used + picked_today < high)
+            options[chosen[earlier]] = False
+            if options.any():
+                j = int(np.argmax(options))
+                chosen[earlier, q] = j
+                used[j] += 1
+                used[k] -= 1
+                return int(k)
+    return -1
+
+
+class _LocalSearch:
+    """Moves that improve a plan, evaluated for every day, meal and move at once."""
+
+    def __init__(
+        self, catalog, objective, low, high, smallest, bounds, fits, availability
+    ):
+        self.matrix = catalog.matrix
+        self.kcal = catalog["kcal"]
+        self.discrete = catalog.discrete
+        self.objective = objective
+        self.low, self.high = low, high
+        self.smallest, self.bounds = smallest, bounds
+        self.fits, self.availability = fits, availability
+
+    def _days(self, chosen, quantities):
+        """The totals, the kcal of every meal and the objective value of each day."""
+        contributions = self.matrix[chosen] * quantities[..., None]
+        totals = contributions.sum(axis=1)
+        kcals = self.kcal[chosen] * quantities
+        values = self.objective(totals, kcals.max(axis=1), kcals.min(axis=1))
+        return contributions, totals, kcals, values
+
+    @staticmethod
+    def _others(kcals):
+        """The largest and smallest kcal of the other meals of a day, per meal."""
+        num_meals = kcals.shape[1]
+        others = ~np.eye(num_meals, dtype=bool)
+        others_max = np.where(others, kcals[:, None, :], -np.inf).max(axis=-1)
+        others_min = np.where(others, kcals[:, None, :], np.inf).min(axis=-1)
+        return others_max, others_min
+
+    def swap_meals(self, chosen, quantities, used, default):
+        """Replace one meal per day by another meal, if it improves the day."""
+        num_days, num_meals = chosen.shape
+        contributions, totals, kcals, values = self._days(chosen, quantities)
+        others_max, others_min = self._others(kcals)
+        new_contributions = self.matrix * default[:, None]
+        new_kcals = self.kcal * default
+
+        moves = 0
+        chunk = max(1, CHUNK_SIZE // (num_meals * len(default)))
+        for start in range(0, num_days, chunk):
+            days = np.arange(start, min(start + chunk, num_days))
+            new_totals = (
+                totals[days, None, None, :]
+                - contributions[days, :, None, :]
+                + new_contributions[None, None, :, :]
+            )
+            kcal_max = np.maximum(others_max[days, :, None], new_kcals)
+            kcal_min = np.minimum(others_min[days, :, None], new_kcals)
+            deltas = self.objective(new_totals, kcal_max, kcal_min)
+            deltas -= values[days, None, None]
+
+            # A meal may replace another if it fits in its slot, it's available and not
+            # used that day, it's below its upper limit, and the replaced meal stays at
+            # or above its lower limit
+            unavailable = ~self.availability[:, days].T
+            unavailable[np.arange(len(days))[:, None], chosen[days]] = True
+            invalid = unavailable[:, None, :] | (used >= self.high) | ~self.fits
+            invalid = (
+                invalid | (used[chosen[days]] <= self.low[chosen[days]])[..., None]
+            )
+            deltas[invalid] = np.inf
+
+            for k, day in enumerate(days):
+                p, j = np.unravel_index(np.argmin(deltas[k]), deltas[k].shape)
+                i = chosen[day, p]
+                # The limits are checked again, since other days may have changed
+                if deltas[k, p, j] >= -1e-12 or j in chosen[day]:
+                    continue
+                if used[j] >= self.high[j] or used[i] <= self.low[i]:
+                    continue
+                chosen[day, p], quantities[day, p] = j, default[j]
+                used[i], used[j] = used[i] - 1, used[j] + 1
+                moves += 1
+        return moves
+
+    def change_quantities(self, chosen, quantities):
+        """Change the quantity of one meal per day, if it improves the day."""
+        num_days, num_meals = chosen.shape
+        contributions, totals, kcals, values = self._days(chosen, quantities)
+        others_max, others_min = self._others(kcals)
+
+        # Candidate quantities (days x meals x moves), within the bounds of each meal
+        discrete = self.discrete[chosen][..., None]
+        new_quantities = np.where(
+            discrete,
+            quantities[..., None] + np.array(PORTION_STEPS),
+            quantities[..., None] * np.array(QUANTITY_FACTORS),
+        )
+        new_quantities = np.clip(
+            new_quantities,
+            self.smallest[chosen][..., None],
+            self.bounds[chosen][..., None],
+        )
+        changes = new_quantities - quantities[..., None]
+        new_totals = (
+            totals[:, None, None, :]
+            + self.matrix[chosen][:, :, None, :] * changes[..., None]
+        )
+        new_kcals = self.kcal[chosen][..., None] * new_quantities
+        kcal_max = np.maximum(others_max[..., None], new_kcals)
+        kcal_min = np.minimum(others_min[..., None], new_kcals)
+        deltas = self.objective(new_totals, kcal_max, kcal_min) - values[:, None, None]
+
+        best = deltas.reshape(num_days, -1).argmin(axis=1)
+        p, s = np.unravel_index(best, deltas.shape[1:])
+        days = np.arange(num_days)
+        improved = deltas[days, p, s] < -1e-12
+        quantities[days[improved], p[improved]] = new_quantities[days, p, s][improved]
+        return int(improved.sum())
+
+
+def test_heuristic():
+    """Example: The heuristic plan is feasible, and close to the optimal plan."""
+
+    from optimizing_meals import optimize_mealplan
+
+    meal_list = list(meals.values())
+    dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    meals_limits = [(None, 2)] + [(None, None)] * 5 + [(1, None)]
+    params = {"num_days": 3, "num_meals": 3}
+
+    x, results_data = optimize_mealplan(
+        meal_list,
+        dietary_constraints,
+        meals_limits=meals_limits,
+        params=dict(params, mode="heuristic"),
+    )
+    x = np.array(x)
+    assert results_data["status"] == "FEASIBLE"
+    assert np.all((x > 0).sum(axis=0) == 3)
+    assert (x[0] > 0).sum() <= 2 and (x[6] > 0).sum() >= 1
+
+    # The reported value is the objective function value of the MIP
+    value = evaluate_mealplan(x, meal_list, dietary_constraints, params=params)
+    assert abs(value - results_data["obj_func_value"]) < 1e-6
+    x_mip, results_mip = optimize_mealplan(
+        meal_list, dietary_constraints, meals_limits=meals_limits, params=params
+    )
+    assert results_data["obj_func_value"] < 1.5 * results_mip["obj_func_value"]
+
+    # The heuristic plan is a feasible initial solution for the MIP
+    params["heuristic_start"] = True
+    x_seeded, results_seeded = optimize_mealplan(
+        meal_list, dietary_constraints, meals_limits=meals_limits, params=params
+    )
+    difference = results_seeded["obj_func_value"] - results_mip["obj_func_value"]
+    assert abs(difference) < 1e-3
+
+
+def test_tight_limits():
+    """Example: The limits leave one meal to spare over 5 days, and a hint may fail."""
+
+    from unittest import mock
+
+    from optimizing_meals import optimize_mealplan
+
+    meal_list = list(meals.values())
+    dietary_constraints = {"kcal": (1800, 1800)}
+    meals_limits = [
+        (None, 2),
+        (None, 4),
+        (None, 1),
+        (None, None),
+        (None, 3),
+        (None, None),
+        (None, 1),
+    ]
+    params = {"num_days": 5, "num_meals": 4}
+
+    # Meals that later days need are not used up on the first days
+    x, results_data = optimize_mealplan(
+        meal_list,
+        dietary_constraints,
+        meals_limits=meals_limits,
+        params=dict(params, mode="heuristic"),
+    )
+    x = np.array(x)
+    assert np.all((x > 0).sum(axis=0) == 4)
+    assert all(
+        high is None or (x[i] > 0).sum() <= high
+        for i, (_, high) in enumerate(meals_limits)
+    )
+
+    # Should the heuristic fail, the MIP is solved without a hint
+    x_mip, results_mip = optimize_mealplan(
+        meal_list, dietary_constraints, meals_limits=meals_limits, params=params
+    )
+    params["heuristic_start"] = True
+    with mock.patch("heuristic.heuristic_plan", side_effect=RuntimeError):
+        x_seeded, results_seeded = optimize_mealplan(
+            meal_list, dietary_constraints, meals_limits=meals_limits, params=params
+        )
+    assert results_seeded["status"] == results_mip["status"] == "OPTIMAL"
+    difference = results_seeded["obj_func_value"] - results_mip["obj_func_value"]
+    assert abs(difference) < 1e-6
+
+
+def test_limits_and_availability():
+    """Example: Meals with a lower limit are used on the few days they are available."""
+
+    from benchmark import generate_catalog
+
+    meal_list = generate_catalog(25, seed=936)
+    dietary_constraints = {"kcal": (1800, 2200)}
+    params = {"num_days": 3, "num_meals": 2}
+    meals_limits = [(None, None)] * len(meal_list)
+    availability = np.ones((len(meal_list), 3), dtype=bool)
+    for i, limits, days in ((16, (1, 2), [1]), (23, (2, 3), [0, 1]), (24, (1, 1), [0, 1])):
+        meals_limits[i] = limits
+        availability[i] = np.isin(np.arange(3), days)
+
+    x, moves = heuristic_plan(
+        meal_list,
+        dietary_constraints,
+        meals_limits=meals_limits,
+        params=params,
+        availability=availability,
+    )
+    assert list((x[[16, 23, 24]] > 0).sum(axis=1)) == [1, 2, 1]
+    assert not np.any((x > 0) & ~availability)
+
+    # On day 2, three meals are needed for two slots, which no conflict check finds
+    availability[24] = [False, True, False]
+    try:
+        heuristic_plan(
+            meal_list,
+            dietary_constraints,
+            meals_limits=meals_limits,
+            params=params,
+            availability=availability,
+        )
+    except RuntimeError as error:
+        assert "meets the meals limits" in str(error)
+    else:
+        assert False
+
+
+if __name__ == "__main__":
+    test_heuristic()
+    test_tight_limits()
+    test_limits_and_availability()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LOAD TEST - Latency and throughput of the meal planning service
+---------------------------------------------------------------
+
+Sends `num_requests` requests to the service, with `concurrency` requests in flight at
+any time, and reports the 50th and 99th percentile of the latency, the throughput and
+the number of responses with each status code. The problems are drawn from a seed, and
+vary in the kcal target and the number of days. A service is started locally, unless
+the port of a running service is given:
+    1. $ python load_test.py --requests 100 --concurrency 8 --workers 2
+    2. $ python load_test.py --port 8080 --requests 100 --concurrency 8
+"""
+import argparse
+import asyncio
+import collections
+import json
+import time
+
+import numpy as np
+
+from data import meals
+from service import MealPlanService, request
+
+
+def generate_requests(num_requests, *, seed=0, max_days=7):
+    """Return the bodies of `num_requests` requests, drawn from a seed."""
+    rng = np.random.default_rng(seed)
+    num_meals = len(meals)
+    bodies = []
+    for i in range(num_requests):
+        kcal = int(rng.integers(1600, 2600))
+        num_days = int(rng.integers(1, max_days + 1))
+        most = int(rng.integers(num_days, 2 * num_days + 1))
+        bodies.append(
+            {
+                "dietary_constraints": {"kcal": [kcal, kcal], "protein": [100, None]},
+                "meals_limits": [[None, most]] * num_meals,
+                "params": {"num_days": num_days, "num_meals": 3, "time_limit_secs": 2},
+            }
+        )
+    return bodies
+
+
+async def run_load_test(host, port, bodies, *, concurrency=8):
+    """
+    Send the requests with `concurrency` in flight, and return a dictionary with the
+    latency percentiles (in seconds), the throughput (requests per second) and the
+    count of each status code.
+    """
+    queue = collections.deque(bodies)
+    latencies, statuses = [], collections.Counter()
+
+    async def client():
+        while queue:
+            body = queue.popleft()
+            start_time = time.perf_counter()
+            status, _ = await request(host, port, "POST", "/mealplan", body)
+            latencies.append(time.perf_counter() - start_time)
+            statuses[status] += 1
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(client() for i in range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "requests": len(bodies),
+        "concurrency": concurrency,
+        "p50_secs": round(float(np.percentile(latencies, 50)), 4),
+        "p99_secs": round(float(np.percentile(latencies, 99)), 4),
+        "throughput": round(len(bodies) / elapsed, 2),
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+async def main(args):
+    bodies = generate_requests(args.requests, seed=args.seed)
+    if args.port is not None:
+        return await run_load_test(
+            args.host, args.port, bodies, concurrency=args.concurrency
+        )
+
+    service = MealPlanService(
+        list(meals.values()), max_workers=args.workers, max_queue=args.max_queue
+    )
+    port = await service.start(args.host, 0)
+    try:
+        return await run_load_test(
+            args.host, port, bodies, concurrency=args.concurrency
+        )
+    finally:
+        await service.close()
+
+
+def test_load_test():
+    """Example: A short load test against a local service."""
+
+    service = MealPlanService(list(meals.values()), max_workers=1, max_queue=8)
+
+    async def run():
+        port = await service.start(port=0)
+        try:
+            bodies = generate_requests(6, max_days=2)
+            return await run_load_test("127.0.0.1", port, bodies, concurrency=3)
+        finally:
+            await service.close()
+
+    report = asyncio.run(run())
+    assert report["statuses"] == {200: 6}
+    assert 0 < report["p50_secs"] <= report["p99_secs"]
+    assert report["throughput"] > 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main(args)), indent=2))
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LOADER - Foods and meal recipes read from tables, instead of Python literals
+----------------------------------------------------------------------------
+
+Foods are read from a table with the columns in `FOOD_COLUMNS`, one row per food, with
+values per 100 grams. Any other column is a nutrient, e.g. 'fiber' or 'sodium', and
+empty values are 0. Recipes are read from a table with the columns in
+`RECIPE_COLUMNS`, one row per food in a meal. Tables are CSV files, or Parquet files if
+pyarrow is installed (`pip install pyarrow`), which are then memory-mapped.
+
+The tables are kept as columns (NumPy arrays). The kcal of every food is validated in
+one pass, and the attributes of every meal are computed with a sparse sum over the
+recipes, so no `Food` or `Meal` object is created while loading. Those are created on
+demand, when a meal of the catalog is accessed. A compiled catalog can be saved as
+NumPy files with `save_catalog`, and loaded memory-mapped with `load_saved_catalog`.
+
+Examples
+--------
+>>> import tempfile, os
+>>> from data import meals
+>>> directory = tempfile.mkdtemp()
+>>> foods_path = os.path.join(directory, "foods.csv")
+>>> recipes_path = os.path.join(directory, "recipes.csv")
+>>> write_tables(list(meals.values()), foods_path, recipes_path)
+>>> catalog = load_catalog(foods_path, recipes_path)
+>>> len(catalog), catalog.names[0]
+(7, 'mixed nuts')
+>>> catalog.meals[4] == meals["egg"]
+True
+"""
+import collections.abc
+import csv
+import os
+import warnings
+
+import numpy as np
+
+from data import meals
+from classes import Catalog, Food, Meal, compile_catalog
+
+FOOD_COLUMNS = (
+    "name",
+    "protein",
+    "fat",
+    "carbs",
+    "kcal",
+    "price_per_product",
+    "grams_per_product",
+)
+RECIPE_COLUMNS = ("meal", "food", "grams", "discrete", "type")
+
+# =============================================================================
+# CLASSES - Used to store tables as columns, and create objects on demand
+# =============================================================================
+
+
+class FoodTable(collections.abc.Sequence):
+    """
+    A table of foods stored as columns. Indexing returns a `Food`, created on demand
+    and then kept. The columns that are not in `FOOD_COLUMNS` are `nutrients`.
+
+    Examples
+    --------
+    >>> table = FoodTable({"name": ["eggs"], "protein": [13.0], "fat": [10.6],
+    ...                    "carbs": [0.3], "kcal": [149], "price_per_product": [32.9],
+    ...                    "grams_per_product": [690]})
+    >>> table[0].name, table["price"]
+    ('eggs', array([4.76811594]))
+    >>> table[0] is table[0]
+    True
+    >>> table.kcal_errors()
+    array([False])
+    """
+
+    def __init__(self, columns):
+        self.names = np.asarray(columns["name"], dtype=object)
+        self.nutrients = tuple(key for key in columns if key not in FOOD_COLUMNS)
+        self._foods = dict()
+        self.columns = {
+            key: _floats(columns[key]) for key in FOOD_COLUMNS[1:] + self.nutrients
+        }
+        self.columns["price"] = (
+            self.columns["price_per_product"] / self.columns["grams_per_product"] * 100
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, key):
+        """Return a column by name, or the `Food` in a row."""
+        if isinstance(key, str):
+            return self.columns[key]
+        key = int(key)
+        if key not in self._foods:
+            self._foods[key] = self._food(key)
+        return self._foods[key]
+
+    def _food(self, key):
+        values = [self.columns[column][key].item() for column in FOOD_COLUMNS[1:]]
+        nutrients = {
+            name: self.columns[name][key].item()
+            for name in self.nutrients
+            if self.columns[name][key]
+        }
+
+        # The kcal were validated for every food at once, see `kcal_errors`
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return Food(self.names[key], *values, nutrients=nutrients)
+
+    def index(self, names):
+        """Return the row of every name in `names`, raising a KeyError if not found."""
+        order = np.argsort(self.names.astype(str), kind="stable")
+        sorted_names = self.names[order].astype(str)
+        names = np.asarray(names, dtype=str)
+        position = np.searchsorted(sorted_names, names).clip(0, len(self) - 1)
+        found = sorted_names[position] == names
+        if not np.all(found):
+            raise KeyError(f"Unknown foods: {sorted(set(names[~found]))}")
+        return order[position]
+
+    def kcal_errors(self, tolerance=0.1):
+        """
+        Return a boolean array, True for foods where the kcal differ from those computed
+        from the macros (4 per gram of protein and carbs, 9 per gram of fat) by more
+        than the relative `tolerance`, as `Food` does one food at a time.
+        """
+        columns = self.columns
+        computed = 4 * columns["protein"] + 4 * columns["carbs"] + 9 * columns["fat"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative_error = np.abs((columns["kcal"] - computed) / computed)
+        return ~(relative_error <= tolerance)
+
+
+class LazyMeals(collections.abc.Sequence):
+    """
+    The meals of a catalog, created on demand from the foods and the recipes. A meal is
+    kept once created, so memory only grows with the meals that are used.
+    """
+
+    def __init__(self, foods, names, recipes, discrete, types):
+        self.foods = foods
+        self.names = names
+        self.discrete = discrete
+        self.types = types
+
+        # The recipes (meal, food, grams) as arrays, sorted by meal
+        meal_rows, food_rows, grams = recipes
+        order = np.argsort(meal_rows, kind="stable")
+        self._food_rows, self._grams = food_rows[order], grams[order]
+        self._starts = np.searchsorted(meal_rows[order], np.arange(len(names) + 1))
+        self._meals = dict()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = range(len(self))[i]
+        if i not in self._meals:
+            rows = slice(self._starts[i], self._starts[i + 1])
+            foods = {
+                self.foods[food_row]: grams.item()
+                for (food_row, grams) in zip(self._food_rows[rows], self._grams[rows])
+            }
+            self._meals[i] = Meal(
+                self.names[i],
+                foods,
+                discrete=bool(self.discrete[i]),
+                type=self.types[i],
+            )
+        return self._meals[i]
+
+
+# =============================================================================
+# FUNCTIONS - Used to read and write tables
+# =============================================================================
+
+
+def read_table(path, columns=None):
+    """
+    Read the `columns` of a CSV or Parquet file into a dictionary of arrays, or every
+    column if `columns` is None. Columns that are missing are None. Parquet files are
+    memory-mapped.
+    """
+    if os.path.splitext(path)[1] == ".parquet":
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Reading Parquet files requires `pip install pyarrow`.")
+        table = pyarrow.parquet.read_table(path, memory_map=True)
+        columns = table.column_names if columns is None else columns
+        return {
+            column: (
+                table.column(column).to_numpy()
+                if column in table.column_names
+                else None
+            )
+            for column in columns
+        }
+
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        rows = list(reader)
+    values = list(zip(*rows)) if rows else [() for column in header]
+    columns = header if columns is None else columns
+    return {
+        column: (
+            np.array(values[header.index(column)], dtype=object)
+            if column in header
+            else None
+        )
+        for column in columns
+    }
+
+
+def load_foods(path):
+    """
+    Read a table of foods, see `FOOD_COLUMNS`, and the nutrients in its other columns.
+    A single warning lists the foods where the kcal don't match the macros.
+    """
+    table = FoodTable(read_table(path))
+    errors = table.kcal_errors()
+    if np.any(errors):
+        names = ", ".join(f"'{name}'" for name in table.names[errors][:10])
+        more = "" if errors.sum() <= 10 else ", ..."
+        warnings.warn(
+            f"Got a kcal error above 0.10 on {errors.sum()} foods: {names}{more}."
+        )
+    return table
+
+
+def load_catalog(foods_path, recipes_path):
+    """
+    Read a table of foods and a table of recipes, see `RECIPE_COLUMNS`, and return a
+    compiled catalog of the meals, in the order they first appear in the recipes. The
+    'discrete' and 'type' of a meal are read from its first row, and default to True
+    and None.
+    """
+    foods = load_foods(foods_path)
+    recipes = read_table(recipes_path, RECIPE_COLUMNS)
+
+    names, first_rows, meal_rows = np.unique(
+        recipes["meal"].astype(str), return_index=True, return_inverse=True
+    )
+    order = np.argsort(first_rows, kind="stable")
+    meal_rows = np.argsort(order)[meal_rows.ravel()]
+    names, first_rows = names[order].astype(object), first_rows[order]
+
+    food_rows = foods.index(recipes["food"].astype(str))
+    grams = np.asarray(recipes["grams"], dtype=float)
+    discrete = np.ones(len(names), dtype=bool)
+    if recipes["discrete"] is not None:
+        discrete = np.isin(
+            recipes["discrete"][first_rows].astype(str), ("True", "true", "1")
+        )
+    types = [None] * len(names)
+    if recipes["type"] is not None:
+        types = [value or None for value in recipes["type"][first_rows].tolist()]
+
+    # The sum over the foods of every meal, for each attribute, in one pass. Like a
+    # compiled catalog, the other nutrients of the foods follow, sorted by name.
+    nutrients = [name for name in foods.nutrients if foods[name][food_rows].any()]
+    attributes = Catalog.attributes + tuple(sorted(nutrients))
+    matrix = np.zeros((len(names), len(attributes)))
+    for k, attribute in enumerate(attributes):
+        values = foods[attribute][food_rows] * grams / 100
+        matrix[:, k] = np.bincount(meal_rows, weights=values, minlength=len(names))
+
+    lazy_meals = LazyMeals(foods, names, (meal_rows, food_rows, grams), discrete, types)
+    return Catalog.from_arrays(
+        lazy_meals, matrix, discrete, names, types, attributes=attributes
+    )
+
+
+def save_catalog(catalog, directory):
+    """
+    Save the arrays of a compiled catalog as NumPy files in a directory, to be loaded
+    memory-mapped with `load_saved_catalog`.
+    """
+    catalog = compile_catalog(catalog)
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "matrix.npy"), catalog.matrix)
+    np.save(os.path.join(directory, "discrete.npy"), catalog.discrete)
+    np.save(os.path.join(directory, "names.npy"), catalog.names.astype(str))
+    types = ["" if value is None else value for value in catalog.types]
+    np.save(os.path.join(directory, "types.npy"), np.array(types, dtype=str))
+    attributes = np.array(catalog.attributes, dtype=str)
+    np.save(os.path.join(directory, "attributes.npy"), attributes)
+
+
+def load_saved_catalog(directory, meals=None, mmap_mode="r"):
+    """
+    Load a catalog saved with `save_catalog`, memory-mapping the arrays so that only the
+    pages that are used are read. The `meals` of the catalog may be given, e.g. from
+    `load_catalog`, otherwise they are the names of the meals.
+    """
+    matrix = np.load(os.path.join(directory, "matrix.npy"), mmap_mode=mmap_mode)
+    discrete = np.load(os.path.join(directory, "discrete.npy"), mmap_mode=mmap_mode)
+    names = np.load(os.path.join(directory, "names.npy"), mmap_mode=mmap_mode)
+    types = np.load(os.path.join(directory, "types.npy"), mmap_mode=mmap_mode)
+    types = [value or None for value in types.tolist()]
+    attributes = np.load(os.path.join(directory, "attributes.npy")).tolist()
+    meals = names.tolist() if meals is None else meals
+    return Catalog.from_arrays(
+        meals, matrix, discrete, names, types, attributes=attributes
+    )
+
+
+def write_tables(meals, foods_path, recipes_path):
+    """Write the foods and the recipes of meals to CSV files, e.g. to migrate data.py."""
+    foods = list(dict.fromkeys(food for meal in meals for food in meal.foods))
+    nutrients = list(dict.fromkeys(name for food in foods for name in food.nutrients))
+    with open(foods_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(FOOD_COLUMNS + tuple(nutrients))
+        for food in foods:
+            row = [getattr(food, column) for column in FOOD_COLUMNS]
+            writer.writerow(row + [food.nutrients.get(name, "") for name in nutrients])
+
+    with open(recipes_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(RECIPE_COLUMNS)
+        for meal in meals:
+            for food, grams in meal.foods.items():
+                type_ = "" if meal.type is None else meal.type
+                writer.writerow([meal.name, food.name, grams, meal.discrete, type_])
+
+
+def _floats(values):
+    """Return a column as floats, where empty strings (e.g. in a CSV file) are 0."""
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = np.where(values == "", "0", values)
+    return values.astype(float)
+
+
+def test_load_catalog():
+    """Example: The catalog loaded from tables equals the catalog from data.py."""
+    import tempfile
+
+    # A food with a nutrient beyond the macros is written as an extra column
+    oats = Food("havregryn", 13.5, 7.0, 58.7, 372, 17.9, 1000, {"fiber": 10.1})
+    meal_list = list(meals.values()) + [Meal("oatmeal", {oats: 60}, discrete=False)]
+    with tempfile.TemporaryDirectory() as directory:
+        foods_path = os.path.join(directory, "foods.csv")
+        recipes_path = os.path.join(directory, "recipes.csv")
+        write_tables(meal_list, foods_path, recipes_path)
+        catalog = load_catalog(foods_path, recipes_path)
+
+        expected = compile_catalog(meal_list)
+        assert np.allclose(catalog.matrix, expected.matrix)
+        assert np.all(catalog.discrete == expected.discrete)
+        assert list(catalog.names) == list(expected.names)
+        assert list(catalog.types) == list(expected.types)
+        assert catalog.attributes == expected.attributes
+
+        # No meal is created until it's used, and then it equals the original meal
+        assert not catalog.meals._meals
+        assert catalog.meals[-1] == meal_list[-1]
+        assert len(catalog.meals._meals) == 1
+
+        # The saved arrays are memory-mapped
+        save_catalog(catalog, directory)
+        saved = load_saved_catalog(directory, meals=catalog.meals)
+        assert np.array_equal(saved.matrix, catalog.matrix)
+        assert list(saved.types) == list(catalog.types)
+        assert saved.attributes == catalog.attributes
+        assert isinstance(saved.matrix.base, np.memmap)
+
+
+def test_solve_catalog():
+    """Example: Meal plans over subsets of loaded catalogs, without Meal objects."""
+    import tempfile
+
+    from candidates import optimize_mealplan_candidates
+    from optimizing_meals import optimize_mealplan
+
+    meal_list = list(meals.values())
+    dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    meals_limits = [(None, 0)] + [(None, None)] * (len(meal_list) - 1)
+    params = {"num_days": 1, "num_meals": 3, "prune_dominated": True}
+    with tempfile.TemporaryDirectory() as directory:
+        foods_path = os.path.join(directory, "foods.csv")
+        recipes_path = os.path.join(directory, "recipes.csv")
+        write_tables(meal_list, foods_path, recipes_path)
+        catalog = load_catalog(foods_path, recipes_path)
+        save_catalog(catalog, directory)
+
+        # The meals of a saved catalog are only their names
+        for loaded in (catalog, load_saved_catalog(directory)):
+            x, results_data = optimize_mealplan(
+                loaded, dietary_constraints, meals_limits=meals_limits, params=params
+            )
+            assert len(x) == len(meal_list) and x[0] == [0]
+            x, results_data = optimize_mealplan_candidates(
+                loaded, dietary_constraints, params=params, num_candidates=3
+            )
+            assert len(x) == len(meal_list)
+        assert not catalog.meals._meals
+
+
+def test_kcal_errors():
+    """Example: Foods where the kcal do not match the macros are found in one pass."""
+
+    columns = {
+        "name": ["good", "bad"],
+        "protein": [10.0, 10.0],
+        "fat": [10.0, 10.0],
+        "carbs": [10.0, 10.0],
+        "kcal": [170, 500],
+        "price_per_product": [10.0, 10.0],
+        "grams_per_product": [100, 100],
+    }
+    table = FoodTable(columns)
+    assert list(table.kcal_errors()) == [False, True]
+
+
+if __name__ == "__main__":
+    test_load_catalog()
+    test_solve_catalog()
+    test_kcal_errors()
@@ -27,282 +27,1313 @@ program as a HTML file and print it for your fridge. Tested with markdown2 2.3.8
 
 """
 from data import meals
+from classes import Catalog, compile_catalog
+from feasibility import analyze_feasibility
+from pruning import prune_catalog
+from cache import problem_key
+from render import render_markdown
+from plans import OUTPUTS, as_array, as_list, format_plan
+import os
 import statistics
+import time
+import warnings
 
+import numpy as np
 from ortools.linear_solver import pywraplp
 
+# Solver backends: name -> (OR-Tools solver id, whether the solver uses hints)
+BACKENDS = {
+    "CBC": ("CBC", False),
+    "SCIP": ("SCIP", True),
+    "CP-SAT": ("SAT", True),
+}
+
+# Backends that ignore integrality, used to solve the LP relaxation of a model
+RELAXATIONS = {"GLOP": ("GLOP", False)}
+
+# Stop criteria that are set as solver specific parameters: name -> format, per backend.
+# The relative MIP gap is set through OR-Tools, and is supported by every backend.
+STOP_CRITERIA = {
+    "CBC": {},
+    "SCIP": {
+        "absolute_gap": "limits/absgap = {}",
+        "solution_limit": "limits/solutions = {}",
+    },
+    "CP-SAT": {"absolute_gap": "absolute_gap_limit:{}"},
+}
+
 # =============================================================================
-# FUNCTIONS - Used to generate the meal plan
+# CLASSES - Used to build the model once and re-solve it
 # =============================================================================
 
 
-def optimize_mealplan(meals, dietary_constraints, *, meals_limits=None, params=None):
-    """Optimize the quantitiy of each meal in a day, given constraints."""
-
-    # =============================================================================
-    #     PARSE INPUT ARGUMENTS
-    # =============================================================================
-
-    assert isinstance(meals, (list, tuple))
-    assert isinstance(dietary_constraints, (dict,))
-    assert isinstance(params, (dict,))
-    assert (meals_limits is None) or isinstance(meals_limits, (list, tuple))
+class MealPlanModel:
+    """
+    A meal planning model that is built once, and can be solved repeatedly. Between
+    solves the dietary constraints, the objective weights and the limits on the meals
+    may be updated in place, which is much faster than building a new model. Changing
+    the catalog, `num_days` or `num_meals` requires a new model. The dietary
+    constraints may be on any nutrient of the catalog, see `Catalog.nutrients`, e.g.
+    the macros and the nutrients of the foods in `nutrient_table`.
+
+    The solver is chosen with `params["backend"]`, one of the keys in `BACKENDS`. The
+    CP-SAT solver only handles integer variables, so there the quantity of a meal that
+    is not discrete is an integer number of `params["portion_resolution"]` portions,
+    and the search runs on `params["num_workers"]` threads.
+
+    The time spent in each phase of building, updating and solving the model is
+    reported in `results_data["timings"]`, and passed to `params["profiler"]`, a
+    callable profiler(phase, seconds), e.g. to feed a metrics pipeline.
+
+    The plan `x` is returned as a list of lists, or in the form `params["output"]`,
+    one of the `OUTPUTS` in plans.py: 'list', 'array' or 'coo'.
+
+    With `params["tighten_bounds"]` (the default), M2 is derived from M1 and the
+    calories of the meals, and cuts on the kcal range tighten the LP relaxation. Set it
+    to False for the formulation with M1 and M2 as given. Passing `params["M2"]` while
+    the bounds are tightened raises a ValueError, since it would not be used.
+
+    A boolean (meals x days) `availability` mask limits the meals that may be chosen
+    on each day, e.g. to seasonal meals. Variables and constraints are only created for
+    the available pairs, so the size of the model scales with their number. The other
+    entries of `self.x` and `self.z` hold a single variable that is fixed to zero.
+
+    Examples
+    --------
+    >>> meal_list = list(meals.values())
+    >>> model = MealPlanModel(meal_list, {"kcal": (1800, 1800)}, params={"num_days": 1})
+    >>> x, results_data = model.solve()
+    >>> model.update_dietary_constraints({"kcal": (1800, 1800), "protein": (150, None)})
+    >>> x, results_data = model.solve()
+    >>> model.update_weights(weight_price=0.5)
+    >>> model.update_meals_limits([(None, 0)] + [(None, None)] * (len(meal_list) - 1))
+    >>> x, results_data = model.solve()
+    >>> x[0]
+    [0.0]
+    """
+
+    def __init__(
+        self,
+        meals,
+        dietary_constraints,
+        *,
+        meals_limits=None,
+        params=None,
+        availability=None,
+    ):
+
+        # =========================================================================
+        #     PARSE INPUT ARGUMENTS
+        # =========================================================================
+
+        assert isinstance(meals, (list, tuple, Catalog))
+        assert isinstance(dietary_constraints, (dict,))
+        assert (params is None) or isinstance(params, (dict,))
+        assert (meals_limits is None) or isinstance(meals_limits, (list, tuple))
+
+        # The coefficients of every meal are computed once, and read from the catalog
+        self.catalog = compile_catalog(meals)
+        self.meals = self.catalog.meals
+        assert all(key in self.catalog.nutrients for key in dietary_constraints.keys())
+
+        if params is None:
+            params = dict()
+        self.params = params = _with_slots(params)
+        if availability is not None:
+            availability = np.asarray(availability, dtype=bool)
+            assert availability.shape == (len(self.meals), params.get("num_days", 1))
+        self.availability = availability
+
+        # The time spent in each phase of building and solving the model, in seconds.
+        # A `params["profiler"]` is called as profiler(phase, seconds) after each phase.
+        self.profiler = params.get("profiler", None)
+        self.timings = dict()
+        self.num_nonzeros = 0
+        self._lap_start = time.perf_counter()
+
+        # =========================================================================
+        #     ERROR CHECKING AND USER INPUT SANITATION
+        # =========================================================================
+
+        # Conflicting constraints are found in milliseconds, before creating a solver
+        self._check_feasibility(dietary_constraints, meals_limits)
+        self._lap("validation")
+
+        # Get parameters
+        self.num_days = num_days = params.get("num_days", 1)
+        self.num_meals = params.get("num_meals", 4)
+        self.time_limit_secs = time_limit_secs = params.get("time_limit_secs", 10)
+        self.timed_out = False
+
+        # With slots, each day has `slots[t]` meals of type t, see `_with_slots`. Meals
+        # of a type without slots are fixed to zero.
+        self.slots = slots = params.get("slots", None)
+        self.allowed = np.ones(len(self.meals), dtype=bool)
+        if slots is not None:
+            self.allowed = np.array(
+                [t in slots for t in self.catalog.types], dtype=bool
+            )
 
-    meals = meals.copy()
-    dietary_constraints = dietary_constraints.copy()
+        # The (meals x days) pairs that get variables
+        shape = (len(self.meals), num_days)
+        self.available = available = np.broadcast_to(self.allowed[:, None], shape)
+        if availability is not None:
+            self.available = available = available & availability
+
+        # A small number such as 0.001. x_ij >= EPSILON <=> z_ij = 1
+        self.EPSILON = EPSILON = params.get("epsilon", 1e-3)
+
+        # These weights found to be good by in experiments
+        self.weights = {
+            "weight_price": params.get("weight_price", 0.1),
+            "weight_nutrients": params.get("weight_nutrients", 2.0),
+            "weight_range": params.get("weight_range", 0.75),
+        }
+
+        # Used for normalization of the cost associated with price
+        self.expected_daily_price = params.get("expected_daily_price", 75)
+
+        self.M1 = M1 = params.get("M1", 20)  # Upper bound on x_ij
+        self.M2 = M2 = params.get(
+            "M2", 20
+        )  # Upper bound on x[i][j] * meal.kcal, i.e. calories in a meal
+
+        # Replace M1 by an upper bound per meal, see `_x_bounds`, and M2 by the most
+        # calories a chosen meal may have, which is always a valid M2. The kcal range
+        # is tightened by cuts, see below.
+        self.tighten_bounds = params.get("tighten_bounds", True)
+        if self.tighten_bounds and "M2" in params:
+            raise ValueError(
+                "'M2' is derived when 'tighten_bounds' is True, set it to False to "
+                "use the given M2."
+            )
+        if self.tighten_bounds:
+            self.x_bounds = _x_bounds(self.catalog, M1, EPSILON)
+            self.x_bounds[~self.allowed] = 0
+            self.M2 = M2 = float((self.catalog["kcal"] * self.x_bounds).max())
+        else:
+            self.x_bounds = np.full(len(self.meals), float(M1))
 
-    if meals_limits is None:
-        meals_limits = [(None, None) for meal in meals]
+        # Formatting a name for every variable is slow on large models, so it's optional
+        self.names = names = params.get("variable_names", False)
 
-    if params is None:
-        params = dict()
+        # Create a solver and an objective function
+        self.backend = backend = params.get("backend", "CBC")
+        if backend not in BACKENDS and backend not in RELAXATIONS:
+            raise ValueError(
+                f"Unknown backend '{backend}', use one of {list(BACKENDS)}."
+            )
+        solver_id, self.uses_hints = {**BACKENDS, **RELAXATIONS}[backend]
+        self.output = params.get("output", "list")
+        if self.output not in OUTPUTS:
+            raise ValueError(f"Unknown output '{self.output}', use one of {OUTPUTS}.")
+        self.solver = solver = pywraplp.Solver.CreateSolver(solver_id)
+        if solver is None:
+            raise RuntimeError(f"The backend '{backend}' is not available.")
+        solver.set_time_limit(int(time_limit_secs * 1000))
+        self.objective_function = solver.Objective()
+        self._set_stop_criteria(params)
+        INF = solver.infinity()
+
+        # The quantity of meal i is x_ij = unit_i * (solution value of variable x_ij)
+        discrete = self.catalog.discrete
+        if backend == "CP-SAT":
+            solver.SetNumThreads(params.get("num_workers", os.cpu_count()))
+            self.unit = np.where(discrete, 1.0, params.get("portion_resolution", 0.01))
+            x_integer, x_upper = True, self.x_bounds / self.unit
+        else:
+            self.unit = np.ones(len(self.meals))
+            x_integer = discrete
+            x_upper = self.x_bounds if self.tighten_bounds else None
+
+        # =========================================================================
+        #     CREATE VARIABLES
+        # =========================================================================
+
+        # Variables are stored in (meals x days) object arrays, so that constraints can
+        # be created from slices of them and arrays of coefficients. Pairs that are not
+        # available share a variable fixed to zero, and get no constraints of their own.
+        zero = None if np.all(available) else solver.Var(0, 0, False, "zero")
+        x_options = dict(upper=x_upper, integer=x_integer, where=available, fill=zero)
+        self.x = x = _new_variables(solver, shape, "x", names, **x_options)
+        self._x_integer = np.broadcast_to(x_integer, (len(self.meals),))
+        units = np.broadcast_to(self.unit[:, None], shape)[available]
+        z_options = dict(upper=1, integer=True, where=available, fill=zero)
+        self.z = z = _new_variables(solver, shape, "z", names, **z_options)
+        self._lap("variables")
+
+        # These constraints ensure that z_ij = 1 iff x_ij >= EPSILON
+        eps = EPSILON / 10
+        x_and_z = np.stack([x[available], z[available]], axis=-1)
+        coefficients = np.stack([-units, np.full(len(units), EPSILON)], axis=-1)
+        self._add_constraints(x_and_z, coefficients, -INF, 0)
+        big_M = np.broadcast_to(self.x_bounds[:, None], shape)[available]
+        coefficients = np.stack([units, -(big_M + eps)], axis=-1)
+        self._add_constraints(x_and_z, coefficients, -INF, EPSILON - eps)
+        self._lap("constraints")
+
+        # =========================================================================
+        #     CREATE CONSTRAINTS / OBJECTIVE FUNCTION TERM
+        # =========================================================================
+
+        # OBJECTIVE FUNCTION TERM 1: Total price of the meals in the program
+        # OBJECTIVE FUNCTION TERM 2: Deviation from nutrients (on a daily basis)
+        # The coefficients depend on the weights and on the dietary constraints, and
+        # are set in `_update_objective`. The constraints with slack variables are
+        # created on demand in `update_dietary_constraints`.
+        self._nutrient_rows = dict()
+
+        # OBJECTIVE FUNCTION TERM 3: Minimal range on calories (on a daily basis)
+        kcals = self.catalog["kcal"]
+        kcal_upper = M2 if self.tighten_bounds else None
+        self.lower = lower = _new_variables(
+            solver, num_days, "lower_kcal", names, upper=kcal_upper
+        )
+        self.upper = upper = _new_variables(
+            solver, num_days, "upper_kcal", names, upper=kcal_upper
+        )
+        self._lap("variables")
+
+        # lower_j <= x_ij * kcal_i + (1 - z_ij) * M2 and upper_j >= x_ij * kcal_i
+        kcals_ij = np.broadcast_to(kcals[:, None], shape)[available] * units
+        ones = np.ones(len(units))
+        lower_j = np.broadcast_to(lower, shape)[available]
+        lower_x_z = np.stack([lower_j, x[available], z[available]], axis=-1)
+        coefficients = np.stack([ones, -kcals_ij, np.full(len(units), M2)], axis=-1)
+        self._add_constraints(lower_x_z, coefficients, -INF, M2)
+        upper_j = np.broadcast_to(upper, shape)[available]
+        upper_x = np.stack([upper_j, x[available]], axis=-1)
+        coefficients = np.stack([ones, -kcals_ij], axis=-1)
+        self._add_constraints(upper_x, coefficients, 0, INF)
+
+        # Cuts on the kcal range: the smallest meal of a day has no more calories than
+        # the average meal, nor than the largest meal. Every plan meets them, but in the
+        # LP relaxation a fractional z_ij lets (1 - z_ij) * M2 push lower_j up to M2.
+        if self.tighten_bounds:
+            kcals_j = (kcals * self.unit)[:, None] * available
+            lower_x = np.column_stack([lower, x.T])
+            num_meals_j = np.full(num_days, self.num_meals)
+            coefficients = np.column_stack([num_meals_j, -kcals_j.T])
+            self._add_constraints(lower_x, coefficients, -INF, 0)
+            self._add_constraints(np.column_stack([lower, upper]), [1, -1], -INF, 0)
+
+        # HARD CONSTRAINT 1 : Number of meals per day, or of each type with slots. The
+        # slots of a type are interchangeable, so the variables are not split by slot.
+        if slots is None:
+            self._add_constraints(z.T, available.T, self.num_meals, self.num_meals)
+        else:
+            for meal_type, count in slots.items():
+                of_type = self.catalog.types == meal_type
+                if np.any(of_type):
+                    self._add_constraints(
+                        z[of_type].T, available[of_type].T, count, count
+                    )
+
+        # HARD CONSTRAINT 2: Number of times a food is used
+        # Created on demand in `update_meals_limits`, one constraint per limited meal
+        self._limit_rows = dict()
+
+        # SYMMETRY BREAKING: Every day has the same constraints and objective terms, so
+        # any permutation of the days of a solution is an equally good solution. Order
+        # the days by a score of their meals, sum_i 2^i * z_ij, non-increasing in j. This
+        # is a lexicographic ordering of the z-vectors, on the first meals at least.
+        # The days are put in a varied order again in `solve`.
+        # Days with different meals available are not alike, and are not reordered.
+        self.break_symmetry = (
+            params.get("break_symmetry", True)
+            and num_days > 1
+            and bool(np.all(available == available[:, :1]))
+        )
+        if self.break_symmetry:
+            self._day_scores = scores = 2.0 ** np.minimum(np.arange(len(z)), 16)
+            consecutive = np.concatenate([z[:, :-1].T, z[:, 1:].T], axis=1)
+            scores = scores * available[:, 0]
+            coefficients = np.concatenate([scores, -scores])
+            self._add_constraints(consecutive, coefficients, 0, INF)
+
+        self._set_meals_limits(meals_limits)
+        self._lap("constraints")
+        self._set_dietary_constraints(dietary_constraints)
+        self._lap("dietary_constraints")
+
+    def update_dietary_constraints(self, dietary_constraints):
+        """Replace the dietary constraints, e.g. {'kcal': (1800, 2000), ...}."""
+        assert isinstance(dietary_constraints, (dict,))
+        assert all(key in self.catalog.nutrients for key in dietary_constraints.keys())
+
+        self._lap_start = time.perf_counter()
+        self._check_feasibility(dietary_constraints, self.meals_limits)
+        self._set_dietary_constraints(dietary_constraints)
+        self._lap("update", reset=True)
+
+    def _set_dietary_constraints(self, dietary_constraints):
+        self.dietary_constraints = dietary_constraints.copy()
+        INF = self.solver.infinity()
+
+        # Nutrients that are no longer constrained have their rows relaxed
+        constrained = [macro for (macro, _) in self._nutrient_rows]
+        for macro in dict.fromkeys(list(dietary_constraints) + constrained):
+            low, high = dietary_constraints.get(macro, (None, None))
+
+            # Slack variables related to the lower limit. Only "undershooting" is
+            # penalized. Slack variables related to the upper limit. Only "overshooting"
+            # is penalized. A limit of None relaxes the constraints of every day.
+            for side, rhs in (("low", low), ("up", high)):
+                if rhs is None and (macro, side) not in self._nutrient_rows:
+                    continue
+                constraints, _, _ = self._get_nutrient_rows(macro, side)
+                for constraint in constraints:
+                    if rhs is None:
+                        constraint.SetBounds(-INF, INF)
+                    else:
+                        constraint.SetBounds(rhs, rhs)
+
+        self._update_objective()
+
+    def update_weights(
+        self, *, weight_price=None, weight_nutrients=None, weight_range=None
+    ):
+        """Update the weights of the terms in the objective function."""
+        weights = {
+            "weight_price": weight_price,
+            "weight_nutrients": weight_nutrients,
+            "weight_range": weight_range,
+        }
+        self._lap_start = time.perf_counter()
+        self.weights.update({k: v for (k, v) in weights.items() if v is not None})
+        self._update_objective()
+        self._lap("update", reset=True)
+
+    def update_meals_limits(self, meals_limits):
+        """Replace the limits on the number of times each meal is used."""
+        assert (meals_limits is None) or isinstance(meals_limits, (list, tuple))
+
+        self._lap_start = time.perf_counter()
+        self._check_feasibility(None, meals_limits)
+        self._set_meals_limits(meals_limits)
+        self._lap("update", reset=True)
+
+    def _set_meals_limits(self, meals_limits):
+        if meals_limits is None:
+            meals_limits = [(None, None)] * len(self.meals)
+
+        self.meals_limits = list(meals_limits)
+        INF = self.solver.infinity()
+
+        for i, (low, high) in enumerate(meals_limits):
+            if (low, high) == (None, None) and i not in self._limit_rows:
+                continue
+            if i not in self._limit_rows:
+                self._limit_rows[i] = self.solver.Constraint(-INF, INF)
+                for variable in self.z[i][self.available[i]]:
+                    self._limit_rows[i].SetCoefficient(variable, 1)
+                self.num_nonzeros += int(self.available[i].sum())
+            self._limit_rows[i].SetBounds(
+                -INF if low is None else low, INF if high is None else high
+            )
 
-    # Get parameters
-    num_days = params.get("num_days", 1)
-    num_meals = params.get("num_meals", 4)
-    time_limit_secs = params.get("time_limit_secs", 10)
+    def _set_stop_criteria(self, params):
+        """
+        Stop the search before the time limit once the relative gap is at most
+        `params["relative_gap"]`, the absolute gap at most `params["absolute_gap"]`,
+        or `params["solution_limit"]` solutions are found. A ValueError is raised if
+        the backend does not support a criterion.
+        """
+        self._solver_parameters = pywraplp.MPSolverParameters()
+        if params.get("relative_gap") is not None:
+            self._solver_parameters.SetDoubleParam(
+                pywraplp.MPSolverParameters.RELATIVE_MIP_GAP, params["relative_gap"]
+            )
 
-    # A small number such as 0.001. x_ij >= EPSILON <=> z_ij = 1
-    EPSILON = params.get("epsilon", 1e-3)
+        formats = dict(STOP_CRITERIA.get(self.backend, dict()))
+        if self.backend == "CP-SAT" and params.get("solution_limit") == 1:
+            formats["solution_limit"] = "stop_after_first_solution:true"
+        specific = []
+        for criterion in ("absolute_gap", "solution_limit"):
+            if params.get(criterion) is None:
+                continue
+            if criterion not in formats:
+                raise ValueError(
+                    f"The backend '{self.backend}' does not support '{criterion}'."
+                )
+            specific.append(formats[criterion].format(params[criterion]))
+        if specific:
+            self.solver.SetSolverSpecificParametersAsString("\n".join(specific))
+
+    def solve(self, initial_solution=None):
+        """
+        Solve the model, and return the solution as `optimize_mealplan` does.
+
+        A previous solution `x` (e.g. last week's plan) may be given as the
+        `initial_solution`. It's passed to the solver as a hint, and if it's feasible
+        it's kept as an incumbent: should the solver fail to find a better solution
+        within the time limit, the initial solution is returned. Whether it was used
+        is reported in `results_data["initial_solution_used"]`.
+
+        The `results_data["status"]` is 'OPTIMAL' if the plan is proven optimal,
+        'FEASIBLE' if the search stopped before that (at the time limit, or by a stop
+        criterion), and 'TIMEOUT_NO_SOLUTION' if no plan was found in time. In the
+        latter case `x` is None. CBC reports a problem as infeasible if it stops at the
+        time limit without a plan, which is returned as 'TIMEOUT_NO_SOLUTION' too. If
+        the solver stops without a plan before the time limit, although the problem is
+        known to be feasible, the status is 'NO_SOLUTION' and `x` is None. Whether the
+        time limit was hit is kept in `timed_out`.
+        """
+
+        # =========================================================================
+        #     SOLVE THE OPTIMIZATION PROBLEM
+        # =========================================================================
+
+        solver = self.solver
+        for phase in ("hint", "solve", "postprocess"):
+            self.timings.pop(phase, None)
+
+        self._lap_start = time.perf_counter()
+        incumbent = None
+        if initial_solution is None:
+            solver.SetHint([], [])
+        else:
+            incumbent = self._set_initial_solution(initial_solution)
+        self._lap("hint")
+
+        # Minimize the deviation from the goal
+        result_status = solver.Solve(self._solver_parameters)
+        solved = result_status in (solver.OPTIMAL, solver.FEASIBLE)
+        status = "OPTIMAL" if result_status == solver.OPTIMAL else "FEASIBLE"
+        self._lap("solve")
+
+        # Keep the initial solution unless the solver found a strictly better one
+        if incumbent is not None:
+            x, z, obj_func_value = incumbent
+            if not solved or obj_func_value < solver.Objective().Value() - 1e-9:
+                return self._results(
+                    x, z, obj_func_value, status=status, initial_solution_used=True
+                )
+
+        # CBC reports INFEASIBLE if it stops at the time limit before finding a plan.
+        # That's no proof of infeasibility, and neither is it when the hard constraints
+        # are known to be feasible, see `_check_feasibility`.
+        self.timed_out = timed_out = self.timings["solve"] >= self.time_limit_secs
+        if result_status == solver.INFEASIBLE and not (
+            timed_out or self._proven_feasible
+        ):
+            raise RuntimeError("Infeasible problem.")
+        if result_status in (solver.INFEASIBLE, solver.NOT_SOLVED):
+            status = "TIMEOUT_NO_SOLUTION" if timed_out else "NO_SOLUTION"
+            return self._results(None, None, None, status=status)
+        if not solved:
+            raise RuntimeError(f"The solver failed with status {result_status}.")
+
+        assert solver.VerifySolution(1e-7, True)
+
+        # =========================================================================
+        #     POSTPROCESS THE SOLUTION AND RETURN
+        # =========================================================================
+
+        # Parse the variables and get the solution values
+        x = _solution_values(self.x) * self.unit[:, None]
+        z = _solution_values(self.z)
+
+        # Similar days are next to each other after the symmetry breaking, so spread
+        # them out. The order of the days does not change the objective function.
+        if self.break_symmetry:
+            order = _varied_day_order(z)
+            x, z = x[:, order], z[:, order]
+
+        used = (initial_solution is not None) and self.uses_hints
+        obj_func_value = solver.Objective().Value()
+        return self._results(
+            x, z, obj_func_value, status=status, initial_solution_used=used
+        )
 
-    # These weights found to be good by in experiments
-    weight_price = params.get("weight_price", 0.1)
-    weight_nutrients = params.get("weight_nutrients", 2.0)
-    weight_range = params.get("weight_range", 0.75)
+    def solve_anytime(self, initial_solution=None, *, first_time_limit_secs=0.25):
+        """
+        Solve the model, generating improving plans as (x, results_data) while the
+        search runs, e.g. to show a plan to an interactive user at once.
+
+        OR-Tools offers no incumbent callbacks in Python, so the model is solved in
+        stages. The first stage has a time limit of `first_time_limit_secs`, and every
+        following stage twice that of the previous one, starting from the best plan so
+        far. A plan is generated when it improves on the previous one or is proven
+        optimal. The stages end when the plan is optimal, a stop criterion is met or
+        `params["time_limit_secs"]` is spent. The last plan generated is the result. If
+        no plan is found, (None, results_data) is generated with the status of the last
+        stage, 'TIMEOUT_NO_SOLUTION' or 'NO_SOLUTION', see `solve`.
+
+        Each stage starts a new search, from the best plan so far as a hint. With CBC
+        the branch-and-bound tree is built again from scratch, so a stage repeats the
+        work of the stages before it: proving optimality takes up to the sum of the
+        stage limits, about twice the time of a single solve. Once a stage returns an
+        optimal plan, no further stages are run.
+        """
+        time_limit_secs = self.params.get("time_limit_secs", 10)
+        relative_gap = self.params.get("relative_gap", None)
+        absolute_gap = self.params.get("absolute_gap", None)
+        start_time = time.perf_counter()
+        stage_limit_secs = first_time_limit_secs
+        best_value = None
+
+        try:
+            while True:
+                remaining = time_limit_secs - (time.perf_counter() - start_time)
+                stage_secs = max(min(stage_limit_secs, remaining), 0.001)
+                self.time_limit_secs = stage_secs
+                self.solver.set_time_limit(int(stage_secs * 1000))
+                x, results_data = self.solve(initial_solution=initial_solution)
+                results_data["wall_time"] = round(time.perf_counter() - start_time, 3)
+
+                value, status = results_data["obj_func_value"], results_data["status"]
+                if x is not None:
+                    improved = best_value is None or value < best_value - 1e-9
+                    if improved or status == "OPTIMAL":
+                        yield x, results_data
+                    best_value = value if improved else best_value
+                    initial_solution = x
+
+                    # The gap is relative to the objective function value
+                    mip_gap = results_data["mip_gap"]
+                    stop = (relative_gap is not None and mip_gap <= relative_gap) or (
+                        absolute_gap is not None
+                        and mip_gap * abs(value) <= absolute_gap
+                    )
+                    if status == "OPTIMAL" or stop:
+                        return
+
+                if stage_secs >= remaining:
+                    break
+                stage_limit_secs *= 2
+        finally:
+            self.time_limit_secs = time_limit_secs
+            self.solver.set_time_limit(int(time_limit_secs * 1000))
+
+        if best_value is None:
+            yield x, results_data
+
+    def _results(self, x, z, obj_func_value, *, status, initial_solution_used=False):
+        """
+        Return x in the form of `params["output"]`, and a dictionary with data on the
+        solution. If no solution was found, x is None and so are the values that depend
+        on it.
+        """
+        solver = self.solver
+        obj_func_value_rounded, total_price, mip_gap = None, None, None
+
+        if x is not None:
+            # If the food is chosen, x_ij is no smaller than epsilon
+            x = np.where(z > 0.5, np.maximum(x, self.EPSILON), 0)
+
+            # Compute the total price
+            total_price = round(float(self.catalog["price"] @ x.sum(axis=1)), 1)
+
+            # The relative gap between the objective function value and the best bound
+            best_bound = solver.Objective().BestBound()
+            mip_gap = abs(obj_func_value - best_bound) / max(abs(obj_func_value), 1e-9)
+            mip_gap = round(mip_gap, 6)
+            obj_func_value_rounded = round(obj_func_value, 6)
+            x = format_plan(x, self.output)
+
+        self._lap("postprocess")
+        return (
+            x,
+            {
+                "status": status,
+                "obj_func_value": obj_func_value_rounded,
+                "wall_time": round(self.timings["solve"], 3),
+                "iterations": solver.iterations(),
+                "total_price": total_price,
+                "initial_solution_used": initial_solution_used,
+                "nodes": solver.nodes(),
+                "mip_gap": mip_gap,
+                "num_variables": solver.NumVariables(),
+                "num_constraints": solver.NumConstraints(),
+                "num_nonzeros": self.num_nonzeros,
+                "timings": {k: round(v, 6) for (k, v) in self.timings.items()},
+                "backend": self.backend,
+            },
+        )
 
-    # Used for normalization of the cost associated with price
-    expected_daily_price = params.get("expected_daily_price", 75)
+    def _lap(self, phase, *, reset=False):
+        """
+        Add the time since the previous lap to the time spent in `phase`, and pass it
+        to the profiler. If `reset` is True, the time replaces that of earlier laps.
+        """
+        now = time.perf_counter()
+        seconds = now - self._lap_start
+        self._lap_start = now
+        self.timings[phase] = seconds + (0 if reset else self.timings.get(phase, 0))
+        if self.profiler is not None:
+            self.profiler(phase, seconds)
+
+    def _add_constraints(self, variables, coefficients, lower, upper, *, keep=False):
+        """Add constraints with `_add_constraints`, counting the nonzero coefficients."""
+        variables = np.asarray(variables, dtype=object)
+        coefficients = np.broadcast_to(
+            np.asarray(coefficients, dtype=float), variables.shape
+        )
+        self.num_nonzeros += int(np.count_nonzero(coefficients))
+        return _add_constraints(
+            self.solver, variables, coefficients, lower, upper, keep=keep
+        )
 
-    M1 = params.get("M1", 20)  # Upper bound on x_ij
-    M2 = params.get(
-        "M2", 20
-    )  # Upper bound on x[i][j] * meal.kcal, i.e. calories in a meal
-
-    # A strange bug is that sometime the optimizer will return INFEASIBLE on attempt #1,
-    # but calling this function again with the same inputs works. So we allow calling it
-    # two times. This is very hacky and not suitable for production, but it works for
-    # 'hobby usage'.
-    first_call = params.get("first_call", True)
-
-    # Create a solver and an objective function
-    solver = pywraplp.Solver("meals", pywraplp.Solver.CBC_MIXED_INTEGER_PROGRAMMING)
-    solver.set_time_limit(time_limit_secs * 1000)
-    objective_function = 0
-    INF = solver.infinity()
-
-    # =============================================================================
-    #     ERROR CHECKING AND USER INPUT SANITATION
-    # =============================================================================
-
-    # Error checking
-    meals_total = num_days * num_meals
-    maximum_limit = sum(9999 if high is None else high for (low, high) in meals_limits)
-    if maximum_limit < meals_total:
-        msg = f"Cannot achieve {meals_total} totals meals with a total of {maximum_limit} meals."
-        raise RuntimeError(msg)
-
-    allowed_macros = ("kcal", "protein", "fat", "carbs")
-    assert all(key in allowed_macros for key in dietary_constraints.keys())
-
-    assert len(meals_limits) == len(meals)
-
-    # =============================================================================
-    #     CREATE VARIABLES
-    # =============================================================================
-
-    x = [[None for j in range(num_days)] for i in range(len(meals))]
-    z = [[None for j in range(num_days)] for i in range(len(meals))]
-
-    # Loop over every combination of meal and days, create variables
-    for i, meal in enumerate(meals):
-        for j in range(num_days):
-            z[i][j] = solver.IntVar(0, 1, f"z_{i}{j}")
-
-            if meal.discrete:
-                x[i][j] = solver.IntVar(0, INF, f"x_{i}{j}")
-            else:
-                x[i][j] = solver.NumVar(0, INF, f"x_{i}{j}")
-
-            # These constraints ensure that z_ij = 1 iff x_ij >= EPSILON
-            solver.Add(EPSILON * z[i][j] <= x[i][j])
-            eps = EPSILON / 10
-            solver.Add(x[i][j] <= (M1 + eps) * z[i][j] + EPSILON - eps)
-
-    # =============================================================================
-    #     CREATE CONSTRAINTS / OBJECTIVE FUNCTION TERM
-    # =============================================================================
+    def _set_initial_solution(self, initial_solution):
+        """
+        Set a hint for every variable from a previous solution `x`, completing it with
+        the values of z, the slack variables and the kcal range. Returns the tuple
+        (x, z, objective function value) if the solution is feasible, else None.
+        """
+        x = np.asarray(initial_solution, dtype=float)
+        assert x.shape == self.x.shape
+        z = (x > 0).astype(float)
+        x = np.where(z > 0.5, np.maximum(x, self.EPSILON), 0)
+
+        # Round to the number of units of integer variables, e.g. for CP-SAT
+        x_units = x / self.unit[:, None]
+        x_units[self._x_integer] = np.round(x_units[self._x_integer])
+        x = x_units * self.unit[:, None]
+
+        # The hint has to satisfy the symmetry breaking, so its days are sorted. The
+        # incumbent that is returned keeps the order of the days that was given.
+        incumbent = (x, z)
+        if self.break_symmetry:
+            order = np.argsort(-(self._day_scores @ z), kind="stable")
+            x, x_units, z = x[:, order], x_units[:, order], z[:, order]
+        available = self.available
+        variables = [self.x[available], self.z[available]]
+        values = [x_units[available], z[available]]
+
+        # Slack variables: sum_i food_i * macro_i + positive - negative == limit
+        for (macro, side), (_, positive, negative) in self._nutrient_rows.items():
+            low, high = self.dietary_constraints.get(macro, (None, None))
+            limit = low if side == "low" else high
+            deviation = 0 if limit is None else limit - self.catalog[macro] @ x
+            variables += [positive, negative]
+            values += [
+                np.broadcast_to(np.maximum(deviation, 0), positive.shape),
+                np.broadcast_to(np.maximum(-deviation, 0), negative.shape),
+            ]
+
+        # The smallest and largest number of calories in a meal, each day
+        kcals = self.catalog["kcal"][:, None] * x
+        variables += [self.lower, self.upper]
+        values += [(kcals + (1 - z) * self.M2).min(axis=0), kcals.max(axis=0)]
+
+        variables = np.concatenate([v.ravel() for v in variables])
+        values = np.concatenate([v.ravel() for v in values])
+        self.solver.SetHint(variables.tolist(), values.tolist())
+
+        # The nutrients and the kcal range are soft, so only the number of meals per
+        # day, the meals limits, the bounds and integrality of the meals are checked
+        times_used = z.sum(axis=1)
+        discrete = self.catalog.discrete
+        feasible = (
+            np.all(z.sum(axis=0) == self.num_meals)
+            and not np.any(z[~available])
+            and all(
+                np.all(z[self.catalog.types == meal_type].sum(axis=0) == count)
+                for meal_type, count in (self.slots or dict()).items()
+            )
+            and np.all(x <= self.x_bounds[:, None])
+            and np.allclose(x[discrete], np.round(x[discrete]))
+            and all(
+                (low is None or times_used[i] >= low)
+                and (high is None or times_used[i] <= high)
+                for i, (low, high) in enumerate(self.meals_limits)
+            )
+        )
+        if not feasible:
+            return None
 
-    # OBJECTIVE FUNCTION TERM 1: Total price of the meals in the program
-    denom = expected_daily_price * num_days
-    for j in range(num_days):
-        daily_price = sum(x[i][j] * meal.price for i, meal in enumerate(meals))
-        objective_function += (weight_price / denom) * daily_price
+        objective_function = self.objective_function
+        obj_func_value = objective_function.offset() + sum(
+            objective_function.GetCoefficient(variable) * value
+            for (variable, value) in zip(variables.tolist(), values.tolist())
+        )
+        return incumbent + (obj_func_value,)
+
+    def _check_feasibility(self, dietary_constraints, meals_limits):
+        """
+        Raise a RuntimeError naming the constraints that clash, if any, and warn about
+        daily nutrient targets that can't be reached. With `params["conflict_report"]`
+        the meals involved in each conflict are named too.
+
+        Without an availability mask that sets the days apart the analysis is exact, so
+        a problem that passes it has a plan, and `_proven_feasible` is True.
+        """
+        report = analyze_feasibility(
+            self.catalog,
+            dietary_constraints,
+            meals_limits=meals_limits,
+            params=self.params,
+            availability=self.availability,
+            conflict_report=self.params.get("conflict_report", False),
+        )
+        if not report.feasible:
+            raise RuntimeError(str(report))
+        for msg in report.unreachable:
+            warnings.warn(msg)
+        availability = self.availability
+        self._proven_feasible = availability is None or bool(
+            np.all(availability == availability[:, :1])
+        )
 
-    # OBJECTIVE FUNCTION TERM 2: Deviation from nutrients (on a daily basis)
-    for j in range(num_days):
-        for macro, (low, high) in dietary_constraints.items():
+    def _get_nutrient_rows(self, macro, side):
+        """
+        Return the constraints (one per day) and the positive and negative slack
+        variables for the lower ('low') or upper ('up') limit on a macro, creating them
+        if needed.
+        """
+        if (macro, side) in self._nutrient_rows:
+            return self._nutrient_rows[(macro, side)]
+
+        # One row per day: sum_i food_i * macro_i, followed by two slack variables
+        solver, num_days, names = self.solver, self.num_days, self.names
+        INF = solver.infinity()
+        values = self.catalog[macro] * self.unit * self.available.T
+        coefficients = np.column_stack([values, np.ones(num_days), -np.ones(num_days)])
+        name = f"{side}_lim_{macro}"
+        positive = _new_variables(solver, num_days, "over_" + name, names)
+        negative = _new_variables(solver, num_days, "under_" + name, names)
+        variables = np.column_stack([self.x.T, positive, negative])
+        constraints = self._add_constraints(
+            variables, coefficients, -INF, INF, keep=True
+        )
 
-            # No point in adding any constraints if it's None
-            if low is None and high is None:
+        self._nutrient_rows[(macro, side)] = (constraints, positive, negative)
+        return self._nutrient_rows[(macro, side)]
+
+    def _update_objective(self):
+        """Set every coefficient of the objective function."""
+        objective_function = self.objective_function
+        num_days, num_meals = self.num_days, self.num_meals
+        weight_price = self.weights["weight_price"]
+        weight_nutrients = self.weights["weight_nutrients"]
+        weight_range = self.weights["weight_range"]
+
+        # OBJECTIVE FUNCTION TERM 1: Total price of the meals in the program
+        denom = self.expected_daily_price * num_days
+        prices = self.catalog["price"] * self.unit
+        prices = prices[:, None] * self.available
+        _set_coefficients(objective_function, self.x, (weight_price / denom) * prices)
+
+        # OBJECTIVE FUNCTION TERM 2: Deviation from nutrients (on a daily basis)
+        for (macro, side), (_, positive, negative) in self._nutrient_rows.items():
+            low, high = self.dietary_constraints.get(macro, (None, None))
+            limit = low if side == "low" else high
+
+            # Undershooting the lower limit, or overshooting the upper limit, is penalized
+            penalized = positive if side == "low" else negative
+
+            # No point in penalizing deviations from a limit that is None
+            if limit is None:
+                _set_coefficients(objective_function, penalized, 0)
                 continue
 
-            food_macros = [getattr(meal, macro) for meal in meals]
-
-            # Create the sum: sum_i food_i * macro_i
-            x_meals = [x[i][j] for i in range(len(meals))]
-            total_macro = sum(c * x for x, c in zip(x_meals, food_macros))
-
             # The maximal deviation in a day is approx mean([low, high]) * nutrients
             # The maximal deviation is the above times the number of days
             denom = statistics.mean(
                 [value for value in [low, high] if value is not None]
             )
             denom = denom * num_days  # * len(dietary_constraints)
+            _set_coefficients(objective_function, penalized, weight_nutrients / denom)
 
-            # Slack variables related to the lower limit. Only "undershooting" is penalized.
-            if low is not None:
-                low_positive = solver.NumVar(0, INF, "over_low_lim_" + macro + str(j))
-                low_negative = solver.NumVar(0, INF, "under_low_lim_" + macro + str(j))
-                solver.Add(total_macro + low_positive - low_negative == low)
-                objective_function += (weight_nutrients / denom) * low_positive
-
-            # Slack variables related to the upper limit. Only "overshooting" is penalized.
-            if high is not None:
-                high_positive = solver.NumVar(0, INF, "over_up_lim_" + macro + str(j))
-                high_negative = solver.NumVar(0, INF, "under_upp_lim_" + macro + str(j))
-                solver.Add(total_macro + high_positive - high_negative == high)
-                objective_function += (weight_nutrients / denom) * high_negative
-
-    # OBJECTIVE FUNCTION TERM 3: Minimal range on calories (on a daily basis)
-    for j in range(num_days):
-        lower = solver.NumVar(0, INF, f"lower_kcal_{j}")
-        upper = solver.NumVar(0, INF, f"upper_kcal_{j}")
-
-        for i, meal in enumerate(meals):
-
-            solver.Add(lower <= x[i][j] * meal.kcal + (1 - z[i][j]) * M2)
-            solver.Add(upper >= x[i][j] * meal.kcal)
-
+        # OBJECTIVE FUNCTION TERM 3: Minimal range on calories (on a daily basis)
         # The maximal spread per day is approximately mean([kcal_low, kcal_high]) / meals
         # The maximal spread is the above times the number of days. Normalize w.r.t this
         denom = statistics.mean(
-            [value for value in dietary_constraints["kcal"] if value is not None]
+            [value for value in self.dietary_constraints["kcal"] if value is not None]
         )
         denom = denom * num_days / num_meals
-        objective_function += (weight_range / denom) * (upper - lower)
+        _set_coefficients(objective_function, self.upper, weight_range / denom)
+        _set_coefficients(objective_function, self.lower, -weight_range / denom)
 
-    # HARD CONSTRAINT 1 : Number of meals per day
-    for j in range(num_days):
-        solver.Add(sum(z[i][j] for i in range(len(meals))) == num_meals)
+        objective_function.SetMinimization()
 
-    # HARD CONSTRAINT 2: Number of times a food is used
-    for i, (meal, (low, high)) in enumerate(zip(meals, meals_limits)):
 
-        times_used = sum(z[i])
-        assert len(z[i]) == num_days
+# =============================================================================
+# FUNCTIONS - Used to generate the meal plan
+# =============================================================================
 
-        # Add lower limit
-        if low is not None:
-            if low > num_days:
-                msg = f"Lower limit on '{meal.name}' is {low}, but there are {num_days} days."
-                raise RuntimeError(msg)
-            solver.Add(times_used >= low)
 
-        # Add upper limit
-        if high is not None:
-            solver.Add(times_used <= high)
-
-    # =============================================================================
-    #     SOLVE THE OPTIMIZATION PROBLEM
-    # =============================================================================
-
-    # Minimize the deviation from the goal
-    solver.Minimize(objective_function)
-    result_status = solver.Solve()
-    if result_status == solver.INFEASIBLE:
-
-        if first_call:
-            params["first_call"] = False
-            return optimize_mealplan(
-                meals=meals,
-                dietary_constraints=dietary_constraints,
-                meals_limits=meals_limits,
-                params=params,
-            )
+def optimize_mealplan(
+    meals,
+    dietary_constraints,
+    *,
+    meals_limits=None,
+    params=None,
+    initial_solution=None,
+    availability=None,
+):
+    """
+    Optimize the quantitiy of each meal in a day, given constraints. A previous
+    solution `x` may be given as `initial_solution`, see `MealPlanModel.solve`.
+
+    The days are only coupled by the limits on the meals, and the objective function
+    is an average over the days. Without limits that couple the days, every day of an
+    optimal plan may be the optimal single day, so a single day is solved and repeated
+    unless `params["aggregate_days"]` is False.
+
+    With `params["prune_dominated"]`, duplicate and dominated meals are removed before
+    the model is built (see `prune_catalog`), and reported in
+    `results_data["pruned_meals"]`. The plan `x` still has a row for every meal.
+
+    With a `SolutionCache` as `params["cache"]`, a problem with the same contents as
+    one solved before is not solved again, see `cache.py`. Whether the plan came from
+    the cache is reported in `results_data["cache_hit"]`.
+
+    With `params["mode"]` set to 'heuristic', the plan is built in milliseconds by a
+    greedy algorithm and a local search, without a MIP solver, see heuristic.py. With
+    `params["heuristic_start"]`, such a plan is the initial solution of the MIP.
+
+    With `params["slots"]`, e.g. {"breakfast": 1, "lunch": 1, "dinner": 2}, each day
+    has that many meals of each `Meal.type`, see `MealPlanModel`.
+
+    A boolean (meals x days) `availability` mask limits the meals that may be chosen
+    on each day. Meals that can't be used at all (with no available day, an upper limit
+    of 0 or a type without slots) are left out of the model, and the model only has
+    variables for the available (meal, day) pairs of the others.
+    """
+    params = _with_slots(dict() if params is None else params)
+    if params.get("cache", None) is not None:
+        return _optimize_cached(
+            meals,
+            dietary_constraints,
+            meals_limits,
+            params,
+            initial_solution,
+            availability,
+        )
+    if params.get("mode", "mip") == "heuristic":
+        # The heuristic module imports this one, so it's imported when it's used
+        from heuristic import optimize_mealplan_heuristic
+
+        x, results_data = optimize_mealplan_heuristic(
+            meals,
+            dietary_constraints,
+            meals_limits=meals_limits,
+            params=params,
+            availability=availability,
+        )
+        callback = params.get("incumbent_callback", None)
+        if callback is not None:
+            callback(x, results_data)
+        return x, results_data
+
+    # Meals that can't be used are left out of the model
+    unusable = np.zeros(len(meals), dtype=bool)
+    if meals_limits is not None:
+        unusable |= [high is not None and high <= 0 for (_, high) in meals_limits]
+    if availability is not None:
+        availability = np.asarray(availability, dtype=bool)
+        unusable |= ~availability.any(axis=1)
+    slots = params.get("slots", None)
+    if slots is not None:
+        unusable |= [t not in slots for t in compile_catalog(meals).types]
+    if np.any(unusable):
+        catalog = compile_catalog(meals)
+        report = analyze_feasibility(
+            catalog,
+            None,
+            meals_limits=meals_limits,
+            params=params,
+            availability=availability,
+        )
+        if not report.feasible:
+            raise RuntimeError(str(report))
+        return _optimize_subset(
+            catalog,
+            np.flatnonzero(~unusable),
+            dietary_constraints,
+            meals_limits,
+            params,
+            initial_solution,
+            availability,
+        )
 
-        else:
-            raise RuntimeError("Infeasible problem.")
+    if params.get("prune_dominated", False):
+        catalog = compile_catalog(meals)
+        report = prune_catalog(
+            catalog,
+            dietary_constraints,
+            meals_limits=meals_limits,
+            params=params,
+            availability=availability,
+        )
+        return _optimize_subset(
+            catalog,
+            report.kept,
+            dietary_constraints,
+            meals_limits,
+            dict(params, prune_dominated=False),
+            initial_solution,
+            availability,
+            pruned_meals=list(report.removed.values()),
+        )
 
-    assert solver.VerifySolution(1e-7, True)
-
-    # =============================================================================
-    #     POSTPROCESS THE SOLUTION AND RETURN
-    # =============================================================================
-
-    # Parse the variables and get the solution values
-    for j in range(num_days):
-        for i, meal in enumerate(meals):
-            x[i][j] = x[i][j].solution_value()
-            z[i][j] = z[i][j].solution_value()
-
-            # Food is chosen
-            if z[i][j] > 0.5:
-                # If the food is chosen, x_ij is no smaller than epsilon
-                x[i][j] = max(x[i][j], EPSILON)
-            else:
-                x[i][j] = 0
-
-    # Compute the total price
-    total_price = 0
-    for j in range(num_days):
-        daily_price = sum(x[i][j] * meal.price for i, meal in enumerate(meals))
-        total_price += daily_price
-
-    return (
-        x,
-        {
-            "obj_func_value": round(solver.Objective().Value(), 6),
-            "wall_time": round(solver.wall_time() / 1000, 3),
-            "iterations": solver.iterations(),
-            "total_price": round(total_price, 1),
-        },
+    num_days = params.get("num_days", 1)
+    interchangeable = meals_limits is None or all(
+        (low is None or low <= 0) and (high is None or high >= num_days)
+        for (low, high) in meals_limits
     )
+    interchangeable = interchangeable and (
+        availability is None or np.all(availability == availability[:, :1])
+    )
+    aggregate = params.get("aggregate_days", True) and interchangeable
+    if num_days > 1 and aggregate and initial_solution is None:
+        model = MealPlanModel(
+            meals,
+            dietary_constraints,
+            meals_limits=None,
+            params=dict(params, num_days=1),
+            availability=None if availability is None else availability[:, :1],
+        )
+        repeat = num_days
+    else:
+        model = MealPlanModel(
+            meals,
+            dietary_constraints,
+            meals_limits=meals_limits,
+            params=params,
+            availability=availability,
+        )
+        repeat = 1
+
+    # A hint is only a help, so the model is solved without one if the heuristic fails
+    if params.get("heuristic_start", False) and initial_solution is None:
+        from heuristic import heuristic_plan
+
+        try:
+            initial_solution, _ = heuristic_plan(
+                model.catalog,
+                dietary_constraints,
+                meals_limits=model.meals_limits,
+                params=model.params,
+                availability=model.availability,
+            )
+        except RuntimeError:
+            initial_solution = None
+
+    # Improving plans are passed to the callback while solving, see `solve_anytime`
+    callback = params.get("incumbent_callback", None)
+    if callback is None:
+        x, results_data = model.solve(initial_solution=initial_solution)
+        return _repeat_days(x, results_data, repeat, model.output)
+    for x, results_data in model.solve_anytime(initial_solution=initial_solution):
+        x, results_data = _repeat_days(x, results_data, repeat, model.output)
+        callback(x, results_data)
+    return x, results_data
+
+
+def _optimize_cached(
+    meals, dietary_constraints, meals_limits, params, initial_solution, availability
+):
+    """Return a cached meal plan, or optimize the meal plan and store it."""
+    cache = params["cache"]
+    key = problem_key(
+        meals,
+        dietary_constraints,
+        meals_limits=meals_limits,
+        params=params,
+        initial_solution=initial_solution,
+        availability=availability,
+    )
+    solution = cache.get(key)
+    if solution is not None:
+        x, results_data = solution
+        x = format_plan(x, params.get("output", "list"))
+        results_data["cache_hit"] = True
+        callback = params.get("incumbent_callback", None)
+        if callback is not None:
+            callback(x, results_data)
+        return x, results_data
 
+    x, results_data = optimize_mealplan(
+        meals,
+        dietary_constraints,
+        meals_limits=meals_limits,
+        params=dict(params, cache=None),
+        initial_solution=initial_solution,
+        availability=availability,
+    )
+    # Plans found before a time limit may improve if solved again, and are not stored
+    results_data["cache_hit"] = False
+    if x is not None and results_data["status"] == "OPTIMAL":
+        cache.put(key, as_list(x), results_data)
+    return x, results_data
+
+
+def _optimize_subset(
+    catalog,
+    kept,
+    dietary_constraints,
+    meals_limits,
+    params,
+    initial_solution,
+    availability=None,
+    **results,
+):
+    """
+    Optimize a meal plan over the meals `kept` of a catalog, and map it back to every
+    meal. The keyword arguments are added to `results_data`.
+    """
+    num_days = params.get("num_days", 1)
 
-def print_results(x, meals, results_data, *, verbose=True):
-    """Print the results in Markdown."""
-
-    num_meals = len(x)
-    num_days = len(x[0])
+    def full_plan(x, results_data):
+        results_data.update(results)
+        if x is None:
+            return x, results_data
+        x_full = np.zeros((len(catalog), num_days))
+        x_full[kept] = as_array(x)
+        return format_plan(x_full, params.get("output", "list")), results_data
+
+    params = dict(params)
+    callback = params.get("incumbent_callback", None)
+    if callback is not None:
+        params["incumbent_callback"] = lambda *plan: callback(*full_plan(*plan))
+    if meals_limits is not None:
+        meals_limits = [meals_limits[i] for i in kept]
+    if initial_solution is not None:
+        initial_solution = as_array(initial_solution)[kept].tolist()
+    if availability is not None:
+        availability = np.asarray(availability, dtype=bool)[kept]
 
-    print(f"# Meal plan")
-    for day_num in range(num_days):
+    x, results_data = optimize_mealplan(
+        catalog.subset(kept),
+        dietary_constraints,
+        meals_limits=meals_limits,
+        params=params,
+        initial_solution=initial_solution,
+        availability=availability,
+    )
+    return full_plan(x, results_data)
+
+
+def _with_slots(params):
+    """
+    Return the parameters with `num_meals` set to the number of slots per day, if
+    `params["slots"]` is given. Raises a ValueError if `num_meals` is another number.
+
+    Examples
+    --------
+    >>> _with_slots({"slots": {"breakfast": 1, "dinner": 2}})
+    {'slots': {'breakfast': 1, 'dinner': 2}, 'num_meals': 3}
+    """
+    slots = params.get("slots", None)
+    if slots is None:
+        return params
+    num_meals = sum(slots.values())
+    if params.get("num_meals", num_meals) != num_meals:
+        raise ValueError(
+            f"The slots add up to {num_meals} meals, but num_meals is {params['num_meals']}."
+        )
+    return dict(params, num_meals=num_meals)
+
+
+def _repeat_days(x, results_data, num_days, output):
+    """Repeat the single day of a plan `num_days` times."""
+    if x is None or num_days == 1:
+        return x, results_data
+    results_data["total_price"] = round(results_data["total_price"] * num_days, 1)
+    return format_plan(np.tile(as_array(x), (1, num_days)), output), results_data
+
+
+def evaluate_mealplan(x, meals, dietary_constraints, *, params=None):
+    """
+    Return the objective function value of a meal plan `x`, as the optimizer would
+    compute it given the same arguments. Computed with NumPy, without a solver, so it's
+    fast enough to compare plans found by other means (e.g. stitched together).
+
+    Examples
+    --------
+    >>> meal_list = list(meals.values())
+    >>> dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    >>> x, results_data = optimize_mealplan(meal_list, dietary_constraints)
+    >>> value = evaluate_mealplan(x, meal_list, dietary_constraints)
+    >>> abs(value - results_data["obj_func_value"]) < 1e-5
+    True
+    """
+    catalog = compile_catalog(meals)
+    params = _with_slots(dict() if params is None else params)
+    x = np.asarray(x, dtype=float)
+    z = (x > 0).astype(float)
+    num_days = x.shape[1]
+    num_meals = params.get("num_meals", 4)
+    weight_price = params.get("weight_price", 0.1)
+    weight_nutrients = params.get("weight_nutrients", 2.0)
+    weight_range = params.get("weight_range", 0.75)
+    expected_daily_price = params.get("expected_daily_price", 75)
+    # With tightened bounds, M2 is at least the kcal of any chosen meal
+    M2 = np.inf if params.get("tighten_bounds", True) else params.get("M2", 20)
 
-        x_day = [x[i][day_num] for i in range(num_meals)]
+    # OBJECTIVE FUNCTION TERM 1: Total price of the meals in the program
+    denom = expected_daily_price * num_days
+    objective = (weight_price / denom) * float(catalog["price"] @ x.sum(axis=1))
 
-        result = list((m, qnty) for (m, qnty) in zip(meals, x_day) if qnty > 0)
+    # OBJECTIVE FUNCTION TERM 2: Deviation from nutrients (on a daily basis)
+    for macro, (low, high) in dietary_constraints.items():
+        if low is None and high is None:
+            continue
+        total_macro = catalog[macro] @ x
+        denom = statistics.mean([value for value in [low, high] if value is not None])
+        denom = denom * num_days
+        if low is not None:
+            objective += (weight_nutrients / denom) * np.maximum(
+                low - total_macro, 0
+            ).sum()
+        if high is not None:
+            objective += (weight_nutrients / denom) * np.maximum(
+                total_macro - high, 0
+            ).sum()
 
-        # Heuristics to get more carbohydrates earlier in the day
-        result = sorted(result, key=lambda r: r[0].carbs * r[1], reverse=True)
-        price = int(sum(meal.price * qnty for (meal, qnty) in result))
-        print(f"\n## Day {day_num + 1} (price: {price} NOK)")
+    # OBJECTIVE FUNCTION TERM 3: Minimal range on calories (on a daily basis)
+    kcals = catalog["kcal"][:, None] * x
+    lower = np.maximum(np.where(z > 0.5, kcals, M2).min(axis=0), 0)
+    upper = kcals.max(axis=0)
+    denom = statistics.mean(
+        [value for value in dietary_constraints["kcal"] if value is not None]
+    )
+    denom = denom * num_days / num_meals
+    objective += (weight_range / denom) * float((upper - lower).sum())
+
+    return float(objective)
+
+
+def _x_bounds(catalog, M1, EPSILON):
+    """
+    Return an upper bound on the quantity of each meal. It's M1, rounded down for
+    discrete meals, but no bound is below the smallest portion of a meal (unless M1
+    is). Only the hard constraints are used: the dietary limits are soft, and a meal
+    that overshoots one by itself may still be part of an optimal plan.
+
+    Examples
+    --------
+    >>> catalog = compile_catalog(list(meals.values()))
+    >>> catalog.discrete[:2]
+    array([False,  True])
+    >>> _x_bounds(catalog, 20.5, 1e-3)[:2]
+    array([20.5, 20. ])
+    """
+    bounds = np.full(len(catalog), float(M1))
+    bounds = np.where(catalog.discrete, np.floor(bounds), bounds)
+    smallest_portion = np.where(catalog.discrete, 1.0, EPSILON)
+    return np.minimum(np.maximum(bounds, smallest_portion), M1)
+
+
+def _varied_day_order(z):
+    """
+    Return an order of the days (the columns of z) in which consecutive days have
+    few meals in common. Starting with the first day, the next day is the one with the
+    fewest meals in common with the previous day, the first such day in case of ties.
+
+    Examples
+    --------
+    >>> z = np.array([[1, 1, 0], [1, 1, 0], [0, 0, 1]])
+    >>> _varied_day_order(z)
+    [0, 2, 1]
+    """
+    z = np.asarray(z) > 0.5
+    common = z.T.astype(int) @ z.astype(int)
+    order, remaining = [0], list(range(1, z.shape[1]))
+    while remaining:
+        following = min(remaining, key=lambda day: common[order[-1], day])
+        order.append(following)
+        remaining.remove(following)
+    return order
+
+
+def _new_variables(
+    solver,
+    shape,
+    name,
+    names=False,
+    *,
+    upper=None,
+    integer=False,
+    where=None,
+    fill=None,
+):
+    """
+    Return an object array of new, non-negative variables. The arguments `upper` and
+    `integer` are scalars, or arrays with one entry per row. Names such as 'x_3_14' are
+    only formatted if `names` is True, since doing so for every variable is slow. With
+    a boolean array `where`, only its True entries get a new variable, and the others
+    are set to `fill`.
+    """
+    upper = solver.infinity() if upper is None else upper
+    variables = np.empty(shape, dtype=object)
+    upper = np.broadcast_to(np.asarray(upper, dtype=float), variables.shape[:1])
+    upper = upper.tolist()
+    integer = np.broadcast_to(integer, variables.shape[:1]).tolist()
+    indices = np.ndindex(variables.shape)
+    if where is not None and not np.all(where):
+        variables[...] = fill
+        indices = zip(*(index.tolist() for index in np.nonzero(where)))
+    for index in indices:
+        var_name = "_".join(map(str, (name,) + index)) if names else ""
+        variables[index] = solver.Var(0, upper[index[0]], integer[index[0]], var_name)
+    return variables
+
+
+def _add_constraints(
+    solver, variables, coefficients, lower, upper, *, keep=False, chunk_size=4096
+):
+    """
+    Add one constraint per row of the 2D array `variables`:
+
+        lower[k] <= sum_l coefficients[k, l] * variables[k, l] <= upper[k]
+
+    The coefficients and the bounds are broadcast, so a single row of coefficients or
+    scalar bounds may be shared by every constraint. Zero coefficients are skipped.
+    Rows are converted to Python objects in chunks, to keep the peak memory low. The
+    constraints are only returned if `keep` is True, since holding on to a Python
+    object per constraint is costly on large models.
+    """
+    variables = np.asarray(variables, dtype=object)
+    num_rows = variables.shape[0]
+    coefficients = np.broadcast_to(
+        np.asarray(coefficients, dtype=float), variables.shape
+    )
+    lower = np.broadcast_to(np.asarray(lower, dtype=float), (num_rows,))
+    upper = np.broadcast_to(np.asarray(upper, dtype=float), (num_rows,))
+
+    constraints = []
+    for start in range(0, num_rows, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        rows = zip(
+            variables[chunk].tolist(),
+            coefficients[chunk].tolist(),
+            lower[chunk].tolist(),
+            upper[chunk].tolist(),
+        )
+        for row_variables, row_coefficients, row_lower, row_upper in rows:
+            constraint = solver.Constraint(row_lower, row_upper)
+            for variable, coefficient in zip(row_variables, row_coefficients):
+                if coefficient:
+                    constraint.SetCoefficient(variable, coefficient)
+            if keep:
+                constraints.append(constraint)
+    return constraints
+
+
+def _set_coefficients(objective, variables, coefficients):
+    """Set the objective coefficients of an array of variables (broadcasting)."""
+    variables = np.asarray(variables, dtype=object)
+    coefficients = np.broadcast_to(
+        np.asarray(coefficients, dtype=float), variables.shape
+    )
+    for variable, coefficient in zip(variables.ravel(), coefficients.ravel().tolist()):
+        objective.SetCoefficient(variable, coefficient)
 
-        print(f"\n### Meals\n")
-        for meal, qnty in result:
-            qnty = round(qnty, 1)
-            if qnty % 1 == 0:
-                qnty = int(qnty)
 
-            print(f"- {round(qnty, 1)} x {str(meal)}")
+def _solution_values(variables):
+    """Return a float array with the solution values of an array of variables."""
+    values = [variable.solution_value() for variable in variables.ravel()]
+    return np.array(values, dtype=float).reshape(variables.shape)
 
-        if not verbose:
-            continue
 
-        print(f"\n### Statistics\n")
-        for macro in ["kcal", "protein", "fat", "carbs"]:
-            macro_distr = [getattr(meal, macro) * qnty for (meal, qnty) in result]
-            macro_distr_r = [int(round(m)) for m in macro_distr]
-            print(f"- Total {macro}: {int(round(sum(macro_distr)))} {macro_distr_r}")
+def print_results(x, meals, results_data, *, verbose=True):
+    """Print the results in Markdown, see `render_markdown`."""
+    for chunk in render_markdown(x, meals, verbose=verbose):
+        print(chunk, end="")
 
 
 def test_single_day():
@@ -379,6 +1410,406 @@ def test_several_days():
     assert True
 
 
+def test_initial_solution():
+    """Example: Re-planning, starting from a previous meal plan."""
+
+    params = {"num_days": 2, "num_meals": 4}
+    dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    meal_list = list(meals.values())
+
+    x, results_data = optimize_mealplan(
+        meals=meal_list, dietary_constraints=dietary_constraints, params=params
+    )
+    assert not results_data["initial_solution_used"]
+
+    # With almost no time, the previous plan is kept unless the solver improves on it
+    params["time_limit_secs"] = 0.01
+    x_new, results_data_new = optimize_mealplan(
+        meals=meal_list,
+        dietary_constraints=dietary_constraints,
+        params=params,
+        initial_solution=x,
+    )
+    assert results_data_new["obj_func_value"] <= results_data["obj_func_value"]
+
+
+def test_backends():
+    """Example: The same problem solved with every solver backend."""
+
+    dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    meal_list = list(meals.values())
+
+    results = dict()
+    for backend in BACKENDS:
+        params = {"num_days": 1, "num_meals": 4, "backend": backend}
+        results[backend] = optimize_mealplan(
+            meals=meal_list, dietary_constraints=dietary_constraints, params=params
+        )
+
+    # CP-SAT approximates the quantities of meals that are not discrete
+    x, results_data = results["CBC"]
+    for backend, (x_backend, results_data_backend) in results.items():
+        assert results_data_backend.keys() == results_data.keys()
+        assert np.array(x_backend).shape == np.array(x).shape
+        difference = (
+            results_data_backend["obj_func_value"] - results_data["obj_func_value"]
+        )
+        assert abs(difference) < 0.005
+
+
+def test_symmetry_breaking():
+    """Example: Interchangeable days are ordered, or solved once if not coupled."""
+
+    dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    meal_list = list(meals.values())
+    meals_limits = [(None, 2)] + [(None, 1) for meal in meal_list[1:]]
+
+    results = dict()
+    for break_symmetry in (False, True):
+        params = {"num_days": 2, "num_meals": 4, "break_symmetry": break_symmetry}
+        results[break_symmetry] = optimize_mealplan(
+            meals=meal_list,
+            dietary_constraints=dietary_constraints,
+            meals_limits=meals_limits,
+            params=params,
+        )
+    values = [results_data["obj_func_value"] for (x, results_data) in results.values()]
+    assert abs(values[0] - values[1]) < 1e-6
+
+    # Without limits every day is the best single day
+    params = {"num_days": 3, "num_meals": 4}
+    x, results_data = optimize_mealplan(meal_list, dietary_constraints, params=params)
+    x_day, results_day = optimize_mealplan(meal_list, dietary_constraints)
+    assert np.allclose(np.array(x), np.array(x_day))
+    assert results_data["obj_func_value"] == results_day["obj_func_value"]
+
+
+def test_profiler():
+    """Example: The time spent in each phase is passed to a profiler."""
+
+    timings = dict()
+
+    def profiler(phase, seconds):
+        timings[phase] = timings.get(phase, 0) + seconds
+
+    params = {"num_days": 2, "num_meals": 4, "profiler": profiler}
+    meal_list = list(meals.values())
+    meals_limits = [(None, 2)] + [(None, 1) for meal in meal_list[1:]]
+    x, results_data = optimize_mealplan(
+        meals=meal_list,
+        dietary_constraints={"kcal": (1800, 1800)},
+        meals_limits=meals_limits,
+        params=params,
+    )
+
+    assert timings.keys() == results_data["timings"].keys()
+    assert {"validation", "variables", "constraints", "solve"} <= timings.keys()
+    assert results_data["num_nonzeros"] > results_data["num_variables"] > 0
+    assert results_data["mip_gap"] < 1e-3
+
+    # The wall time is that of the solve, not counting the time since the model was
+    # built
+    model = MealPlanModel(
+        meal_list,
+        dietary_constraints={"kcal": (1800, 1800)},
+        meals_limits=meals_limits,
+        params={"num_days": 2, "num_meals": 4},
+    )
+    time.sleep(0.5)
+    start_time = time.perf_counter()
+    x, results_data = model.solve()
+    assert results_data["wall_time"] <= round(time.perf_counter() - start_time, 3)
+    assert results_data["wall_time"] == round(results_data["timings"]["solve"], 3)
+
+
+def test_anytime():
+    """Example: Improving plans are streamed while solving, with a status."""
+
+    dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    meal_list = list(meals.values())
+    meals_limits = [(None, 2)] + [(None, 1) for meal in meal_list[1:]]
+    plans = []
+
+    params = {"num_days": 2, "incumbent_callback": lambda *plan: plans.append(plan)}
+    x, results_data = optimize_mealplan(
+        meal_list, dietary_constraints, meals_limits=meals_limits, params=params
+    )
+    assert (x, results_data) == plans[-1]
+    assert results_data["status"] == "OPTIMAL"
+    values = [results_data["obj_func_value"] for (x, results_data) in plans]
+    assert values == sorted(values, reverse=True)
+
+    # No stage is run after an optimal plan is found
+    solves = []
+    params = {"num_days": 2, "profiler": lambda phase, secs: solves.append(phase)}
+    model = MealPlanModel(
+        meal_list, dietary_constraints, meals_limits=meals_limits, params=params
+    )
+    plans = list(model.solve_anytime(first_time_limit_secs=10))
+    assert [results_data["status"] for (x, results_data) in plans] == ["OPTIMAL"]
+    assert solves.count("solve") == 1
+
+    # CBC reports INFEASIBLE if the time limit is hit before a plan is found
+    from benchmark import generate_problem
+
+    problem = generate_problem(200, 7, 4)
+    problem["params"] = {**problem["params"], "time_limit_secs": 0.01}
+    model = MealPlanModel(**problem)
+    plans = list(model.solve_anytime(first_time_limit_secs=0.005))
+    assert len(plans) == 1 and model.timed_out
+    x, results_data = plans[0]
+    assert x is None and results_data["status"] == "TIMEOUT_NO_SOLUTION"
+    assert results_data["obj_func_value"] is None
+
+    # CBC only stops early on the relative gap
+    params = {"num_days": 2, "absolute_gap": 0.01}
+    try:
+        optimize_mealplan(meal_list, dietary_constraints, params=params)
+    except ValueError as error:
+        assert "does not support 'absolute_gap'" in str(error)
+    else:
+        assert False
+
+
+def test_infeasible():
+    """Example: Conflicting limits are reported without solving the problem."""
+
+    params = {"num_days": 2, "num_meals": 4, "conflict_report": True}
+    meal_list = list(meals.values())
+    meals_limits = [(None, 1) for meal in meal_list]
+
+    try:
+        optimize_mealplan(
+            meals=meal_list,
+            dietary_constraints={"kcal": (1800, 1800)},
+            meals_limits=meals_limits,
+            params=params,
+        )
+    except RuntimeError as error:
+        assert "Cannot achieve 8 totals meals with a total of 7 meals" in str(error)
+        assert "scoop protein shake" in str(error)
+    else:
+        assert False
+
+
+def test_short_time_limit():
+    """Example: A feasible problem is never reported as infeasible at a time limit."""
+
+    from benchmark import generate_problem
+
+    # CBC stops at the time limit before it finds a plan for a week of 200 meals
+    problem = generate_problem(200, 7, 4)
+    for time_limit_secs in (0.001, 0.01):
+        problem["params"] = {**problem["params"], "time_limit_secs": time_limit_secs}
+        model = MealPlanModel(**problem)
+        x, results_data = model.solve()
+        assert model.timed_out and model._proven_feasible
+        assert x is None and results_data["status"] == "TIMEOUT_NO_SOLUTION"
+
+    # The feasibility analysis proves there is a plan, so a solver that stops early
+    # on a limit of its own reports that it found none
+    model = MealPlanModel(**problem)
+    model.time_limit_secs = 10
+    x, results_data = model.solve()
+    assert not model.timed_out
+    assert x is None and results_data["status"] == "NO_SOLUTION"
+
+
+def test_slots():
+    """Example: Every day has a meal of each type with slots, and no other meals."""
+
+    from classes import Meal
+
+    types = ["snack", "breakfast", "dinner", "dinner", "breakfast", "snack", "lunch"]
+    meal_list = [
+        Meal(meal.name, meal.foods, meal.discrete, type=meal_type)
+        for (meal, meal_type) in zip(meals.values(), types)
+    ]
+    dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    slots = {"breakfast": 1, "lunch": 1, "dinner": 2}
+    meals_limits = [(None, None)] * 6 + [(None, 2)]
+
+    for mode in ("mip", "heuristic"):
+        params = {"num_days": 2, "slots": slots, "mode": mode}
+        x, results_data = optimize_mealplan(
+            meal_list, dietary_constraints, meals_limits=meals_limits, params=params
+        )
+        chosen = np.array(x) > 0
+        for meal_type in ("breakfast", "lunch", "dinner", "snack"):
+            counts = chosen[np.array(types) == meal_type].sum(axis=0)
+            assert np.all(counts == slots.get(meal_type, 0))
+
+    # A single lunch can't be eaten on both days, if it's limited to one day
+    meals_limits[6] = (None, 1)
+    try:
+        optimize_mealplan(
+            meal_list, dietary_constraints, meals_limits=meals_limits, params=params
+        )
+    except RuntimeError as error:
+        assert "Cannot achieve 2 'lunch' meals with a total of 1 meals" in str(error)
+    else:
+        assert False
+
+    try:
+        optimize_mealplan(
+            meal_list, dietary_constraints, params=dict(num_meals=3, slots=slots)
+        )
+    except ValueError as error:
+        assert "The slots add up to 4 meals" in str(error)
+    else:
+        assert False
+
+
+def test_availability():
+    """Example: Meals are only chosen on the days they are available."""
+
+    meal_list = list(meals.values())
+    dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    params = {"num_days": 3, "num_meals": 3, "output": "array"}
+    availability = np.ones((len(meal_list), 3), dtype=bool)
+    availability[[0, 4], 1:] = False
+    availability[5] = False
+
+    for mode in ("mip", "heuristic"):
+        x, results_data = optimize_mealplan(
+            meal_list,
+            dietary_constraints,
+            params=dict(params, mode=mode),
+            availability=availability,
+        )
+        assert np.all((x > 0).sum(axis=0) == 3)
+        assert not np.any(x[~availability])
+
+    # Only the available pairs have variables and constraints
+    model = MealPlanModel(meal_list, dietary_constraints, params=params)
+    sparse = MealPlanModel(
+        meal_list, dietary_constraints, params=params, availability=availability
+    )
+    num_variables = model.solver.NumVariables() - 2 * int((~availability).sum())
+    assert sparse.solver.NumVariables() == num_variables + 1  # The zero variable
+    assert sparse.solver.NumConstraints() < model.solver.NumConstraints()
+    x, results_data = sparse.solve()
+    assert not np.any(x[~availability])
+
+    # A day needs enough meals
+    availability[1:3, 2] = False
+    try:
+        optimize_mealplan(
+            meal_list, dietary_constraints, params=params, availability=availability
+        )
+    except RuntimeError as error:
+        assert "Day 3 has 2 meals available, but needs 3." in str(error)
+    else:
+        assert False
+
+
+def test_soft_limits():
+    """Example: The bounds on x don't cut off plans that overshoot a soft limit."""
+
+    from benchmark import generate_catalog
+
+    meal_list = generate_catalog(15, seed=3, num_micronutrients=3)
+    dietary_constraints = {
+        "kcal": (None, 1200),
+        "protein": (250, None),
+        "micronutrient 0": (None, 40),
+    }
+    values = []
+    for params in ({}, {"tighten_bounds": False, "M2": 1e5}):
+        params = dict(params, num_days=1, num_meals=1)
+        x, results_data = optimize_mealplan(
+            meal_list, dietary_constraints, params=params
+        )
+        values.append(results_data["obj_func_value"])
+    assert abs(values[0] - values[1]) < 1e-6
+
+
+def test_tighten_bounds():
+    """Example: The tightened model has the same optimum, and a tighter LP relaxation."""
+
+    from benchmark import generate_problem
+
+    problem = generate_problem(10, 2, 2)
+    M2 = float(compile_catalog(problem["meals"])["kcal"].max() * 20)  # A valid M2
+    results = dict()
+    for tighten_bounds in (False, True):
+        params = dict(problem["params"], tighten_bounds=tighten_bounds)
+        if not tighten_bounds:
+            params["M2"] = M2
+        x, results_data = MealPlanModel(**dict(problem, params=params)).solve()
+
+        # The LP relaxation is a lower bound on the objective function
+        params["backend"] = "GLOP"
+        relaxation = MealPlanModel(**dict(problem, params=params))
+        relaxation.solver.Solve()
+        results[tighten_bounds] = results_data, relaxation.solver.Objective().Value()
+
+    (loose, loose_bound), (tight, tight_bound) = results[False], results[True]
+    assert abs(loose["obj_func_value"] - tight["obj_func_value"]) < 1e-4
+    assert loose_bound < 0 < tight_bound <= tight["obj_func_value"]
+    assert tight["nodes"] <= loose["nodes"]
+
+    # A given M2 would not be used with tightened bounds
+    try:
+        MealPlanModel(**dict(problem, params=dict(problem["params"], M2=M2)))
+    except ValueError as error:
+        assert "'M2' is derived" in str(error)
+    else:
+        assert False
+
+
+def test_nutrients():
+    """Example: A constraint on fiber, a nutrient beyond the macros."""
+
+    from classes import Food, Meal, compile_catalog
+
+    oats = Food(
+        name="havregryn",
+        protein=13.5,
+        fat=7.0,
+        carbs=58.7,
+        kcal=372,
+        price_per_product=17.9,
+        grams_per_product=1000,
+        nutrients={"fiber": 10.1},
+    )
+    meal_list = list(meals.values()) + [
+        Meal(name="oatmeal", foods={oats: 60}, discrete=False, type="breakfast")
+    ]
+    catalog = compile_catalog(meal_list)
+    fiber = catalog["fiber"]
+    assert fiber[-1] == 6.06 and not fiber[:-1].any()
+
+    params = {"num_days": 2, "num_meals": 3}
+    for limits in ((15, None), (None, 5)):
+        dietary_constraints = {"kcal": (1800, 1800), "fiber": limits}
+        x, results_data = optimize_mealplan(
+            meal_list, dietary_constraints, params=params
+        )
+        totals = fiber @ np.array(x)
+        assert np.all((limits[0] or 0) - 1e-6 <= totals)
+        assert np.all(totals <= (limits[1] or np.inf) + 1e-6)
+
+    try:
+        optimize_mealplan(meal_list, {"kcal": (1800, 1800), "zinc": (10, None)})
+    except AssertionError:
+        pass
+    else:
+        assert False
+
+
 if __name__ == "__main__":
     test_single_day()
     test_several_days()
+    test_initial_solution()
+    test_backends()
+    test_symmetry_breaking()
+    test_profiler()
+    test_anytime()
+    test_infeasible()
+    test_short_time_limit()
+    test_slots()
+    test_availability()
+    test_soft_limits()
+    test_tighten_bounds()
+    test_nutrients()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PLANS - Meal plans as lists, dense arrays or sparse (day, meal, quantity) triplets
+----------------------------------------------------------------------------------
+
+A meal plan `x` has a row per meal and a column per day, and only `num_meals` entries
+per day are non-zero. By default `optimize_mealplan` returns it as a list of lists.
+With `params["output"]` set to 'array' it's returned as a NumPy array, and with 'coo'
+as a `SparsePlan`, which only stores the non-zero entries. The functions below accept
+a plan in any of these forms.
+
+Examples
+--------
+>>> x = format_plan([[0, 2.0], [1.5, 0]], "coo")
+>>> x
+SparsePlan(days=[0, 1], meals=[1, 0], quantities=[1.5, 2.0], shape=(2, 2))
+>>> as_list(x)
+[[0.0, 2.0], [1.5, 0.0]]
+>>> selection_mask(x)
+array([[False,  True],
+       [ True, False]])
+"""
+import numpy as np
+
+from classes import compile_catalog
+
+OUTPUTS = ("list", "array", "coo")
+
+
+class SparsePlan:
+    """
+    A meal plan stored as the days, meals and quantities of its non-zero entries, in
+    the coordinate (COO) format, sorted by day. `shape` is (meals, days). Converts to
+    a dense array with `np.asarray`.
+    """
+
+    def __init__(self, days, meals, quantities, shape):
+        self.days = np.asarray(days, dtype=np.int64)
+        self.meals = np.asarray(meals, dtype=np.int64)
+        self.quantities = np.asarray(quantities, dtype=float)
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_array(cls, x):
+        """Create a sparse plan from a dense (meals x days) array."""
+        x = np.asarray(x, dtype=float)
+        days, meals = np.nonzero(x.T)
+        return cls(days, meals, x[meals, days], x.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.toarray().astype(dtype or float, copy=False)
+
+    def __repr__(self):
+        return (
+            f"SparsePlan(days={self.days.tolist()}, meals={self.meals.tolist()}, "
+            f"quantities={self.quantities.tolist()}, shape={self.shape})"
+        )
+
+    def toarray(self):
+        x = np.zeros(self.shape)
+        x[self.meals, self.days] = self.quantities
+        return x
+
+    def tolist(self):
+        return self.toarray().tolist()
+
+
+def format_plan(x, output="list"):
+    """Return a meal plan in one of the forms in `OUTPUTS`. None is returned as is."""
+    if x is None:
+        return None
+    if output == "list":
+        return as_list(x)
+    if output == "array":
+        return as_array(x)
+    if output == "coo":
+        return x if isinstance(x, SparsePlan) else SparsePlan.from_array(x)
+    raise ValueError(f"Unknown output '{output}', expected one of {OUTPUTS}.")
+
+
+def as_array(x):
+    """Return a meal plan as a dense (meals x days) array."""
+    return np.asarray(x, dtype=float)
+
+
+def as_list(x):
+    """Return a meal plan as a list of lists, the form `optimize_mealplan` returns."""
+    if isinstance(x, list):
+        return x
+    return as_array(x).tolist()
+
+
+def selection_mask(x):
+    """Return a boolean (meals x days) array, True where a meal is chosen on a day."""
+    return as_array(x) > 0
+
+
+def day_totals(x, meals):
+    """
+    Return the totals of the attributes of the chosen meals on each day, as a
+    (days x attributes) array with the columns in the order of `catalog.attributes`.
+
+    Examples
+    --------
+    >>> from data import meals
+    >>> x = np.zeros((len(meals), 2))
+    >>> x[4, 0] = 2
+    >>> day_totals(format_plan(x, "coo"), list(meals.values()))[:, 0]
+    array([208.6,   0. ])
+    """
+    catalog = compile_catalog(meals)
+    if not isinstance(x, SparsePlan):
+        return as_array(x).T @ catalog.matrix
+    totals = np.zeros((x.shape[1], catalog.matrix.shape[1]))
+    np.add.at(totals, x.days, catalog.matrix[x.meals] * x.quantities[:, None])
+    return totals
+
+
+def test_outputs():
+    """Example: Every output of `optimize_mealplan` gives the same plan."""
+
+    from data import meals
+    from optimizing_meals import optimize_mealplan
+
+    meal_list = list(meals.values())
+    dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    meals_limits = [(None, 1)] * len(meal_list)
+    plans = {}
+    for output in OUTPUTS:
+        params = {"num_days": 2, "num_meals": 3, "output": output}
+        plans[output], results_data = optimize_mealplan(
+            meal_list, dietary_constraints, meals_limits=meals_limits, params=params
+        )
+
+    assert isinstance(plans["list"], list)
+    assert np.array_equal(plans["array"], plans["list"])
+    assert isinstance(plans["coo"], SparsePlan)
+    assert len(plans["coo"].quantities) == 6
+    assert as_list(plans["coo"]) == plans["list"]
+
+    totals = day_totals(plans["coo"], meal_list)
+    assert np.allclose(totals, day_totals(plans["list"], meal_list))
+    # The kcal of a day are close to the target, which is a soft constraint
+    assert np.all(np.abs(totals[:, 0] - 1800) < 50)
+
+
+if __name__ == "__main__":
+    test_outputs()
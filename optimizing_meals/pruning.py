@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PRUNING - Removal of duplicate and dominated meals, before a model is built
+---------------------------------------------------------------------------
+
+Every meal adds a set of x and z variables per day to the model. In large catalogs many
+meals are duplicates of another meal, or dominated by one: per kcal, they cost more and
+have less of every macro with a lower limit (and more of every macro with an upper
+limit) than another meal. Such meals are removed here.
+
+Each day has `num_meals` distinct meals, so a dominated meal may still be part of the
+optimal plan, e.g. as the fourth best meal of a day. A meal is therefore only removed if
+`num_meals` other meals dominate it, in which case the optimal objective function value
+is unchanged. A macro with both a lower and an upper limit must be equal (per kcal)
+for one meal to dominate another, so few meals are removed with such limits. With
+`params["slots"]`, a meal is only dominated by meals of its type, and is removed if
+there are as many of them as there are slots for the type.
+"""
+import numpy as np
+
+from classes import compile_catalog
+from feasibility import analyze_feasibility
+
+
+class PruningReport:
+    """
+    The result of `prune_catalog`. `kept` holds the indices of the meals that are kept,
+    and `removed` maps the index of a removed meal to a message saying why.
+
+    Examples
+    --------
+    >>> report = PruningReport(np.arange(3))
+    >>> report.removed[3] = "'b' is a duplicate of 'a'."
+    >>> print(report)
+    Removed 1 meals: 'b' is a duplicate of 'a'.
+    """
+
+    def __init__(self, kept):
+        self.kept = kept
+        self.removed = dict()
+
+    def __str__(self):
+        return f"Removed {len(self.removed)} meals: " + " ".join(self.removed.values())
+
+
+def prune_catalog(
+    meals,
+    dietary_constraints,
+    *,
+    meals_limits=None,
+    params=None,
+    availability=None,
+    chunk_size=512,
+):
+    """
+    Find the meals that are duplicates of, or dominated by, at least `num_meals` other
+    meals. The arguments are those of `optimize_mealplan`.
+
+    Meal b dominates meal a if, per kcal, b costs no more, has no less of any macro
+    with a lower limit and no more of any macro with an upper limit, and is strictly
+    better on one of these (or is an identical meal listed before a). A day that uses
+    `a` then has a dominating meal left over, and a portion of it with the same kcal
+    is at least as good in every term of the objective. For that portion to exist, b
+    has at least the kcal of a, and is not discrete unless a is discrete with the same
+    kcal. Only meals without an upper limit in `meals_limits` may replace another, and
+    meals forced by a lower limit are kept. With an `availability` mask, b must be
+    available on every day that a is. If the problem would become infeasible, nothing
+    is removed. Rows are compared in chunks of `chunk_size`.
+
+    Examples
+    --------
+    >>> from data import meals
+    >>> from classes import Meal
+    >>> meal_list = list(meals.values())
+    >>> meal_list.append(Meal("egg (copy)", meal_list[4].foods, discrete=True))
+    >>> dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    >>> report = prune_catalog(meal_list, dietary_constraints, params={"num_meals": 1})
+    >>> print(report)
+    Removed 2 meals: 'chicken w/ sweet&sour' is dominated by 'scoop protein shake'. 'egg (copy)' is a duplicate of 'egg'.
+    >>> report.kept
+    array([0, 1, 3, 4, 5, 6])
+    """
+    catalog = compile_catalog(meals)
+    params = dict() if params is None else params
+    num_days = params.get("num_days", 1)
+    num_meals = params.get("num_meals", 4)
+    names = catalog.names
+    n = len(catalog)
+
+    if meals_limits is None:
+        meals_limits = [(None, None)] * len(catalog)
+    assert len(meals_limits) == n
+
+    # Forced meals must be kept, and only unlimited meals can replace another meal
+    forced = np.array([low is not None and low > 0 for (low, _) in meals_limits])
+    unlimited = np.array(
+        [high is None or high >= num_days for (_, high) in meals_limits]
+    )
+
+    # A meal can only be replaced on the days it's available by a meal available then
+    if availability is not None:
+        availability = np.asarray(availability, dtype=bool)
+        available, unavailable = availability.astype(float), (~availability).astype(
+            float
+        )
+
+    # With slots, a meal can only be replaced by one of the slots of its type
+    slots, types = params.get("slots", None), catalog.types
+    if slots is None:
+        needed = np.full(n, num_meals)
+    else:
+        needed = np.array([slots.get(meal_type, num_meals) for meal_type in types])
+
+    # Scores per kcal, where higher is better. Both signs of a macro with both limits
+    # are included, so that a meal only dominates another if that macro is equal.
+    kcal, discrete = catalog["kcal"], catalog.discrete
+    per_kcal = catalog.matrix / np.where(kcal > 0, kcal, 1)[:, None]
+    columns, signs = [catalog.attributes.index("price")], [-1.0]
+    for macro, (low, high) in dietary_constraints.items():
+        if macro == "kcal":
+            continue
+        column = catalog.attributes.index(macro)
+        if low is not None:
+            columns, signs = columns + [column], signs + [1.0]
+        if high is not None:
+            columns, signs = columns + [column], signs + [-1.0]
+    scores = per_kcal[:, columns] * np.array(signs)
+    tolerance = 1e-9 * np.maximum(np.abs(scores), 1)
+    identical_rows = np.column_stack([catalog.matrix, discrete])
+
+    # =============================================================================
+    #     DOMINANCE - dominates[a, b] is True if meal b dominates meal a
+    # =============================================================================
+
+    dominates = np.zeros((n, n), dtype=bool)
+    can_replace = unlimited & (kcal > 0)
+    index = np.arange(n)
+    for start in range(0, n, chunk_size):
+        a = index[start : start + chunk_size]
+        difference = scores[None, :, :] - scores[a][:, None, :]
+        at_least = np.all(difference >= -tolerance[a][:, None, :], axis=-1)
+        strictly = np.any(difference > tolerance[a][:, None, :], axis=-1)
+        identical = np.all(
+            identical_rows[None, :, :] == identical_rows[a][:, None, :], axis=-1
+        )
+        first = index[None, :] < a[:, None]
+        same_portion = ~discrete[None, :] | (
+            discrete[a][:, None] & (kcal[None, :] == kcal[a][:, None])
+        )
+        dominates[a] = (
+            at_least
+            & (strictly | (identical & first))
+            & same_portion
+            & (kcal[None, :] >= kcal[a][:, None])
+            & can_replace[None, :]
+        )
+        if slots is not None:
+            dominates[a] &= types[a][:, None] == types[None, :]
+        if availability is not None:
+            dominates[a] &= (available[a] @ unavailable.T) == 0
+    dominates[forced | (kcal <= 0)] = False
+
+    # A dominating meal has fewer meals dominating it, so going through the meals in
+    # that order, the meals dominating a meal are decided on before the meal itself
+    kept = np.ones(n, dtype=bool)
+    removed = dict()
+    for i in np.argsort(dominates.sum(axis=1), kind="stable"):
+        replacements = np.flatnonzero(dominates[i] & kept)
+        if len(replacements) >= needed[i]:
+            kept[i] = False
+            j = replacements[0]
+            if np.all(identical_rows[i] == identical_rows[j]):
+                removed[i] = f"'{names[i]}' is a duplicate of '{names[j]}'."
+            else:
+                removed[i] = f"'{names[i]}' is dominated by '{names[j]}'."
+
+    # =============================================================================
+    #     FEASIBILITY
+    # =============================================================================
+
+    kept = np.flatnonzero(kept)
+    report = analyze_feasibility(
+        catalog.subset(kept),
+        None,
+        meals_limits=[meals_limits[i] for i in kept],
+        params=params,
+        availability=None if availability is None else availability[kept],
+    )
+    if not report.feasible:
+        return PruningReport(np.arange(n))
+
+    report = PruningReport(kept)
+    report.removed = {i: removed[i] for i in sorted(removed)}
+    return report
+
+
+def test_pruning():
+    """Example: A pruned catalog gives a plan with the shape of the full catalog."""
+
+    from data import meals
+    from optimizing_meals import optimize_mealplan
+
+    meal_list = list(meals.values())
+    dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    params = {"num_days": 1, "num_meals": 1}
+
+    x, results_data = optimize_mealplan(meal_list, dietary_constraints, params=params)
+    params["prune_dominated"] = True
+    x_pruned, results_pruned = optimize_mealplan(
+        meal_list, dietary_constraints, params=params
+    )
+    assert len(x_pruned) == len(meal_list) and x_pruned[2] == [0]
+    assert results_pruned["pruned_meals"] == [
+        "'chicken w/ sweet&sour' is dominated by 'scoop protein shake'."
+    ]
+    # Meals that are not chosen may have x below epsilon, so the values differ a little
+    difference = results_pruned["obj_func_value"] - results_data["obj_func_value"]
+    assert abs(difference) < 1e-3
+
+    # A meal forced by a lower limit is kept
+    meals_limits = [(None, None), (None, None), (1, None)] + [(None, None)] * 4
+    report = prune_catalog(
+        meal_list, dietary_constraints, meals_limits=meals_limits, params=params
+    )
+    assert 2 in report.kept and not report.removed
+
+
+if __name__ == "__main__":
+    test_pruning()
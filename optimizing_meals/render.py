@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+RENDER - Meal plans written as Markdown, JSON Lines or CSV, one day at a time
+-----------------------------------------------------------------------------
+
+Each renderer is a generator that yields the text of a plan in chunks, one per day, so
+that long plans are written to a file as they are rendered instead of being built as
+one string. Prices and macros are read from the compiled catalog, and the meals of a
+day are found with array operations on its column of `x`.
+
+Examples
+--------
+>>> from data import meals
+>>> meal_list = list(meals.values())
+>>> x = [[0], [2], [0], [1.5], [0], [0], [0]]
+>>> for chunk in render_jsonl(x, meal_list):
+...     print(chunk, end="")
+{"day": 1, "price": 27.2, "meals": [{"name": "yogurt w/ muesli", "quantity": 2.0}, {"name": "hamburger", "quantity": 1.5}], "kcal": 955.8, "protein": 42.9, "fat": 37.6, "carbs": 105.9}
+"""
+import csv
+import functools
+import io
+import json
+
+import numpy as np
+
+from classes import MACROS, compile_catalog
+
+
+def render_markdown(x, meals, *, verbose=True):
+    """
+    Yield a meal plan as Markdown, one day at a time. The meals of a day are sorted by
+    their carbs, to get more carbohydrates earlier in the day. With `verbose`, the
+    totals of the macros are listed after the meals.
+    """
+    catalog, x = compile_catalog(meals), np.asarray(x, dtype=float)
+    yield "# Meal plan\n"
+    for day_num, (chosen, quantities) in enumerate(_days(catalog, x)):
+        price = int(np.sum(catalog["price"][chosen] * quantities))
+        lines = [f"\n## Day {day_num + 1} (price: {price} NOK)\n", "\n### Meals\n\n"]
+        for i, qnty in zip(chosen, quantities.tolist()):
+            qnty = round(qnty, 1)
+            if qnty % 1 == 0:
+                qnty = int(qnty)
+            lines.append(f"- {qnty} x {_label(catalog.meals[i])}\n")
+
+        if verbose:
+            lines.append("\n### Statistics\n\n")
+            for macro in MACROS:
+                macro_distr = catalog[macro][chosen] * quantities
+                macro_distr_r = np.round(macro_distr).astype(int).tolist()
+                total = int(round(macro_distr.sum()))
+                lines.append(f"- Total {macro}: {total} {macro_distr_r}\n")
+        yield "".join(lines)
+
+
+def render_jsonl(x, meals):
+    """
+    Yield a meal plan as JSON Lines, one line (a JSON object) per day, with the price,
+    the meals and their quantities, and the totals of the macros.
+    """
+    catalog, x = compile_catalog(meals), np.asarray(x, dtype=float)
+    for day_num, (chosen, quantities) in enumerate(_days(catalog, x)):
+        totals = catalog.matrix[chosen].T @ quantities
+        day = {"day": day_num + 1}
+        day["price"] = round(float(totals[catalog.attributes.index("price")]), 1)
+        day["meals"] = [
+            {"name": str(catalog.names[i]), "quantity": round(qnty, 3)}
+            for (i, qnty) in zip(chosen, quantities.tolist())
+        ]
+        for macro in MACROS:
+            day[macro] = round(float(totals[catalog.attributes.index(macro)]), 1)
+        yield json.dumps(day) + "\n"
+
+
+def render_csv(x, meals):
+    """
+    Yield a meal plan as CSV, with a header and then the rows of one day at a time. A
+    row is a meal in a day, with its quantity, price and macros.
+    """
+    catalog, x = compile_catalog(meals), np.asarray(x, dtype=float)
+    columns = ["price"] + list(MACROS)
+    indices = [catalog.attributes.index(column) for column in columns]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["day", "meal", "quantity"] + columns)
+    for day_num, (chosen, quantities) in enumerate(_days(catalog, x)):
+        values = catalog.matrix[np.ix_(chosen, indices)] * quantities[:, None]
+        for i, qnty, row in zip(chosen, quantities.tolist(), values.round(2).tolist()):
+            writer.writerow([day_num + 1, catalog.names[i], round(qnty, 3)] + row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if len(x) == 0 or x.shape[1] == 0:
+        yield buffer.getvalue()
+
+
+RENDERERS = {"markdown": render_markdown, "jsonl": render_jsonl, "csv": render_csv}
+
+
+def write_plan(x, meals, file, *, format="markdown", **kwargs):
+    """
+    Write a meal plan to a file-like object, in a format of `RENDERERS`. Keyword
+    arguments are passed on to the renderer.
+    """
+    for chunk in RENDERERS[format](x, meals, **kwargs):
+        file.write(chunk)
+
+
+def _days(catalog, x):
+    """Yield the meals chosen on each day and their quantities, sorted by carbs."""
+    carbs = catalog["carbs"]
+    for day in x.T:
+        chosen = np.flatnonzero(day > 0)
+        quantities = day[chosen]
+        order = np.argsort(-carbs[chosen] * quantities, kind="stable")
+        yield chosen[order], quantities[order]
+
+
+@functools.lru_cache(maxsize=4096)
+def _label(meal):
+    """The text of a meal, computed once per meal when rendering many plans."""
+    return str(meal)
+
+
+def test_renderers():
+    """Example: Rendering a plan in every format, to a file-like object."""
+
+    from data import meals
+
+    meal_list = list(meals.values())
+    x = np.zeros((len(meal_list), 3))
+    x[[1, 3, 4], 0] = [2, 1.5, 3]
+    x[[0, 5], 2] = [1, 0.25]
+
+    file = io.StringIO()
+    write_plan(x, meal_list, file, format="csv")
+    rows = list(csv.reader(io.StringIO(file.getvalue())))
+    assert rows[0][:3] == ["day", "meal", "quantity"]
+    assert [row[0] for row in rows[1:]] == ["1", "1", "1", "3", "3"]
+
+    lines = list(render_jsonl(x, meal_list))
+    assert len(lines) == 3 and json.loads(lines[1])["meals"] == []
+    day = json.loads(lines[0])
+    assert day["kcal"] == round(sum(meal_list[i].kcal * x[i, 0] for i in range(7)), 1)
+
+    # One chunk for the title, then one per day
+    chunks = list(render_markdown(x, meal_list))
+    assert len(chunks) == 4 and chunks[1].startswith("\n## Day 1")
+    assert "- 3 x Meal(name='egg'" in chunks[1]
+
+
+if __name__ == "__main__":
+    test_renderers()
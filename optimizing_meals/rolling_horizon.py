@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ROLLING HORIZON - Meal plans for many days, solved a few days at a time
+-----------------------------------------------------------------------
+
+The full model couples every day through the limits on how many times a meal may be
+used, and becomes slow to solve for long plans (90 to 365 days). Here the plan is
+solved in overlapping windows of days, in sequence. The first days of each window are
+kept, and the remaining usage budget of every meal is carried forward to the next
+window. The days in the overlap are solved again as part of the next window.
+"""
+
+import time
+
+import numpy as np
+
+from data import meals
+from classes import compile_catalog
+from plans import format_plan
+from optimizing_meals import optimize_mealplan, evaluate_mealplan
+
+# =============================================================================
+# FUNCTIONS - Used to generate the meal plan
+# =============================================================================
+
+
+def optimize_mealplan_rolling(
+    meals,
+    dietary_constraints,
+    *,
+    meals_limits=None,
+    params=None,
+    window_days=7,
+    overlap_days=2,
+    compare=False,
+):
+    """
+    Optimize a meal plan of `params["num_days"]` days in windows of `window_days`
+    days, where consecutive windows share `overlap_days` days. Returns (x, results_data)
+    like `optimize_mealplan`. The objective function value is that of the stitched
+    plan, evaluated over every day. The windows are solved separately, so the 'status'
+    is 'FEASIBLE', unless a single window covers every day and is solved to optimality.
+
+    If `compare` is True, the full model is also solved, starting from the stitched
+    plan, and `results_data` reports how far the stitched plan is from it. Both plans
+    are valued by `evaluate_mealplan`, so that they are compared in the same way. The
+    status of that solve is 'full_status', and the 'relative_gap' is None unless the
+    full solve was proven optimal, since otherwise it may just return the stitched plan.
+    """
+    assert 0 <= overlap_days < window_days
+    params = dict() if params is None else params.copy()
+    catalog = compile_catalog(meals)
+    num_days = params.get("num_days", 1)
+
+    if meals_limits is None:
+        meals_limits = [(None, None)] * len(catalog)
+    assert len(meals_limits) == len(catalog)
+
+    x = np.zeros((len(catalog), num_days))
+    used = [0] * len(catalog)
+    wall_time, iterations, nodes, windows = 0.0, 0, 0, 0
+    statuses = []
+
+    start = 0
+    while start < num_days:
+        end = min(start + window_days, num_days)
+        last_window = end == num_days
+        keep = (end - start) if last_window else (end - start - overlap_days)
+
+        # Carry the remaining budget of every meal forward. A lower limit only has to
+        # be met in this window if the days after it can't make up for it.
+        days_after = num_days - end
+        window_limits = []
+        for (low, high), times_used in zip(meals_limits, used):
+            if low is not None:
+                low = min(max(low - times_used - days_after, 0), end - start)
+            if high is not None:
+                high = max(high - times_used, 0)
+            window_limits.append((low, high))
+
+        window_params = dict(params, num_days=end - start)
+        x_window, results_window = optimize_mealplan(
+            meals=catalog,
+            dietary_constraints=dietary_constraints,
+            meals_limits=window_limits,
+            params=window_params,
+        )
+        if x_window is None:
+            raise RuntimeError(
+                f"No solution was found for days {start} to {end} within the time limit."
+            )
+
+        x_window = np.array(x_window)[:, :keep]
+        x[:, start : start + keep] = x_window
+        used = [u + int(n) for (u, n) in zip(used, (x_window > 0).sum(axis=1))]
+        wall_time += results_window["wall_time"]
+        iterations += results_window["iterations"]
+        nodes += results_window["nodes"]
+        statuses.append(results_window["status"])
+        windows += 1
+        start += keep
+
+    obj_func_value = evaluate_mealplan(x, catalog, dietary_constraints, params=params)
+    total_price = float(catalog["price"] @ x.sum(axis=1))
+    status = "OPTIMAL" if statuses == ["OPTIMAL"] else "FEASIBLE"
+    results_data = {
+        "status": status,
+        "obj_func_value": round(obj_func_value, 6),
+        "wall_time": round(wall_time, 3),
+        "iterations": iterations,
+        "total_price": round(total_price, 1),
+        "initial_solution_used": False,
+        "nodes": nodes,
+        "backend": results_window["backend"],
+        "windows": windows,
+    }
+
+    if compare:
+        start_time = time.perf_counter()
+        x_full, results_full = optimize_mealplan(
+            meals=catalog,
+            dietary_constraints=dietary_constraints,
+            meals_limits=meals_limits,
+            params=params,
+            initial_solution=x.tolist(),
+        )
+        full_value = None
+        if x_full is not None:
+            full_value = evaluate_mealplan(
+                x_full, catalog, dietary_constraints, params=params
+            )
+        results_data["full_obj_func_value"] = (
+            None if full_value is None else round(full_value, 6)
+        )
+        results_data["full_wall_time"] = round(time.perf_counter() - start_time, 3)
+        results_data["full_status"] = results_full["status"]
+        results_data["relative_gap"] = None
+        if results_full["status"] == "OPTIMAL":
+            results_data["relative_gap"] = round(
+                (obj_func_value - full_value) / max(abs(full_value), 1e-9), 6
+            )
+
+    return format_plan(x, params.get("output", "list")), results_data
+
+
+def test_rolling_horizon():
+    """Example: Optimizing meals for 10 days, in windows of 4 days."""
+
+    params = {"num_days": 10, "num_meals": 4, "time_limit_secs": 1}
+    dietary_constraints = {"kcal": (1800, 1800), "protein": (100, None)}
+    meal_list = list(meals.values())
+    meals_limits = [(None, 3)] + [(None, None) for meal in meal_list[1:]]
+
+    x, results_data = optimize_mealplan_rolling(
+        meals=meal_list,
+        dietary_constraints=dietary_constraints,
+        meals_limits=meals_limits,
+        params=params,
+        window_days=4,
+        overlap_days=1,
+        compare=True,
+    )
+
+    x = np.array(x)
+    assert x.shape == (len(meal_list), 10)
+    assert np.all((x > 0).sum(axis=0) == 4)
+    assert (x[0] > 0).sum() <= 3
+    assert results_data["windows"] == 3
+    assert results_data["status"] == "FEASIBLE"
+
+    # The gap is only known if the full model was solved to optimality
+    if results_data["full_status"] == "OPTIMAL":
+        assert results_data["relative_gap"] >= -1e-6
+    else:
+        assert results_data["relative_gap"] is None
+
+    # Two days are solved to optimality within the time limit
+    params = dict(params, num_days=2, time_limit_secs=30)
+    x, results_data = optimize_mealplan_rolling(
+        meals=meal_list,
+        dietary_constraints=dietary_constraints,
+        params=params,
+        window_days=1,
+        overlap_days=0,
+        compare=True,
+    )
+    assert results_data["full_status"] == "OPTIMAL"
+    assert results_data["relative_gap"] >= -1e-6
+
+    # A single window is the full model
+    x, results_data = optimize_mealplan_rolling(
+        meals=meal_list,
+        dietary_constraints=dietary_constraints,
+        params=params,
+        window_days=2,
+        overlap_days=0,
+    )
+    assert results_data["status"] == "OPTIMAL" and results_data["windows"] == 1
+
+
+if __name__ == "__main__":
+    test_rolling_horizon()
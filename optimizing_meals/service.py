@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SERVICE - Meal plans served over HTTP/JSON, solved in a pool of processes
+-------------------------------------------------------------------------
+
+An asyncio server answers POST requests to /mealplan, where the body is a JSON object
+with the keyword arguments of `optimize_mealplan` ('dietary_constraints', and
+optionally 'meals_limits', 'params', 'initial_solution' and 'availability') and an
+optional 'deadline_secs'. The catalog of meals is fixed when the service starts. The
+response is a JSON object with 'x' and 'results_data', where 'x' is a list of lists, so
+a 'params' with another 'output' is answered with 400 (Bad Request). GET /stats returns
+counters of the service.
+
+Solving is CPU-bound, so the solves run in a pool of `max_workers` processes, and at
+most `max_workers` problems are solved at once. Other requests wait in a queue of at
+most `max_queue` requests, and requests arriving when the queue is full are answered
+at once with 503 (Service Unavailable), so that clients can back off.
+
+Every request has a deadline. The time limit of its solve is cut to the time left, and
+a request that is not done by its deadline is answered with 504 (Gateway Timeout).
+Requests whose client disconnects are cancelled: if still queued they are never solved,
+and if already solving, the worker is freed when its time limit runs out. Should a
+worker process die, the requests it breaks are answered with 503, and the pool is
+replaced.
+
+    $ python service.py --port 8080 --workers 4
+    $ python load_test.py --port 8080 --requests 200 --concurrency 16
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import http
+import json
+import multiprocessing
+import os
+
+from data import meals
+from batch import new_pool, solve_problem
+
+# Requests finish a little after their deadline, since the result must be sent back
+DEADLINE_GRACE_SECS = 0.5
+
+
+class MealPlanService:
+    """
+    The state of the service: the process pool, the slots for solving, the queue and
+    the counters reported by GET /stats. Start it with `start`, and stop it with
+    `close`.
+    """
+
+    def __init__(
+        self, meals, *, max_workers=None, max_queue=64, default_deadline_secs=30
+    ):
+        self.meals = meals
+        self.max_workers = max_workers or os.cpu_count()
+        self.max_queue = max_queue
+        self.default_deadline_secs = default_deadline_secs
+        self.stats = dict.fromkeys(
+            ("completed", "failed", "rejected", "timed_out", "cancelled"), 0
+        )
+        self.queued = 0
+        self.running = 0
+        self._pool = None
+        self._futures = set()
+        self._slots = None
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=8080):
+        """Start the process pool and the server. Returns the port listened on."""
+        self._pool = self._new_pool()
+        await asyncio.wrap_future(self._pool.submit(int))
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+        for future in list(self._futures):
+            future.cancel()
+        self._pool.shutdown(wait=False)
+
+    def _new_pool(self):
+        """
+        A worker forked from this process would hold on to the sockets of the
+        connections open at that time, so that closing them wouldn't end them. Where
+        possible, workers are forked from a server process without any sockets.
+        """
+        methods = multiprocessing.get_all_start_methods()
+        method = "forkserver" if "forkserver" in methods else None
+        context = multiprocessing.get_context(method)
+        return new_pool(self.meals, self.max_workers, mp_context=context)
+
+    def _replace_pool(self, pool):
+        """Replace a broken pool, unless another request did already."""
+        if self._pool is pool:
+            pool.shutdown(wait=False)
+            self._pool = self._new_pool()
+
+    # =========================================================================
+    #     SOLVING
+    # =========================================================================
+
+    async def solve(self, problem):
+        """
+        Solve a problem in the process pool, waiting for a free worker first. Returns
+        (status code, response object).
+        """
+        loop = asyncio.get_running_loop()
+        deadline_secs = problem.pop("deadline_secs", self.default_deadline_secs)
+        deadline = loop.time() + deadline_secs
+
+        # Backpressure: answer at once instead of queueing without bound
+        if self._slots.locked() and self.queued >= self.max_queue:
+            self.stats["rejected"] += 1
+            return http.HTTPStatus.SERVICE_UNAVAILABLE, {"error": "The queue is full."}
+
+        # A free slot is taken at once, so that concurrent requests see it as taken
+        if self._slots.locked():
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                self.stats["timed_out"] += 1
+                return http.HTTPStatus.GATEWAY_TIMEOUT, {"error": "Deadline exceeded."}
+            finally:
+                self.queued -= 1
+        else:
+            await self._slots.acquire()
+
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            self._slots.release()
+            self.stats["timed_out"] += 1
+            return http.HTTPStatus.GATEWAY_TIMEOUT, {"error": "Deadline exceeded."}
+
+        # The slot is released when the worker is done, even if the request is not
+        params = dict(problem.get("params") or dict())
+        params["time_limit_secs"] = min(params.get("time_limit_secs", 10), remaining)
+        problem = dict(problem, params=params)
+        pool = self._pool
+        self.running += 1
+        submitted = False
+        try:
+            future = pool.submit(solve_problem, problem)
+            submitted = True
+        except concurrent.futures.process.BrokenProcessPool:
+            return self._broken(pool)
+        finally:
+            if not submitted:
+                self._release()
+        self._futures.add(future)
+        future.add_done_callback(
+            lambda future: loop.call_soon_threadsafe(self._release, future)
+        )
+
+        try:
+            result = await asyncio.wait_for(
+                asyncio.wrap_future(future), remaining + DEADLINE_GRACE_SECS
+            )
+        except asyncio.TimeoutError:
+            self.stats["timed_out"] += 1
+            return http.HTTPStatus.GATEWAY_TIMEOUT, {"error": "Deadline exceeded."}
+        except concurrent.futures.process.BrokenProcessPool:
+            return self._broken(pool)
+
+        if isinstance(result, Exception):
+            self.stats["failed"] += 1
+            return http.HTTPStatus.UNPROCESSABLE_ENTITY, {"error": repr(result)}
+        self.stats["completed"] += 1
+        x, results_data = result
+        return http.HTTPStatus.OK, {"x": x, "results_data": results_data}
+
+    def _release(self, future=None):
+        self._futures.discard(future)
+        self.running -= 1
+        self._slots.release()
+
+    def _broken(self, pool):
+        """A worker of `pool` died: replace the pool, and ask the client to retry."""
+        self._replace_pool(pool)
+        self.stats["failed"] += 1
+        error = "A worker process died, please retry."
+        return http.HTTPStatus.SERVICE_UNAVAILABLE, {"error": error}
+
+    # =========================================================================
+    #     HTTP
+    # =========================================================================
+
+    async def _handle(self, reader, writer):
+        """Answer a single request on a connection, then close it."""
+        try:
+            method, path, body = await _read_request(reader)
+            if method == "GET" and path == "/stats":
+                stats = dict(self.stats, queued=self.queued, running=self.running)
+                status, response = http.HTTPStatus.OK, stats
+            elif method == "POST" and path == "/mealplan":
+                status, response = await self._solve_or_cancel(reader, body)
+            else:
+                status, response = http.HTTPStatus.NOT_FOUND, {"error": "Not found."}
+        except (ValueError, KeyError) as exception:
+            status, response = http.HTTPStatus.BAD_REQUEST, {"error": str(exception)}
+        except (ConnectionError, asyncio.IncompleteReadError):
+            status = None
+        except Exception as exception:
+            error = {"error": repr(exception)}
+            status, response = http.HTTPStatus.INTERNAL_SERVER_ERROR, error
+
+        # A response that can't be sent as JSON is a failure of the service
+        if status is not None:
+            try:
+                data = _encode_response(status, response)
+            except Exception as exception:
+                if status == http.HTTPStatus.OK and "results_data" in response:
+                    self.stats["completed"] -= 1
+                    self.stats["failed"] += 1
+                error = {"error": repr(exception)}
+                status = http.HTTPStatus.INTERNAL_SERVER_ERROR
+                data = _encode_response(status, error)
+            writer.write(data)
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def _solve_or_cancel(self, reader, body):
+        """Solve the problem in the body, cancelling it if the client disconnects."""
+        problem = json.loads(body)
+        if not isinstance(problem, dict) or "dietary_constraints" not in problem:
+            raise ValueError("Expected a JSON object with 'dietary_constraints'.")
+        params = problem.get("params") or dict()
+        if not isinstance(params, dict):
+            raise ValueError("Expected 'params' to be a JSON object.")
+        if params.get("output", "list") != "list":
+            raise ValueError("Only the 'list' output can be sent as JSON.")
+
+        solving = asyncio.ensure_future(self.solve(problem))
+        disconnected = asyncio.ensure_future(reader.read(1))
+        await asyncio.wait((solving, disconnected), return_when=asyncio.FIRST_COMPLETED)
+        if solving.done():
+            disconnected.cancel()
+            return solving.result()
+
+        # The client sends nothing after the request, so the read ends on EOF
+        if disconnected.result():
+            return await solving
+        solving.cancel()
+        self.stats["cancelled"] += 1
+        raise ConnectionResetError("The client disconnected.")
+
+
+async def _read_request(reader):
+    """Read an HTTP/1.1 request, returning (method, path, body)."""
+    request_line = await reader.readline()
+    if not request_line:
+        raise ConnectionResetError("The client disconnected.")
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = dict()
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        key, value = line.split(":", 1)
+        headers[key.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    return method, path, body
+
+
+def _encode_response(status, response):
+    """Return an HTTP/1.1 response with the JSON object `response` as its body."""
+    body = json.dumps(response).encode()
+    head = (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+async def request(host, port, method, path, body=None):
+    """Send a request to the service, returning (status code, response object)."""
+    reader, writer = await asyncio.open_connection(host, port)
+    body = b"" if body is None else json.dumps(body).encode()
+    head = (
+        f"{method} {path} HTTP/1.1\r\n"
+        f"Host: {host}\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n"
+    )
+    writer.write(head.encode("latin-1") + body)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    while (await reader.readline()).strip():
+        pass
+    response = json.loads(await reader.read())
+    writer.close()
+    await writer.wait_closed()
+    return status, response
+
+
+async def serve(meals, host, port, **kwargs):
+    """Run the service until it's interrupted."""
+    service = MealPlanService(meals, **kwargs)
+    port = await service.start(host, port)
+    print(f"Serving meal plans on http://{host}:{port}/mealplan")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.close()
+
+
+def test_service():
+    """Example: Solving, rejecting and timing out requests to a local service."""
+
+    meal_list = list(meals.values())
+    problem = {
+        "dietary_constraints": {"kcal": [1800, 1800], "protein": [100, None]},
+        "params": {"num_days": 1, "num_meals": 4},
+    }
+    # Limits couple the days, so this problem takes a while to solve
+    slow_problem = {
+        "dietary_constraints": {"kcal": [1800, 1800], "protein": [100, None]},
+        "meals_limits": [[None, 3]] * len(meal_list),
+        "params": {"num_days": 7, "num_meals": 3, "time_limit_secs": 1},
+    }
+
+    async def run():
+        service = MealPlanService(meal_list, max_workers=1, max_queue=1)
+        port = await service.start(port=0)
+        try:
+            status, response = await request(
+                "127.0.0.1", port, "POST", "/mealplan", problem
+            )
+            assert status == 200 and len(response["x"]) == len(meal_list)
+
+            # One request is solved, one is queued, and the rest are turned away
+            statuses = await asyncio.gather(
+                *(
+                    request("127.0.0.1", port, "POST", "/mealplan", slow_problem)
+                    for i in range(4)
+                )
+            )
+            assert sorted(status for (status, _) in statuses)[:2] == [200, 200]
+            assert [status for (status, _) in statuses].count(503) == 2
+
+            late = dict(problem, deadline_secs=0)
+            status, response = await request(
+                "127.0.0.1", port, "POST", "/mealplan", late
+            )
+            assert status == 504
+
+            # Plans are sent as lists, since arrays can't be sent as JSON
+            as_array = dict(problem, params=dict(problem["params"], output="array"))
+            status, response = await request(
+                "127.0.0.1", port, "POST", "/mealplan", as_array
+            )
+            assert status == 400 and "'list' output" in response["error"]
+
+            status, stats = await request("127.0.0.1", port, "GET", "/stats")
+            assert stats["completed"] == 3 and stats["rejected"] == 2
+            assert stats["queued"] == stats["running"] == 0
+        finally:
+            await service.close()
+
+    asyncio.run(run())
+
+
+def test_broken_pool():
+    """Example: A worker process dies, and the service recovers."""
+
+    import signal
+
+    problem = {
+        "dietary_constraints": {"kcal": [1800, 1800]},
+        "params": {"num_days": 1, "num_meals": 4},
+    }
+
+    async def run():
+        service = MealPlanService(list(meals.values()), max_workers=1)
+        port = await service.start(port=0)
+        try:
+            for pid in list(service._pool._processes):
+                os.kill(pid, signal.SIGKILL)
+            await asyncio.sleep(0.5)
+
+            # The request that finds the pool broken is answered, and frees its slot
+            status, response = await request(
+                "127.0.0.1", port, "POST", "/mealplan", problem
+            )
+            assert status == 503
+            status, stats = await request("127.0.0.1", port, "GET", "/stats")
+            assert stats["failed"] == 1 and stats["running"] == 0
+
+            status, response = await request(
+                "127.0.0.1", port, "POST", "/mealplan", problem
+            )
+            assert status == 200
+        finally:
+            await service.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--deadline", type=float, default=30)
+    args = parser.parse_args()
+
+    asyncio.run(
+        serve(
+            list(meals.values()),
+            args.host,
+            args.port,
+            max_workers=args.workers,
+            max_queue=args.max_queue,
+            default_deadline_secs=args.deadline,
+        )
+    )